@@ -1,28 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import hmac
+import logging
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-import firebase_admin
-from firebase_admin import auth, credentials
-import os
+
+from .token_verifier import firebase_auth
+
+logger = logging.getLogger(__name__)
 
 auth_router = APIRouter()
 security = HTTPBearer()
 
-# Firebase Admin SDK初期化
-if not firebase_admin._apps:
-    cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-    if cred_path:
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
+# スケジューラ用エンドポイントの共有シークレット（未設定の場合はエンドポイントを無効にする）
+SCHEDULER_SECRET = os.getenv("SCHEDULER_SECRET", "")
 
 class UserResponse(BaseModel):
     uid: str
     email: str
     name: str
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
     try:
-        decoded_token = auth.verify_id_token(credentials.credentials)
+        # 検証済みトークンはキャッシュから返す（FirebaseTokenVerifierはlifespanで生成）
+        decoded_token = await request.app.state.token_verifier.verify(credentials.credentials)
         return decoded_token
     except Exception as e:
         raise HTTPException(
@@ -31,10 +38,32 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def verify_scheduler(x_scheduler_token: Optional[str] = Header(None)):
+    """スケジューラからの呼び出しか確認（X-Scheduler-TokenヘッダーがSCHEDULER_SECRETと一致すること）"""
+    if not SCHEDULER_SECRET or not x_scheduler_token or not hmac.compare_digest(
+        x_scheduler_token.encode("utf-8"), SCHEDULER_SECRET.encode("utf-8")
+    ):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Scheduler token required")
+
 @auth_router.post("/verify", response_model=UserResponse)
 async def verify_token(user = Depends(get_current_user)):
     return UserResponse(
         uid=user["uid"],
         email=user.get("email", ""),
         name=user.get("name", "")
-    )
\ No newline at end of file
+    )
+
+@auth_router.post("/logout", status_code=204)
+async def logout(request: Request, user = Depends(get_current_user)):
+    """ログアウト（リフレッシュトークンを失効させ、このインスタンスの検証済みトークンのキャッシュから破棄する）
+
+    他のインスタンスのキャッシュはAUTH_TOKEN_CACHE_TTL以内に切れる。発行済みのIDトークンを
+    有効期限前に拒否するには、AUTH_CHECK_REVOKED=trueで失効確認を有効にする。
+    """
+    try:
+        await asyncio.to_thread(lambda: firebase_auth().revoke_refresh_tokens(user["uid"]))
+    except Exception as e:
+        logger.error("Failed to revoke refresh tokens of user %s: %s", user["uid"], e)
+        raise HTTPException(status_code=503, detail="Failed to revoke tokens")
+    request.app.state.token_verifier.invalidate_user(user["uid"])
+    return Response(status_code=204)
@@ -0,0 +1,28 @@
+from fastapi import Request
+from services.firestore_service import FirestoreService
+from services.calendar_service import CalendarService
+from services.gemini_service import GeminiService
+from services.briefing_service import BriefingService
+from services.work_queue import CaptureWorkQueue
+from services.capture_index import CaptureIndex
+
+# サービスはlifespanでアプリ起動時に一度だけ生成し、app.stateから共有する
+
+def get_firestore_service(request: Request) -> FirestoreService:
+    return request.app.state.firestore_service
+
+def get_calendar_service(request: Request) -> CalendarService:
+    return request.app.state.calendar_service
+
+def get_gemini_service(request: Request) -> GeminiService:
+    return request.app.state.gemini_service
+
+def get_briefing_service(request: Request) -> BriefingService:
+    return request.app.state.briefing_service
+
+
+def get_work_queue(request: Request) -> CaptureWorkQueue:
+    return request.app.state.work_queue
+
+def get_capture_index(request: Request) -> CaptureIndex:
+    return request.app.state.capture_index
@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from datetime import datetime, timedelta
-from .auth import get_current_user
+from datetime import datetime
+from .auth import get_current_user, verify_scheduler
+from .responses import FastJSONResponse, dumps
+from .dependencies import get_calendar_service, get_firestore_service, get_briefing_service
 from services.calendar_service import CalendarService
-from services.gemini_service import GeminiService
+from services.gemini_service import GeminiServiceError
 from services.firestore_service import FirestoreService
+from services.briefing_service import BriefingService
+from services.briefing_scheduler import BriefingScheduler
 
 future_router = APIRouter()
 
@@ -28,11 +33,10 @@ class UpcomingEventsResponse(BaseModel):
 @future_router.get("/upcoming-events", response_model=UpcomingEventsResponse)
 async def get_upcoming_events(
     days_ahead: int = 7,
-    user = Depends(get_current_user)
+    user = Depends(get_current_user),
+    calendar_service: CalendarService = Depends(get_calendar_service)
 ):
     """今後の予定を取得"""
-    calendar_service = CalendarService()
-    
     events = await calendar_service.get_upcoming_events(
         user["uid"], 
         days_ahead=days_ahead
@@ -46,57 +50,100 @@ async def get_upcoming_events(
 @future_router.post("/generate-briefing", response_model=BriefingResponse)
 async def generate_briefing(
     request: BriefingRequest,
-    user = Depends(get_current_user)
+    user = Depends(get_current_user),
+    calendar_service: CalendarService = Depends(get_calendar_service),
+    briefing_service: BriefingService = Depends(get_briefing_service)
 ):
     """特定のイベントに対するブリーフィングを生成"""
-    calendar_service = CalendarService()
-    gemini_service = GeminiService()
-    firestore_service = FirestoreService()
-    
     # イベント詳細を取得
     event = await calendar_service.get_event(user["uid"], request.event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    # ブリーフィング生成
-    briefing_content = await gemini_service.generate_briefing(event)
+    # イベントが前回から変わっていなければ保存済みのものを返す
+    # （失敗時はエラー文を保存せず、再試行を促す）
+    try:
+        briefing = await briefing_service.get_or_generate(user["uid"], event)
+    except GeminiServiceError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
-    # 保存
-    briefing_data = {
-        "user_id": user["uid"],
-        "event_id": request.event_id,
-        "event_title": event["summary"],
-        "event_time": event["start"]["dateTime"],
-        "briefing_content": briefing_content,
-        "created_at": datetime.now()
-    }
+    return _briefing_response(briefing)
+
+@future_router.post("/generate-briefing/stream")
+async def generate_briefing_stream(
+    request: BriefingRequest,
+    user = Depends(get_current_user),
+    calendar_service: CalendarService = Depends(get_calendar_service),
+    briefing_service: BriefingService = Depends(get_briefing_service)
+):
+    """ブリーフィングを生成しながらServer-Sent Eventsで逐次返す"""
+    event = await calendar_service.get_event(user["uid"], request.event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
     
-    briefing_id = await firestore_service.save_briefing(briefing_data)
+    async def event_stream():
+        # 同じイベントの生成中のブリーフィングがあれば合流し、最初から配信する。
+        # クライアントが切断しても、合流している他の要求と保存のために生成は続ける
+        generation = briefing_service.start(user["uid"], event, stream=True)
+        try:
+            async for text in generation.tail():
+                yield _sse("token", {"text": text})
+            briefing = await generation.result()
+        except GeminiServiceError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        yield _sse("done", _briefing_response(briefing).model_dump(mode="json"))
     
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _sse(event: str, data: dict) -> bytes:
+    """Server-Sent Eventsの1イベント分のバイト列（トークンごとに呼ばれるためorjsonでシリアライズする）"""
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + dumps(data) + b"\n\n"
+
+def _briefing_response(briefing: dict) -> BriefingResponse:
     return BriefingResponse(
-        id=briefing_id,
-        event_id=request.event_id,
-        event_title=event["summary"],
-        event_time=datetime.fromisoformat(event["start"]["dateTime"]),
-        briefing_content=briefing_content,
-        created_at=briefing_data["created_at"]
+        id=briefing["id"],
+        event_id=briefing["event_id"],
+        event_title=briefing["event_title"],
+        event_time=briefing["event_time"],
+        briefing_content=briefing["briefing_content"],
+        created_at=briefing["created_at"]
     )
 
-@future_router.get("/briefings", response_model=List[BriefingResponse])
-async def get_briefings(user = Depends(get_current_user)):
-    """ユーザーのブリーフィング一覧を取得"""
-    firestore_service = FirestoreService()
+@future_router.get("/briefings", response_model=List[BriefingResponse], response_class=FastJSONResponse)
+async def get_briefings(
+    limit: int = Query(20, ge=1, le=100),
+    preview: bool = False,
+    user = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service)
+):
+    """ユーザーのブリーフィング一覧を取得（previewで本文を切り詰める）"""
+    briefings = await firestore_service.get_user_briefings(user["uid"], limit=limit, preview=preview)
     
-    briefings = await firestore_service.get_user_briefings(user["uid"])
+    # 一覧に必要なフィールドだけを読んでいるため、BriefingResponseでの再検証は行わない
+    return FastJSONResponse(briefings)
+
+@future_router.post("/precompute-briefings", dependencies=[Depends(verify_scheduler)])
+async def precompute_briefings(
+    hours_ahead: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    max_generations: Optional[int] = None,
+    calendar_service: CalendarService = Depends(get_calendar_service),
+    briefing_service: BriefingService = Depends(get_briefing_service),
+    firestore_service: FirestoreService = Depends(get_firestore_service)
+):
+    """スケジューラ用エンドポイント（直近の予定のブリーフィングを事前生成、X-Scheduler-Tokenが必要）"""
+    scheduler = BriefingScheduler(
+        calendar_service,
+        briefing_service,
+        firestore_service,
+        hours_ahead=hours_ahead,
+        concurrency=concurrency,
+        max_generations=max_generations
+    )
     
-    return [
-        BriefingResponse(
-            id=b["id"],
-            event_id=b["event_id"],
-            event_title=b["event_title"],
-            event_time=b["event_time"],
-            briefing_content=b["briefing_content"],
-            created_at=b["created_at"]
-        )
-        for b in briefings
-    ]
\ No newline at end of file
+    return await scheduler.run()
@@ -1,13 +1,88 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .auth import auth_router
+from .token_verifier import FirebaseTokenVerifier
 from .past_mode import past_router
 from .future_mode import future_router
+from .metrics import setup_metrics
+from services.firestore_service import FirestoreService
+from services.calendar_service import CalendarService
+from services.gemini_service import GeminiService
+from services.summary_cache import SummaryCache
+from services.page_fetcher import PageFetcher
+from services.briefing_service import BriefingService
+from services.work_queue import CaptureWorkQueue
+from services.embedding_service import EmbeddingService
+from services.capture_index import CaptureIndex
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+# URL取得ごとのリクエストログは多すぎるため抑制する
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+async def warm_up(app: FastAPI):
+    """重いSDKの読み込みと初期化を、起動完了後にスレッド上で済ませておく"""
+    services = (
+        app.state.token_verifier,
+        app.state.firestore_service,
+        app.state.calendar_service,
+        app.state.gemini_service,
+        app.state.embedding_service,
+    )
+    for service in services:
+        try:
+            await asyncio.to_thread(service.warm_up)
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", type(service).__name__, e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """外部サービスのクライアントを起動時に一度だけ生成し、全リクエストで共有する"""
+    app.state.token_verifier = FirebaseTokenVerifier()
+    await app.state.token_verifier.start()
+    app.state.firestore_service = FirestoreService()
+    app.state.work_queue = CaptureWorkQueue(app.state.firestore_service)
+    await app.state.work_queue.start()
+    app.state.calendar_service = CalendarService()
+    app.state.page_fetcher = PageFetcher()
+    app.state.gemini_service = GeminiService(
+        summary_cache=SummaryCache(app.state.firestore_service),
+        page_fetcher=app.state.page_fetcher
+    )
+    app.state.embedding_service = EmbeddingService()
+    app.state.capture_index = CaptureIndex(
+        app.state.firestore_service,
+        app.state.embedding_service
+    )
+    app.state.briefing_service = BriefingService(
+        app.state.gemini_service,
+        app.state.firestore_service,
+        capture_index=app.state.capture_index
+    )
+    # SDKの読み込みを待たずにリクエストを受け付け始める（Cloud Runのコールドスタート対策）
+    warm_up_task = None
+    if os.getenv("STARTUP_WARM_UP", "true").lower() == "true":
+        warm_up_task = asyncio.create_task(warm_up(app))
+    yield
+    if warm_up_task:
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+    await app.state.work_queue.aclose()
+    await app.state.page_fetcher.aclose()
+    await app.state.token_verifier.aclose()
 
 app = FastAPI(
     title="Janus AI Butler API",
     description="双貌のAI執事 - Past & Future Mode API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -18,6 +93,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+setup_metrics(app)
+
 app.include_router(auth_router, prefix="/auth", tags=["authentication"])
 app.include_router(past_router, prefix="/past", tags=["past-mode"])
 app.include_router(future_router, prefix="/future", tags=["future-mode"])
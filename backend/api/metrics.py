@@ -0,0 +1,136 @@
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from fastapi import FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from services.metrics import HTTP_REQUEST_SECONDS, start_trace
+
+logger = logging.getLogger(__name__)
+
+# この時間を超えたリクエストはspanの内訳をログに出す
+SLOW_REQUEST_SECONDS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "2000")) / 1000
+# レスポンスに処理段階ごとの所要時間（Server-Timingヘッダー）を付けるか
+# 内部の処理構成がクライアントに見えるため、既定では付けない（調査時にtrueにする）
+SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "false").lower() == "true"
+
+
+def _server_timing(spans: Dict[str, List[float]], total: float) -> str:
+    """段階ごとに集計したspanのServer-Timingヘッダーの値"""
+    entries = [
+        f'{stage};dur={elapsed * 1000:.1f};desc="x{count}"'
+        for stage, (elapsed, count) in spans.items()
+    ]
+    entries.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """ルート別のレイテンシを記録し、リクエストごとのトレースを開始するASGIミドルウェア
+
+    BaseHTTPMiddlewareを使わず、レスポンス開始時にヘッダーを足すだけにしてオーバーヘッドを抑える。
+    """
+
+    def __init__(self, app, fastapi_app: FastAPI):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self._route_paths: Dict[object, str] = {}
+
+    def _route_label(self, scope) -> str:
+        # 生のパスではなくパステンプレートをラベルにして、系列数が増えないようにする
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if not self._route_paths:
+            self._route_paths = {
+                route.endpoint: route.path for route in self.fastapi_app.routes if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        spans = start_trace()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    header = _server_timing(spans, time.perf_counter() - started)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = self._route_label(scope)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(elapsed)
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                logger.warning(
+                    "Slow request %s %s took %.0fms: %s",
+                    scope["method"], route, elapsed * 1000, _server_timing(spans, elapsed)
+                )
+
+
+class ServiceStatsCollector(Collector):
+    """app.stateのサービスが持つstats()を、スクレイプ時にゲージとして読み出す"""
+
+    # (app.stateの属性名, メトリクス名の接頭辞)
+    SOURCES = (
+        ("token_verifier", "auth_token_cache"),
+        ("calendar_service", "calendar"),
+        ("briefing_service", "briefing"),
+        ("capture_index", "capture_index"),
+        ("work_queue", "capture_queue"),
+    )
+
+    def __init__(self, app: FastAPI):
+        self.app = app
+
+    def _stats(self) -> Iterable[Tuple[str, Dict]]:
+        state = self.app.state
+        for attribute, prefix in self.SOURCES:
+            service = getattr(state, attribute, None)
+            if service is not None:
+                yield prefix, service.stats()
+        gemini_service = getattr(state, "gemini_service", None)
+        if gemini_service is not None:
+            yield "gemini_rate_limiter", gemini_service.rate_limiter.stats()
+            if gemini_service.summary_cache:
+                yield "summary_cache", gemini_service.summary_cache.stats()
+
+    def collect(self):
+        try:
+            sources = list(self._stats())
+        except Exception as e:
+            # 集計に失敗してもプロセス全体のメトリクスは返す
+            logger.warning("Failed to collect service stats: %s", e)
+            return
+        for prefix, stats in sources:
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    gauge = GaugeMetricFamily(f"janus_{prefix}_{key}", f"{prefix}.stats()['{key}']")
+                    gauge.add_metric([], value)
+                    yield gauge
+
+
+def setup_metrics(app: FastAPI):
+    """/metrics エンドポイントとミドルウェアを登録する"""
+    app.add_middleware(MetricsMiddleware, fastapi_app=app)
+    REGISTRY.register(ServiceStatsCollector(app))
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1,10 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
+import asyncio
+import hashlib
+import logging
+import os
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel, HttpUrl, ValidationError
+from typing import Any, List, Optional
 from datetime import datetime
 from .auth import get_current_user
+from .responses import FastJSONResponse, dumps
+from .dependencies import get_capture_index, get_firestore_service, get_gemini_service, get_work_queue
 from services.gemini_service import GeminiService
-from services.firestore_service import FirestoreService
+from services.firestore_service import CAPTURE_LIST_FIELDS, DIGEST_SIZE, FirestoreService, capture_preview
+from services.batch_processor import BatchProcessor
+from services.work_queue import CaptureWorkQueue, CaptureQueueWorker
+from services.batch_shards import ShardedBatchProcessor
+from services.capture_index import CaptureIndex
+
+logger = logging.getLogger(__name__)
 
 past_router = APIRouter()
 
@@ -21,18 +33,37 @@ class CaptureResponse(BaseModel):
     processed: bool
     summary: Optional[str] = None
 
+class BulkCaptureResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkCaptureResponse(BaseModel):
+    results: List[BulkCaptureResult]
+    created_count: int
+    failed_count: int
+
+class CaptureSearchResult(BaseModel):
+    capture: CaptureResponse
+    score: float
+
+class CaptureSearchResponse(BaseModel):
+    query: str
+    results: List[CaptureSearchResult]
+
 class DigestResponse(BaseModel):
     captures: List[CaptureResponse]
     generated_at: datetime
+    next_cursor: Optional[str] = None
 
 @past_router.post("/capture", response_model=CaptureResponse)
 async def capture_content(
     request: CaptureRequest,
-    user = Depends(get_current_user)
+    user = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    work_queue: CaptureWorkQueue = Depends(get_work_queue)
 ):
     """コンテンツをキャプチャして保存"""
-    firestore_service = FirestoreService()
-    
     capture_data = {
         "user_id": user["uid"],
         "type": request.type,
@@ -43,6 +74,11 @@ async def capture_content(
     }
     
     capture_id = await firestore_service.save_capture(capture_data)
+    try:
+        await work_queue.enqueue(user["uid"], capture_id)
+    except Exception as e:
+        # キューに積めなくても夜間バッチで処理される
+        logger.warning("Failed to enqueue capture %s: %s", capture_id, e)
     
     return CaptureResponse(
         id=capture_id,
@@ -52,41 +88,224 @@ async def capture_content(
         processed=False
     )
 
-@past_router.get("/digest", response_model=DigestResponse)
-async def get_digest(user = Depends(get_current_user)):
-    """処理済みのキャプチャを取得（朝のダイジェスト）"""
-    firestore_service = FirestoreService()
+# 一括キャプチャで受け付ける最大件数
+CAPTURE_BULK_MAX_ITEMS = int(os.getenv("CAPTURE_BULK_MAX_ITEMS", "500"))
+
+def _validation_summary(error: ValidationError) -> str:
+    """検証エラーの要約（入力値を含めない）"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'item'}: {detail['msg']}"
+        for detail in error.errors(include_input=False, include_url=False)
+    )
+
+@past_router.post("/capture/bulk", response_model=BulkCaptureResponse)
+async def capture_bulk(
+    captures: List[Any] = Body(..., embed=True),
+    user = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    work_queue: CaptureWorkQueue = Depends(get_work_queue)
+):
+    """複数のコンテンツをまとめてキャプチャして保存（インポート用）"""
+    if len(captures) > CAPTURE_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many captures: {len(captures)} (max {CAPTURE_BULK_MAX_ITEMS})"
+        )
     
-    captures = await firestore_service.get_processed_captures(user["uid"])
+    # 不正な項目があっても他の項目は保存できるよう、1件ずつ検証する
+    results = [BulkCaptureResult(index=index) for index in range(len(captures))]
+    valid = []
+    for index, item in enumerate(captures):
+        try:
+            request = CaptureRequest.model_validate(item)
+        except ValidationError as e:
+            # str(e)は入力値をそのまま含むため、項目の場所とメッセージだけを返す
+            results[index].error = _validation_summary(e)
+            continue
+        valid.append((index, {
+            "user_id": user["uid"],
+            "type": request.type,
+            "content": request.content,
+            "metadata": request.metadata or {},
+            "timestamp": datetime.now(),
+            "processed": False
+        }))
+    
+    saved = await firestore_service.save_captures([capture_data for _, capture_data in valid])
+    for (index, _), result in zip(valid, saved):
+        results[index].id = result["id"]
+        results[index].error = result["error"]
     
-    return DigestResponse(
-        captures=captures,
-        generated_at=datetime.now()
+    created = [(user["uid"], result.id) for result in results if result.id]
+    try:
+        await work_queue.enqueue_many(created)
+    except Exception as e:
+        # キューに積めなくても夜間バッチで処理される
+        logger.warning("Failed to enqueue %d bulk captures: %s", len(created), e)
+    
+    created_count = len(created)
+    return BulkCaptureResponse(
+        results=results,
+        created_count=created_count,
+        failed_count=len(results) - created_count
     )
 
+def _digest_etag(captures: List[dict]) -> str:
+    """ダイジェストの内容から強いETagを作る"""
+    return '"' + hashlib.sha256(dumps(captures, sort_keys=True)).hexdigest()[:32] + '"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+@past_router.get("/digest", response_model=DigestResponse, response_class=FastJSONResponse)
+async def get_digest(
+    cursor: Optional[str] = None,
+    limit: int = Query(DIGEST_SIZE, ge=1, le=100),
+    preview: bool = False,
+    if_none_match: Optional[str] = Header(None),
+    user = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service)
+):
+    """処理済みのキャプチャを取得（朝のダイジェスト、2ページ目以降はcursorで取得、previewで本文を切り詰める）"""
+    if cursor is None and limit <= DIGEST_SIZE:
+        # 1ページ目はバッチ処理が作っておいたダイジェストを1回の読み取りで返す
+        digest = await firestore_service.get_digest(user["uid"])
+        if digest is None:
+            digest = await firestore_service.refresh_digest(user["uid"])
+        captures = digest["captures"][:limit]
+        if preview:
+            captures = [capture_preview(capture) for capture in captures]
+        generated_at = digest["updated_at"]
+    else:
+        captures = await firestore_service.get_processed_captures(
+            user["uid"], limit=limit, cursor=cursor, preview=preview
+        )
+        generated_at = datetime.now()
+    
+    etag = _digest_etag(captures)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # 保存済みのフィールドをそのまま返し、DigestResponseでの再検証は行わない
+    return FastJSONResponse({
+        "captures": captures,
+        "generated_at": generated_at,
+        "next_cursor": captures[-1]["id"] if len(captures) == limit else None
+    }, headers=headers)
+
+@past_router.get("/search", response_model=CaptureSearchResponse, response_class=FastJSONResponse)
+async def search_captures(
+    q: str = Query(..., min_length=1, max_length=1000),
+    limit: int = Query(10, ge=1, le=50),
+    preview: bool = False,
+    user = Depends(get_current_user),
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    capture_index: CaptureIndex = Depends(get_capture_index)
+):
+    """意味的に近いキャプチャを検索（処理済みのキャプチャの要約が対象）"""
+    hits = await capture_index.search(user["uid"], q, k=limit)
+    captures = await asyncio.gather(*(
+        firestore_service.get_capture(user["uid"], capture_id, fields=CAPTURE_LIST_FIELDS)
+        for capture_id, _ in hits
+    ))
+    
+    results = []
+    for (_, score), capture in zip(hits, captures):
+        # インデックスにあっても削除済みのキャプチャは除く
+        if not capture:
+            continue
+        capture = {field: capture.get(field) for field in CAPTURE_LIST_FIELDS}
+        results.append({"capture": capture_preview(capture) if preview else capture, "score": score})
+    
+    return FastJSONResponse({"query": q, "results": results})
+
 @past_router.post("/process-batch")
-async def process_batch():
+async def process_batch(
+    concurrency: Optional[int] = None,
+    capture_timeout: Optional[float] = None,
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    capture_index: CaptureIndex = Depends(get_capture_index)
+):
     """バッチ処理用エンドポイント（夜間処理）"""
-    firestore_service = FirestoreService()
-    gemini_service = GeminiService()
+    processor = BatchProcessor(
+        firestore_service,
+        gemini_service,
+        concurrency=concurrency,
+        capture_timeout=capture_timeout,
+        capture_index=capture_index
+    )
     
-    unprocessed_captures = await firestore_service.get_unprocessed_captures()
+    return await processor.run()
+
+def batch_run_id(
+    run_id: Optional[str] = None,
+    x_cloudscheduler_scheduletime: Optional[str] = Header(None)
+) -> str:
+    """夜間処理の実行ID（呼び出し元の指定、なければCloud Schedulerの予定実行時刻）
     
-    processed_count = 0
-    for capture in unprocessed_captures:
-        try:
-            if capture["type"] == "url":
-                summary = await gemini_service.summarize_url(capture["content"])
-            elif capture["type"] == "text":
-                summary = await gemini_service.summarize_text(capture["content"])
-            else:
-                continue
-                
-            await firestore_service.update_capture_summary(capture["id"], summary)
-            processed_count += 1
-            
-        except Exception as e:
-            print(f"Error processing capture {capture['id']}: {e}")
-            continue
+    同じ実行の再試行や複数インスタンスからの呼び出しは同じIDになり、同じシャードのリースを共有する。
+    """
+    run_id = run_id or x_cloudscheduler_scheduletime
+    if not run_id:
+        raise HTTPException(status_code=400, detail="run_id is required")
+    return run_id
+
+@past_router.post("/process-shards")
+async def process_shards(
+    run_id: str = Depends(batch_run_id),
+    max_seconds: float = 3000,
+    concurrency: Optional[int] = None,
+    capture_timeout: Optional[float] = None,
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    capture_index: CaptureIndex = Depends(get_capture_index)
+):
+    """シャード分割した夜間処理（複数インスタンスから同時に呼び出して分担する）"""
+    processor = BatchProcessor(
+        firestore_service,
+        gemini_service,
+        concurrency=concurrency,
+        capture_timeout=capture_timeout,
+        capture_index=capture_index
+    )
+    sharded = ShardedBatchProcessor(processor, run_id=run_id)
+    
+    return await sharded.run(max_seconds)
+
+@past_router.get("/batch-progress")
+async def batch_progress(
+    run_id: str,
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+):
+    """シャード分割した夜間処理の進捗"""
+    processor = BatchProcessor(firestore_service, gemini_service)
+    sharded = ShardedBatchProcessor(processor, run_id=run_id)
+    
+    return await sharded.progress()
+
+@past_router.post("/process-queue")
+async def process_queue(
+    max_seconds: float = 240,
+    concurrency: Optional[int] = None,
+    capture_timeout: Optional[float] = None,
+    firestore_service: FirestoreService = Depends(get_firestore_service),
+    gemini_service: GeminiService = Depends(get_gemini_service),
+    capture_index: CaptureIndex = Depends(get_capture_index),
+    work_queue: CaptureWorkQueue = Depends(get_work_queue)
+):
+    """キュー処理用エンドポイント（Cloud Schedulerなどから定期的に呼び出す）"""
+    processor = BatchProcessor(
+        firestore_service,
+        gemini_service,
+        capture_timeout=capture_timeout,
+        capture_index=capture_index
+    )
+    worker = CaptureQueueWorker(work_queue, processor, concurrency=concurrency)
     
-    return {"processed_count": processed_count}
\ No newline at end of file
+    return await worker.run(max_seconds)
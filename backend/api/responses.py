@@ -0,0 +1,29 @@
+from datetime import date, datetime
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+def _default(value: Any) -> Any:
+    # FirestoreのDatetimeWithNanosecondsなど、datetimeのサブクラスはorjsonが直接扱えない
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any, sort_keys: bool = False) -> bytes:
+    """orjsonでJSONにする（sort_keys指定時はキー順を揃え、ETagの計算に使えるようにする）"""
+    option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class FastJSONResponse(ORJSONResponse):
+    """一覧系のレスポンス用（Pydanticでの再検証を省き、orjsonでそのままシリアライズする）
+
+    返す内容はFirestoreから読んだフィールドをそのまま並べたものなので、
+    response_modelはOpenAPIのスキーマとしてだけ使う。
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
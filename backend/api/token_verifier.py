@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from google.auth import jwt
+
+logger = logging.getLogger(__name__)
+
+# Firebase IDトークンの署名に使われるGoogleの公開鍵（X.509証明書）
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+_firebase_lock = threading.Lock()
+
+
+def firebase_auth():
+    """Firebase Admin SDKのauthモジュール（SDKの読み込みと初期化は初回呼び出し時に行う）"""
+    import firebase_admin
+    from firebase_admin import auth, credentials
+
+    with _firebase_lock:
+        if not firebase_admin._apps:
+            cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+            if cred_path:
+                cred = credentials.Certificate(cred_path)
+                firebase_admin.initialize_app(cred)
+    return auth
+
+
+class FirebaseTokenVerifier:
+    """検証済みIDトークンのキャッシュと、署名用公開鍵のバックグラウンド更新"""
+
+    def __init__(
+        self,
+        project_id: Optional[str] = None,
+        max_entries: Optional[int] = None,
+        max_ttl: Optional[float] = None,
+        check_revoked: Optional[bool] = None,
+    ):
+        self.project_id = project_id or os.getenv("GOOGLE_CLOUD_PROJECT")
+        self.max_entries = max_entries or int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+        self.check_revoked = (
+            check_revoked if check_revoked is not None
+            else os.getenv("AUTH_CHECK_REVOKED", "false").lower() == "true"
+        )
+        # 失効したトークンを使い続けられる時間の上限（失効確認を有効にしている場合はさらに短くする）
+        default_ttl = "60" if self.check_revoked else "300"
+        self.max_ttl = max_ttl or float(os.getenv("AUTH_TOKEN_CACHE_TTL", default_ttl))
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._certs: Dict[str, str] = {}
+        self._certs_expire_at = 0.0
+        self._certs_lock = asyncio.Lock()
+        self._client = httpx.AsyncClient(timeout=10.0)
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """公開鍵を先読みし、期限切れ前に更新し続けるタスクを開始"""
+        if self.project_id and not self.check_revoked:
+            self._refresher = asyncio.create_task(self._refresh_periodically())
+
+    async def aclose(self):
+        if self._refresher:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+        await self._client.aclose()
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """IDトークンを検証してデコード結果を返す（無効な場合は例外）"""
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.time()
+
+        entry = self._cache.get(key)
+        if entry:
+            expires_at, decoded = entry
+            if expires_at > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return decoded
+            del self._cache[key]
+        self.misses += 1
+
+        if self.project_id and not self.check_revoked:
+            decoded = await self._verify_locally(token)
+        else:
+            # 失効確認はFirebaseへの問い合わせが必要なため、SDKにスレッド上で任せる
+            decoded = await asyncio.to_thread(self._verify_with_sdk, token)
+
+        self._cache[key] = (min(decoded["exp"], now + self.max_ttl), decoded)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return decoded
+
+    def _verify_with_sdk(self, token: str) -> Dict[str, Any]:
+        return firebase_auth().verify_id_token(token, check_revoked=self.check_revoked)
+
+    def warm_up(self):
+        """起動後にスレッド上で呼び、SDKへの問い合わせを使う構成ではSDKを先に初期化しておく"""
+        if not (self.project_id and not self.check_revoked):
+            firebase_auth()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def invalidate_user(self, uid: str):
+        """ユーザーのキャッシュ済みトークンを破棄（ログアウト・トークン失効時に呼ぶ）"""
+        for key in [key for key, (_, decoded) in self._cache.items() if decoded.get("uid") == uid]:
+            del self._cache[key]
+
+    async def _verify_locally(self, token: str) -> Dict[str, Any]:
+        certs = await self._get_certs()
+        header = jwt.decode_header(token)
+        if header.get("kid") not in certs:
+            # 鍵のローテーション直後の可能性があるため、一度だけ取り直す
+            certs = await self._get_certs(force=True)
+
+        # 署名検証はCPU処理のため、イベントループの外で実行する
+        decoded = await asyncio.to_thread(jwt.decode, token, certs=certs, audience=self.project_id)
+
+        if decoded.get("iss") != f"https://securetoken.google.com/{self.project_id}":
+            raise ValueError("Invalid issuer")
+        subject = decoded.get("sub")
+        if not subject or len(subject) > 128:
+            raise ValueError("Invalid subject")
+        if decoded.get("auth_time", 0) > time.time():
+            raise ValueError("auth_time is in the future")
+
+        decoded["uid"] = subject
+        return decoded
+
+    async def _get_certs(self, force: bool = False) -> Dict[str, str]:
+        if not force and self._certs and self._certs_expire_at > time.time():
+            return self._certs
+        async with self._certs_lock:
+            if force or not self._certs or self._certs_expire_at <= time.time():
+                await self._fetch_certs()
+        return self._certs
+
+    async def _fetch_certs(self):
+        response = await self._client.get(FIREBASE_CERTS_URL)
+        response.raise_for_status()
+        match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+        self._certs = response.json()
+        self._certs_expire_at = time.time() + (int(match.group(1)) if match else 3600)
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self._get_certs(force=True)
+                # 有効期限の8割が過ぎた時点で更新し、リクエスト処理中に取得が発生しないようにする
+                delay = max(60.0, (self._certs_expire_at - time.time()) * 0.8)
+            except Exception as e:
+                logger.warning("Failed to refresh Firebase public keys: %s", e)
+                delay = 30.0
+            await asyncio.sleep(delay)
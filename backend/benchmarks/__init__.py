@@ -0,0 +1 @@
+# Janus AI Butler Benchmarks
\ No newline at end of file
@@ -0,0 +1,309 @@
+"""実際のルーターを代替実装（benchmarks/fakes.py）の上で動かすエンドツーエンドの性能ベンチマーク
+
+/past/capture・/past/digest・/past/search・/past/process-batch・/past/process-queue・/past/process-shards・
+/future/generate-briefing を指定した同時実行数で呼び出し、スループットとp50/p95/p99レイテンシを出力する。
+--check を付けると保存済みのベースライン（benchmarks/e2e_baseline.json）と比較し、許容幅を超えて悪化した
+シナリオがあれば終了コード1で終わる。
+
+使い方（backend/ で実行）:
+    python -m benchmarks.e2e_bench
+    python -m benchmarks.e2e_bench --check
+    python -m benchmarks.e2e_bench --update-baseline
+    python -m benchmarks.e2e_bench --error-rate 0.02   # エラー注入時の挙動を確認（ベースライン比較には使わない）
+
+1回の実行ではGCやスケジューリングの揺れが大きいため、--runs回（既定3回）実行した各指標の中央値を使う。
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from api.main import app
+from benchmarks.event_loop_latency import percentile
+from benchmarks.fakes import FaultConfig, fake_services, override_dependencies
+
+BASELINE_PATH = Path(__file__).parent / "e2e_baseline.json"
+
+USERS = [f"bench-user-{i}" for i in range(20)]
+
+# 数回のリクエストで多数のキャプチャを処理するシナリオ（p95が1〜2件のサンプルで決まるため、
+# スループットとエラー数だけをベースラインと比較する）
+THROUGHPUT_ONLY = {"process-batch", "process-queue", "process-shards"}
+
+
+async def drive(
+    name: str,
+    request: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+    client: httpx.AsyncClient,
+    requests: int,
+    concurrency: int,
+    prepare: Optional[Callable[[], Awaitable[None]]] = None,
+    count_items: Callable[[httpx.Response], int] = lambda response: 1,
+) -> Dict[str, float]:
+    """requests件のリクエストをconcurrency本のワーカーで送り、レイテンシとスループットを集計
+
+    prepareはリクエストごとに計測の外で実行する。スループットはcount_itemsで数えた処理件数で計算する。
+    """
+    # それまでに作ったデータ（メモリ上の代替Firestore）を世代別GCの対象から外す。
+    # 全体GCがそれを走査する停止時間が、たまたまGCが走ったシナリオのp95に乗らないようにする
+    gc.collect()
+    gc.freeze()
+
+    samples: List[float] = []
+    errors = 0
+    items = 0
+    prepare_seconds = 0.0
+    next_index = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, items, prepare_seconds
+        for index in next_index:
+            if prepare:
+                prepare_started = time.perf_counter()
+                await prepare()
+                prepare_seconds += time.perf_counter() - prepare_started
+            started = time.perf_counter()
+            response = await request(client, index)
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                items += count_items(response)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started - prepare_seconds / concurrency
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_per_second": round(items / elapsed, 2),
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+    }
+
+
+def capture_body(index: int) -> Dict[str, str]:
+    if index % 2:
+        return {"type": "url", "content": f"https://example.com/articles/{index}"}
+    return {"type": "text", "content": f"ベンチマーク用のメモ {index}。" * 20}
+
+
+async def seed_captures(services, count: int, offset: int) -> List[Tuple[str, str]]:
+    """未処理のキャプチャを直接書き込み、(ユーザーID, キャプチャID)を返す（offsetで内容を変え、要約キャッシュに当たらないようにする）"""
+    captures = []
+    for index in range(count):
+        captures.append({
+            "user_id": USERS[index % len(USERS)],
+            **capture_body(offset + index),
+            "metadata": {},
+            "timestamp": datetime.now(),
+            "processed": False,
+        })
+    results = await services.firestore_service.save_captures(captures)
+    return [(capture["user_id"], result["id"]) for capture, result in zip(captures, results) if not result["error"]]
+
+
+async def run_scenarios(args) -> List[Dict[str, float]]:
+    """各シナリオを新しい代替実装の上で、それぞれのseedで用意したデータに対して実行する
+
+    シナリオ間でデータを共有しないため、--onlyで一部だけ実行しても結果は変わらない。
+    """
+    rng = random.Random(args.seed)
+    services = None
+    seeded_batches = 0
+
+    async def seed_batch():
+        nonlocal seeded_batches
+        seeded_batches += 1
+        return await seed_captures(services, args.batch_captures, offset=1_000_000 * seeded_batches)
+
+    async def seed_queue():
+        await services.work_queue.enqueue_many(await seed_batch())
+
+    async def seed_processed(client):
+        # ダイジェスト・検索インデックス・ブリーフィングの関連キャプチャ用に、要約済みのキャプチャを用意する
+        await seed_captures(services, args.seed_captures, offset=0)
+        response = await client.post("/past/process-batch")
+        response.raise_for_status()
+
+    def user_headers(index: int) -> Dict[str, str]:
+        return {"X-Bench-User": USERS[index % len(USERS)]}
+
+    async def capture(client, index):
+        return await client.post("/past/capture", json=capture_body(index), headers=user_headers(index))
+
+    async def digest(client, index):
+        return await client.get("/past/digest", headers=user_headers(index))
+
+    async def search(client, index):
+        return await client.get("/past/search", params={"q": f"ベンチマーク用のメモ {index}"}, headers=user_headers(index))
+
+    async def process_batch(client, index):
+        return await client.post("/past/process-batch")
+
+    async def process_queue(client, index):
+        return await client.post("/past/process-queue")
+
+    async def process_shards(client, index):
+        return await client.post("/past/process-shards", params={"run_id": f"bench-{index}"})
+
+    async def generate_briefing(client, index):
+        # 一部のイベントには繰り返しリクエストが来る（保存済みブリーフィングの再利用を含めて計測する）
+        event_id = f"event-{rng.randrange(args.briefing_events)}"
+        return await client.post(
+            "/future/generate-briefing", json={"event_id": event_id}, headers=user_headers(index)
+        )
+
+    scale = args.scale
+    batch_requests = max(1, int(3 * scale))
+    # (名前, リクエスト, リクエスト数, 同時実行数, 計測前に1回実行するseed, driveのオプション)
+    scenarios = [
+        ("capture", capture, int(400 * scale), 16, None, {}),
+        ("process-batch", process_batch, batch_requests, 1, None, {
+            "prepare": seed_batch,
+            "count_items": lambda response: response.json()["processed_count"],
+        }),
+        ("process-queue", process_queue, batch_requests, 1, None, {
+            "prepare": seed_queue,
+            "count_items": lambda response: response.json()["processed_count"],
+        }),
+        ("process-shards", process_shards, batch_requests, 1, None, {
+            "prepare": seed_batch,
+            "count_items": lambda response: response.json()["progress"]["processed_count"],
+        }),
+        ("digest", digest, int(400 * scale), 32, seed_processed, {}),
+        ("search", search, int(400 * scale), 32, seed_processed, {}),
+        ("generate-briefing", generate_briefing, int(200 * scale), 16, seed_processed, {}),
+    ]
+
+    results = []
+    # 注入したエラーで落ちたリクエストは500として数える
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+        for name, request, requests, concurrency, seed, options in scenarios:
+            if args.only and name not in args.only:
+                continue
+            services = fake_services(FaultConfig(error_rate=args.error_rate, seed=args.seed))
+            override_dependencies(app, services)
+            seeded_batches = 0
+            if seed:
+                await seed(client)
+            results.append(await drive(name, request, client, requests, concurrency, **options))
+
+    app.dependency_overrides.clear()
+    return results
+
+
+def median_results(runs: List[List[Dict[str, float]]]) -> List[Dict[str, float]]:
+    """複数回の実行結果を、シナリオごとに各指標の中央値にまとめる（エラー数は最大値）"""
+    merged = []
+    for results in zip(*runs):
+        merged.append({
+            **results[0],
+            "errors": max(r["errors"] for r in results),
+            **{
+                key: round(statistics.median(r[key] for r in results), 2)
+                for key in ("throughput_per_second", "p50_ms", "p95_ms", "p99_ms")
+            },
+        })
+    return merged
+
+
+def print_results(results: List[Dict[str, float]]):
+    print(f"{'scenario':<20}{'req':>6}{'conc':>6}{'err':>5}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for r in results:
+        print(
+            f"{r['scenario']:<20}{r['requests']:>6}{r['concurrency']:>6}{r['errors']:>5}"
+            f"{r['throughput_per_second']:>10.1f}{r['p50_ms']:>9.1f}ms{r['p95_ms']:>8.1f}ms{r['p99_ms']:>8.1f}ms"
+        )
+
+
+def check_regressions(results: List[Dict[str, float]], baseline: Dict, tolerance: float) -> List[str]:
+    """ベースラインよりp95が(1+tolerance)倍を超えて遅い、またはスループットが(1-tolerance)倍を下回るシナリオ
+
+    THROUGHPUT_ONLYのシナリオはp95を比較しない。
+    """
+    expected = {r["scenario"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = expected.get(r["scenario"])
+        if not base:
+            continue
+        if r["scenario"] not in THROUGHPUT_ONLY and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p95 {r['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if r["throughput_per_second"] < base["throughput_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{r['scenario']}: throughput {r['throughput_per_second']}/s "
+                f"< baseline {base['throughput_per_second']}/s"
+            )
+        if r["errors"] > base["errors"]:
+            regressions.append(f"{r['scenario']}: {r['errors']} errors > baseline {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="各シナリオのリクエスト数の倍率")
+    parser.add_argument("--only", nargs="*", help="実行するシナリオ名")
+    parser.add_argument("--batch-captures", type=int, default=200)
+    parser.add_argument("--seed-captures", type=int, default=400, help="digest・search・generate-briefingの前に要約しておく件数")
+    parser.add_argument("--briefing-events", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=3, help="実行回数（各指標は中央値を使う）")
+    parser.add_argument("--check", action="store_true", help="ベースラインと比較し、悪化していれば失敗する")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        runs.append(asyncio.run(run_scenarios(args)))
+        print_results(runs[-1])
+    results = median_results(runs)
+    if args.runs > 1:
+        print(f"median of {args.runs} runs:")
+        print_results(results)
+
+    config = {
+        **asdict(FaultConfig(error_rate=args.error_rate, seed=args.seed)),
+        "scale": args.scale,
+        "runs": args.runs,
+        "batch_captures": args.batch_captures,
+        "seed_captures": args.seed_captures,
+    }
+    report = {"config": config, "results": results}
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    if args.update_baseline:
+        BASELINE_PATH.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Baseline written to {BASELINE_PATH}")
+
+    if args.check:
+        baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+        if baseline["config"] != report["config"]:
+            print("Warning: the baseline was recorded with a different configuration", file=sys.stderr)
+        regressions = check_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""ブリーフィング生成中でも /health と /past/digest のレイテンシが劣化しないことを確認する負荷テスト
+
+使い方（backend/ で実行）:
+    python -m benchmarks.event_loop_latency
+    python -m benchmarks.event_loop_latency --blocking   # 旧実装（同期呼び出し）を再現して比較
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List
+
+import httpx
+
+from api.auth import get_current_user
+from api.dependencies import get_briefing_service, get_calendar_service, get_firestore_service, get_gemini_service
+from api.main import app
+from services.briefing_service import BriefingService
+from services.gemini_service import GeminiService
+
+
+class FakeModel:
+    """Geminiの応答待ちを模したモデル（blocking=Trueで同期呼び出しを再現）"""
+
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def generate_content_async(self, prompt):
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(text="ブリーフィング")
+
+
+class FakeCalendarService:
+    async def get_event(self, user_id, event_id):
+        return {
+            "id": event_id,
+            "summary": "定例会議",
+            "description": "",
+            "start": {"dateTime": "2024-01-01T10:00:00"},
+            "end": {"dateTime": "2024-01-01T11:00:00"},
+            "attendees": [],
+        }
+
+
+class FakeFirestoreService:
+    async def save_briefing(self, briefing_data, briefing_id=None):
+        await asyncio.sleep(0.005)
+        return briefing_id or "bench-briefing-id"
+
+    async def get_briefing(self, user_id, briefing_id):
+        # 毎回生成させて負荷をかけるため、保存済みのものは返さない
+        await asyncio.sleep(0.005)
+        return None
+
+    async def get_processed_captures(self, user_id, limit=20, cursor=None):
+        await asyncio.sleep(0.005)
+        return []
+
+    async def get_digest(self, user_id):
+        await asyncio.sleep(0.005)
+        return {"captures": [], "updated_at": datetime.now(timezone.utc)}
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def probe(client: httpx.AsyncClient, path: str, requests: int) -> Dict[str, float]:
+    """指定パスへ順次リクエストを送りレイテンシ(ms)を集計"""
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get(path, headers={"Authorization": "Bearer bench"})
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"p50": percentile(samples, 50), "p99": percentile(samples, 99)}
+
+
+async def briefing_load(client: httpx.AsyncClient, stop: asyncio.Event, worker: int):
+    # イベントIDをワーカーごとに変え、同一リクエストとしてまとめられないようにする
+    while not stop.is_set():
+        await client.post(
+            "/future/generate-briefing",
+            json={"event_id": f"bench-event-{worker}"},
+            headers={"Authorization": "Bearer bench"},
+        )
+
+
+async def run(args):
+    gemini_service = GeminiService()
+    gemini_service.model = FakeModel(args.gemini_latency, args.blocking)
+    calendar_service = FakeCalendarService()
+    firestore_service = FakeFirestoreService()
+
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "bench-user"}
+    app.dependency_overrides[get_gemini_service] = lambda: gemini_service
+    app.dependency_overrides[get_calendar_service] = lambda: calendar_service
+    app.dependency_overrides[get_firestore_service] = lambda: firestore_service
+    briefing_service = BriefingService(gemini_service, firestore_service)
+    app.dependency_overrides[get_briefing_service] = lambda: briefing_service
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, load in (("idle", 0), ("under briefing load", args.briefing_workers)):
+            stop = asyncio.Event()
+            loaders = [asyncio.create_task(briefing_load(client, stop, i)) for i in range(load)]
+            await asyncio.sleep(0.1 if load else 0)
+            for path in ("/health", "/past/digest"):
+                result = await probe(client, path, args.requests)
+                print(f"{label:>20} {path:<14} p50={result['p50']:8.2f}ms p99={result['p99']:8.2f}ms")
+            stop.set()
+            await asyncio.gather(*loaders)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--briefing-workers", type=int, default=16)
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--blocking", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
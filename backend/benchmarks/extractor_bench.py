@@ -0,0 +1,77 @@
+"""HTML本文抽出エンジンの比較ベンチマーク
+
+benchmarks/corpus/ に保存したHTMLを各エンジンで繰り返し処理し、
+pages/sec・ピークメモリ増分・抽出後の推定トークン数を出力する。
+メモリはエンジンごとに別プロセスで計測する（lxmlのCメモリも含めるためru_maxrssを使用）。
+
+使い方（backend/ で実行）:
+    python -m benchmarks.extractor_bench
+    python -m benchmarks.extractor_bench --engines readability --rounds 200
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from services.content_extractor import EXTRACTORS, get_extractor
+from services.token_estimator import estimate_tokens
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+
+def load_corpus() -> List[str]:
+    return [path.read_text(encoding="utf-8") for path in sorted(CORPUS_DIR.glob("*.html"))]
+
+
+def measure(engine: str, rounds: int) -> Dict[str, float]:
+    """1エンジン分を計測（子プロセス内で実行される）"""
+    pages = load_corpus()
+    extractor = get_extractor(engine)
+    extractor.extract(pages[0])
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        texts = [extractor.extract(html) for html in pages]
+    elapsed = time.perf_counter() - started
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "engine": engine,
+        "pages_per_second": round(len(pages) * rounds / elapsed, 1),
+        "peak_memory_delta_kb": peak_rss - baseline_rss,
+        "tokens_per_page": round(sum(estimate_tokens(text) for text in texts) / len(pages), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=list(EXTRACTORS))
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.engines[0], args.rounds)))
+        return
+
+    print(f"corpus: {len(load_corpus())} pages from {CORPUS_DIR}")
+    print(f"{'engine':<14}{'pages/sec':>12}{'peak mem +KB':>14}{'tokens/page':>13}")
+    for engine in args.engines:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.extractor_bench", "--child", "--engines", engine, "--rounds", str(args.rounds)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output)
+        print(
+            f"{result['engine']:<14}{result['pages_per_second']:>12}"
+            f"{result['peak_memory_delta_kb']:>14}{result['tokens_per_page']:>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
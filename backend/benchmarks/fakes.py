@@ -0,0 +1,610 @@
+"""GCPを使わずに実際のルーターとサービスを動かすための、ローカルの代替実装
+
+Firestore・Calendar・Vertex AI・ページ取得をメモリ上の実装に置き換える。
+それぞれ呼び出しごとの遅延とエラー発生率を指定できる（FaultInjector）。
+FirestoreはAsyncClient相当のクライアントを差し替えるため、FirestoreService・SummaryWriter・
+SummaryCacheなどは本番と同じコードが動く（トランザクションは楽観的な競合検出のみ）。
+
+使い方:
+    services = fake_services(FaultConfig(gemini_latency=0.05))
+    override_dependencies(app, services)
+"""
+import asyncio
+import copy
+import functools
+import hashlib
+import json
+import random
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import Request
+from google.api_core import exceptions as google_exceptions
+
+from api.auth import get_current_user
+from api.dependencies import (
+    get_briefing_service,
+    get_capture_index,
+    get_calendar_service,
+    get_firestore_service,
+    get_gemini_service,
+    get_work_queue,
+)
+from services.briefing_service import BriefingService
+from services.capture_index import CaptureIndex
+from services.embedding_service import EmbeddingService
+from services.firestore_service import FirestoreService
+from services.gemini_service import GeminiService
+from services.rate_limiter import GeminiRateLimiter
+from services.summary_cache import SummaryCache
+from services.work_queue import CaptureWorkQueue
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+
+
+class FaultInjector:
+    """呼び出しごとに遅延を入れ、指定した確率でエラーを発生させる"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_factory: Callable[[], Exception] = lambda: google_exceptions.ServiceUnavailable("injected fault"),
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_factory = error_factory
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+
+    async def __call__(self):
+        self.calls += 1
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            raise self.error_factory()
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "errors": self.errors}
+
+
+# --- Firestore ---------------------------------------------------------------
+
+DocPath = Tuple[str, ...]
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocument", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str) -> Any:
+        return self._data[field]
+
+
+class FakeDocument:
+    def __init__(self, client: "FakeFirestoreClient", path: DocPath):
+        self._client = client
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def path(self) -> str:
+        return "/".join(self._path)
+
+    @property
+    def parent(self) -> "FakeCollection":
+        return FakeCollection(self._client, self._path[:-1])
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._client, self._path + (name,))
+
+    async def get(self, field_paths: Optional[List[str]] = None, transaction=None) -> FakeSnapshot:
+        await self._client.faults()
+        if transaction is not None:
+            transaction.record_read(self._path)
+        return self._client.snapshot(self._path, field_paths)
+
+    async def set(self, data: Dict[str, Any], merge: bool = False):
+        await self._client.faults()
+        self._client.apply_set(self._path, data, merge)
+
+    async def update(self, data: Dict[str, Any]):
+        await self._client.faults()
+        self._client.apply_update(self._path, data)
+
+    async def delete(self):
+        await self._client.faults()
+        self._client.apply_delete(self._path)
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeFirestoreClient", match: Callable[[DocPath], bool]):
+        self._client = client
+        self._match = match
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, bool]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Dict[str, Any]] = None
+        self._select: Optional[List[str]] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def where(self, field: str, op: str, value: Any) -> "FakeQuery":
+        query = self._copy()
+        query._filters.append((field, op, value))
+        return query
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        query = self._copy()
+        query._orders.append((field, direction == "DESCENDING"))
+        return query
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        query = self._copy()
+        query._select = list(field_paths)
+        return query
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def start_after(self, cursor) -> "FakeQuery":
+        query = self._copy()
+        if isinstance(cursor, FakeSnapshot):
+            query._start_after = {"__path__": cursor.reference._path, **cursor.to_dict()}
+        else:
+            query._start_after = dict(cursor)
+        return query
+
+    def _compare(self, a: Dict[str, Any], b: Dict[str, Any]) -> int:
+        for field, descending in self._orders + [("__path__", False)]:
+            if field not in a or field not in b or a[field] == b[field]:
+                continue
+            result = -1 if a[field] < b[field] else 1
+            return -result if descending else result
+        return 0
+
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for field, op, value in self._filters:
+            if field not in data:
+                return False
+            current = data[field]
+            if not {
+                "==": lambda: current == value,
+                "!=": lambda: current != value,
+                "<": lambda: current < value,
+                "<=": lambda: current <= value,
+                ">": lambda: current > value,
+                ">=": lambda: current >= value,
+                "in": lambda: current in value,
+            }[op]():
+                return False
+        # 並び替えに使うフィールドがないドキュメントは結果に含まれない
+        return all(field in data for field, _ in self._orders)
+
+    async def stream(self, transaction=None) -> AsyncIterator[FakeSnapshot]:
+        await self._client.faults()
+        rows = [
+            {"__path__": path, **data}
+            for path, data in self._client.docs.items()
+            if self._match(path) and self._matches(data)
+        ]
+        rows.sort(key=functools.cmp_to_key(self._compare))
+        if self._start_after is not None:
+            rows = [row for row in rows if self._compare(row, self._start_after) > 0]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for row in rows:
+            if transaction is not None:
+                transaction.record_read(row["__path__"])
+            yield self._client.snapshot(row["__path__"], self._select)
+
+    def count(self, alias: Optional[str] = None) -> "FakeAggregationQuery":
+        return FakeAggregationQuery(self, alias or "count")
+
+
+class FakeAggregationQuery:
+    """AsyncAggregationQueryの代替（件数の集計のみ）"""
+
+    def __init__(self, query: FakeQuery, alias: str):
+        self._query = query
+        self._alias = alias
+
+    async def get(self, transaction=None) -> List[List[SimpleNamespace]]:
+        count = len([snapshot async for snapshot in self._query.stream(transaction=transaction)])
+        return [[SimpleNamespace(alias=self._alias, value=count)]]
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client: "FakeFirestoreClient", path: DocPath):
+        super().__init__(client, lambda doc_path: doc_path[:-1] == path)
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self) -> Optional[FakeDocument]:
+        return FakeDocument(self._client, self._path[:-1]) if len(self._path) > 1 else None
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._client, self._path + (document_id or self._client.new_id(),))
+
+    async def list_documents(self) -> AsyncIterator[FakeDocument]:
+        # サブコレクションだけを持つ（ドキュメント本体のない）IDも返す
+        await self._client.faults()
+        depth = len(self._path)
+        ids = sorted({path[depth] for path in self._client.docs if len(path) > depth and path[:depth] == self._path})
+        for document_id in ids:
+            yield FakeDocument(self._client, self._path + (document_id,))
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestoreClient"):
+        self._client = client
+        self._writes: List[Callable[[], None]] = []
+
+    def set(self, reference: FakeDocument, data: Dict[str, Any], merge: bool = False):
+        self._writes.append(lambda: self._client.apply_set(reference._path, data, merge))
+
+    def update(self, reference: FakeDocument, data: Dict[str, Any]):
+        self._writes.append(lambda: self._client.apply_update(reference._path, data))
+
+    def delete(self, reference: FakeDocument):
+        self._writes.append(lambda: self._client.apply_delete(reference._path))
+
+    async def commit(self):
+        await self._client.faults()
+        self._apply()
+
+    def _apply(self):
+        # 全件成功か全件失敗にするため、途中で失敗したら書き込み前の状態に戻す
+        snapshot = dict(self._client.docs)
+        try:
+            for write in self._writes:
+                write()
+        except Exception:
+            self._client.docs = snapshot
+            raise
+
+
+class FakeTransaction(FakeWriteBatch):
+    """AsyncTransactionの代替（楽観的な同時実行制御）
+
+    トランザクション内で読んだドキュメントの版を記録し、コミット時に他から書き込まれていれば
+    Abortedにする（async_transactionalがAbortedを受けて関数ごと再試行する）。書き込みは
+    コミットまでバッファし、まとめて反映する。
+
+    async_transactionalが呼ぶ非公開のメソッド（_begin/_commit/_rollbackなど）は、
+    requirements.txtで固定したgoogle-cloud-firestoreに合わせている（tests/test_fakes.pyで確認する）。
+    """
+
+    def __init__(self, client: "FakeFirestoreClient", max_attempts: int = 5):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id: Optional[bytes] = None
+        self._read_versions: Dict[DocPath, int] = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def record_read(self, path: DocPath):
+        self._read_versions.setdefault(path, self._client.versions.get(path, 0))
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    async def _begin(self, retry_id: Optional[bytes] = None):
+        self._id = self._client.new_id().encode("utf-8")
+
+    async def _rollback(self):
+        self._clean_up()
+
+    async def _commit(self) -> List[Any]:
+        await self._client.faults()
+        try:
+            # 版の確認から反映までの間にawaitを挟まないため、他のコミットと混ざらない
+            for path, version in self._read_versions.items():
+                if self._client.versions.get(path, 0) != version:
+                    raise google_exceptions.Aborted(f"Document changed during transaction: {'/'.join(path)}")
+            self._apply()
+        finally:
+            self._clean_up()
+        return []
+
+
+class FakeFirestoreClient:
+    """firestore.AsyncClientのうち、このアプリが使う機能だけをメモリ上で実装したもの"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self.faults = faults or FaultInjector()
+        self.docs: Dict[DocPath, Dict[str, Any]] = {}
+        # ドキュメントごとの書き込み回数（トランザクションの競合検出に使う）
+        self.versions: Dict[DocPath, int] = {}
+        self._counter = 0
+
+    def new_id(self) -> str:
+        self._counter += 1
+        return f"auto-{self._counter:08d}"
+
+    def snapshot(self, path: DocPath, field_paths: Optional[List[str]] = None) -> FakeSnapshot:
+        data = self.docs.get(path)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeSnapshot(FakeDocument(self, path), data)
+
+    def apply_set(self, path: DocPath, data: Dict[str, Any], merge: bool):
+        data = copy.deepcopy(data)
+        if merge and path in self.docs:
+            data = {**self.docs[path], **data}
+        self.docs[path] = data
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+    def apply_update(self, path: DocPath, data: Dict[str, Any]):
+        if path not in self.docs:
+            raise google_exceptions.NotFound(f"No document to update: {'/'.join(path)}")
+        self.docs[path] = {**self.docs[path], **copy.deepcopy(data)}
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+    def apply_delete(self, path: DocPath):
+        if self.docs.pop(path, None) is not None:
+            self.versions[path] = self.versions.get(path, 0) + 1
+
+    def document(self, path: str) -> FakeDocument:
+        return FakeDocument(self, tuple(path.split("/")))
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, (name,))
+
+    def collection_group(self, name: str) -> FakeQuery:
+        return FakeQuery(self, lambda path: len(path) >= 2 and path[-2] == name)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts)
+
+
+# --- Calendar ----------------------------------------------------------------
+
+
+class FakeCalendarService:
+    """CalendarServiceの代替（ユーザーごとに今後の予定を決定的に生成する）"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None, events_per_user: int = 20):
+        self.faults = faults or FaultInjector()
+        self.events_per_user = events_per_user
+        self._base = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    def _event(self, event_id: str) -> Dict[str, Any]:
+        index = int(hashlib.sha256(event_id.encode("utf-8")).hexdigest()[:4], 16) % (self.events_per_user * 4)
+        start = self._base + timedelta(hours=index + 1)
+        return {
+            "id": event_id,
+            "summary": f"打ち合わせ {index}",
+            "description": "四半期の進捗確認と次のアクションの相談",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+            "location": "会議室A",
+            "created": self._base.isoformat(),
+            "updated": self._base.isoformat(),
+            "attendees": [
+                {"email": f"member{i}@example.com", "displayName": f"メンバー{i}", "responseStatus": "accepted"}
+                for i in range(3)
+            ],
+        }
+
+    async def get_upcoming_events(self, user_id: str, days_ahead: int = 7) -> List[Dict[str, Any]]:
+        await self.faults()
+        return [self._event(f"{user_id}-event-{i}") for i in range(self.events_per_user)]
+
+    async def get_event(self, user_id: str, event_id: str) -> Optional[Dict[str, Any]]:
+        await self.faults()
+        return self._event(event_id)
+
+    async def get_events_for_briefing(self, user_id: str, hours_ahead: int = 24) -> List[Dict[str, Any]]:
+        return await self.get_upcoming_events(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self.faults.stats()
+
+
+# --- Vertex AI ---------------------------------------------------------------
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int, output_tokens: int):
+        self.text = text
+        self._usage = {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"usage_metadata": dict(self._usage)}
+
+
+BATCH_ITEM = re.compile(r'<item id="(\d+)">\n(.*?)\n</item>', re.DOTALL)
+
+
+class FakeGenerativeModel:
+    """GenerativeModelの代替（プロンプト長に応じたトークン数を返す）"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None, stream_chunks: int = 8):
+        self.faults = faults or FaultInjector()
+        self.stream_chunks = stream_chunks
+
+    def _text(self, prompt: str) -> str:
+        items = BATCH_ITEM.findall(prompt)
+        if items:
+            # まとめて要約するプロンプトには項目ごとの要約をJSON配列で返す
+            return json.dumps(
+                [{"id": int(index), "summary": self._summary(item)} for index, item in items],
+                ensure_ascii=False,
+            )
+        return self._summary(prompt)
+
+    def _summary(self, content: str) -> str:
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:8]
+        return f"- 要点1（{digest}）\n- 要点2\n- 要点3"
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        await self.faults()
+        text = self._text(prompt)
+        prompt_tokens = len(prompt) // 4
+        if not stream:
+            return FakeResponse(text, prompt_tokens, len(text))
+
+        async def chunks():
+            size = max(1, len(text) // self.stream_chunks)
+            for start in range(0, len(text), size):
+                await asyncio.sleep(self.faults.latency / self.stream_chunks)
+                yield FakeResponse(text[start:start + size], prompt_tokens, len(text))
+
+        return chunks()
+
+
+class FakeEmbeddingModel:
+    """TextEmbeddingModelの代替（文字バイグラムのハッシュで、似たテキストが近くなるベクトルを返す）"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None, dimensions: int = 768):
+        self.faults = faults or FaultInjector()
+        self.dimensions = dimensions
+
+    def _values(self, text: str) -> List[float]:
+        values = [0.0] * self.dimensions
+        for start in range(len(text) - 1):
+            bucket = int(hashlib.md5(text[start:start + 2].encode("utf-8")).hexdigest()[:8], 16)
+            values[bucket % self.dimensions] += 1.0
+        return values
+
+    async def get_embeddings_async(self, inputs) -> List[SimpleNamespace]:
+        await self.faults()
+        return [SimpleNamespace(values=self._values(item.text)) for item in inputs]
+
+
+# --- ページ取得 ---------------------------------------------------------------
+
+
+class FakePageFetcher:
+    """PageFetcherの代替（benchmarks/corpus/ のHTMLをURLごとに決定的に返す）"""
+
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self.faults = faults or FaultInjector(
+            error_factory=lambda: httpx.ConnectError("injected fault")
+        )
+        self.pages = [path.read_text(encoding="utf-8") for path in sorted(CORPUS_DIR.glob("*.html"))]
+
+    async def fetch(self, url: str) -> Tuple[str, str]:
+        await self.faults()
+        index = int(hashlib.sha256(url.encode("utf-8")).hexdigest()[:4], 16) % len(self.pages)
+        return self.pages[index], "text/html"
+
+    async def aclose(self):
+        pass
+
+
+# --- 組み立て -----------------------------------------------------------------
+
+
+@dataclass
+class FaultConfig:
+    """各代替実装の1呼び出しあたりの遅延（秒）とエラー発生率"""
+
+    firestore_latency: float = 0.005
+    calendar_latency: float = 0.01
+    gemini_latency: float = 0.05
+    embedding_latency: float = 0.02
+    fetch_latency: float = 0.02
+    jitter_ratio: float = 0.2
+    error_rate: float = 0.0
+    seed: int = 0
+
+    def injector(self, latency: float, **kwargs) -> FaultInjector:
+        return FaultInjector(
+            latency=latency,
+            jitter=latency * self.jitter_ratio,
+            error_rate=self.error_rate,
+            seed=self.seed,
+            **kwargs,
+        )
+
+
+def fake_services(config: Optional[FaultConfig] = None) -> SimpleNamespace:
+    """lifespanと同じ組み合わせで、外部サービスだけを代替実装にしたサービス群を作る"""
+    config = config or FaultConfig()
+
+    firestore_service = FirestoreService()
+    firestore_service.db = FakeFirestoreClient(config.injector(config.firestore_latency))
+    calendar_service = FakeCalendarService(config.injector(config.calendar_latency))
+    page_fetcher = FakePageFetcher(config.injector(
+        config.fetch_latency, error_factory=lambda: httpx.ConnectError("injected fault")
+    ))
+    gemini_service = GeminiService(
+        summary_cache=SummaryCache(firestore_service),
+        page_fetcher=page_fetcher,
+        # 代替実装の性能を測るため、クォータ制限と再試行の待ち時間は実質無効にする
+        rate_limiter=GeminiRateLimiter(
+            requests_per_minute=1e9,
+            tokens_per_minute=1e12,
+            max_concurrency=64,
+            base_delay=0.01,
+            max_delay=0.1,
+        ),
+    )
+    gemini_service.model = FakeGenerativeModel(config.injector(config.gemini_latency))
+    embedding_service = EmbeddingService()
+    embedding_service.model = FakeEmbeddingModel(config.injector(config.embedding_latency))
+    capture_index = CaptureIndex(firestore_service, embedding_service)
+
+    return SimpleNamespace(
+        firestore_service=firestore_service,
+        work_queue=CaptureWorkQueue(firestore_service),
+        calendar_service=calendar_service,
+        page_fetcher=page_fetcher,
+        gemini_service=gemini_service,
+        embedding_service=embedding_service,
+        capture_index=capture_index,
+        briefing_service=BriefingService(gemini_service, firestore_service, capture_index=capture_index),
+    )
+
+
+def bench_user(request: Request) -> Dict[str, str]:
+    """認証の代わりに X-Bench-User ヘッダーのユーザーとして扱う"""
+    return {"uid": request.headers.get("x-bench-user", "bench-user")}
+
+
+def override_dependencies(app, services: SimpleNamespace):
+    app.dependency_overrides[get_current_user] = bench_user
+    app.dependency_overrides[get_firestore_service] = lambda: services.firestore_service
+    app.dependency_overrides[get_work_queue] = lambda: services.work_queue
+    app.dependency_overrides[get_calendar_service] = lambda: services.calendar_service
+    app.dependency_overrides[get_gemini_service] = lambda: services.gemini_service
+    app.dependency_overrides[get_briefing_service] = lambda: services.briefing_service
+    app.dependency_overrides[get_capture_index] = lambda: services.capture_index
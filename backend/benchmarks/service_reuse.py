@@ -0,0 +1,52 @@
+"""サービスをリクエストごとに生成する場合と、lifespanで共有する場合のレイテンシ比較
+
+実際のGCP環境変数（GOOGLE_CLOUD_PROJECT, GOOGLE_APPLICATION_CREDENTIALS）を設定した上で実行する。
+
+使い方（backend/ で実行）:
+    python -m benchmarks.service_reuse --user-id <uid> --iterations 50
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable, List
+
+from benchmarks.event_loop_latency import percentile
+from services.calendar_service import CalendarService
+from services.firestore_service import FirestoreService
+from services.gemini_service import GeminiService
+
+
+async def measure(label: str, make_services: Callable, user_id: str, iterations: int):
+    """1リクエスト相当（サービス取得 + ダイジェスト読み取り + Calendar読み取り）の所要時間を計測"""
+    samples: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        firestore_service, calendar_service, _ = make_services()
+        await firestore_service.get_digest(user_id)
+        await calendar_service.get_upcoming_events(user_id, days_ahead=1)
+        samples.append((time.perf_counter() - started) * 1000)
+    print(
+        f"{label:<16} p50={percentile(samples, 50):8.2f}ms "
+        f"p99={percentile(samples, 99):8.2f}ms mean={sum(samples) / len(samples):8.2f}ms"
+    )
+
+
+async def run(args):
+    def per_request():
+        return FirestoreService(), CalendarService(), GeminiService()
+
+    shared = per_request()
+
+    await measure("per-request", per_request, args.user_id, args.iterations)
+    await measure("app-scoped", lambda: shared, args.user_id, args.iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--iterations", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
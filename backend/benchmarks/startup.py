@@ -0,0 +1,99 @@
+"""コールドスタートの計測（api.mainのインポート時間と、プロセス起動から最初の /health 応答までの時間）
+
+毎回新しいプロセスで計測するため、インポート済みモジュールのキャッシュは効かない。
+
+使い方（backend/ で実行）:
+    python -m benchmarks.startup --iterations 5
+    python -m benchmarks.startup --importtime   # インポートに時間がかかっているモジュールを表示
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import time
+from typing import List
+
+import httpx
+
+from benchmarks.event_loop_latency import percentile
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import api.main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def measure_first_health(timeout: float) -> float:
+    """uvicornを起動し、/health が200を返すまでの時間(ms)を計測"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - started < timeout:
+                try:
+                    if client.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                        return (time.perf_counter() - started) * 1000
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise TimeoutError(f"/health did not respond within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def show_importtime(top: int):
+    """-X importtime の結果から、累積時間の大きいトップレベルのモジュールを表示"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.main"], capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # インデントの浅いもの（直接importされたパッケージ）だけを対象にする
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append((int(cumulative) / 1000, name.strip()))
+    for cumulative_ms, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_ms:8.1f}ms  {name}")
+
+
+def summarize(label: str, samples: List[float]):
+    print(
+        f"{label:<20} p50={percentile(samples, 50):8.1f}ms "
+        f"max={max(samples):8.1f}ms min={min(samples):8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    summarize("import api.main", [measure_import() for _ in range(args.iterations)])
+    summarize("first /health", [measure_first_health(args.timeout) for _ in range(args.iterations)])
+    if args.importtime:
+        show_importtime(args.top)
+
+
+if __name__ == "__main__":
+    main()
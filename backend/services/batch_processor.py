@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.metrics import BATCH_CAPTURES, BATCH_QUEUE_DEPTH, span
+from services.summary_writer import SummaryWriter
+from services.text_batcher import TextSummaryBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class BatchProcessor:
+    """未処理キャプチャを並列ワーカーで要約するパイプライン"""
+
+    def __init__(
+        self,
+        firestore_service,
+        gemini_service,
+        concurrency: Optional[int] = None,
+        capture_timeout: Optional[float] = None,
+        capture_index=None,
+    ):
+        self.firestore_service = firestore_service
+        self.gemini_service = gemini_service
+        self.capture_index = capture_index
+        self.concurrency = concurrency or int(os.getenv("BATCH_CONCURRENCY", "32"))
+        self.capture_timeout = capture_timeout or float(os.getenv("BATCH_CAPTURE_TIMEOUT", "60"))
+        self.digest_concurrency = int(os.getenv("DIGEST_REFRESH_CONCURRENCY", "8"))
+        # 短いテキストは複数件を1回のGemini呼び出しで要約する
+        self.text_batcher = (
+            TextSummaryBatcher(gemini_service)
+            if os.getenv("TEXT_BATCH_ENABLED", "true").lower() == "true" else None
+        )
+
+    async def run(self) -> Dict[str, Any]:
+        """キャプチャをキューに流し込み、ワーカーで並列処理する"""
+        started_at = time.monotonic()
+        counts = Counter()
+
+        async with SummaryWriter(self.firestore_service) as writer:
+            async with self.worker_pool(counts, writer) as queue:
+                # キューが満杯になると取得側が待つため、未処理分を全件メモリに載せない
+                async for capture in self.firestore_service.iter_unprocessed_captures():
+                    await queue.put(capture)
+                    BATCH_QUEUE_DEPTH.set(queue.qsize())
+                await queue.join()
+        await self.after_write(writer.take_written())
+
+        return self.report(counts, writer, time.monotonic() - started_at)
+
+    @asynccontextmanager
+    async def worker_pool(self, counts: Counter, writer: SummaryWriter) -> AsyncIterator[asyncio.Queue]:
+        """並列ワーカーを起動し、キャプチャを投入するキューを返す"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        # まとめて要約するテキストはワーカーを塞がないよう別タスクで待つ（同時に待つ件数は2バッチ分まで）
+        batched_slots = asyncio.Semaphore(self.text_batcher.max_items * 2 if self.text_batcher else 0)
+        batched: Set[asyncio.Task] = set()
+        workers = [
+            asyncio.create_task(self._worker(queue, counts, writer, batched_slots, batched))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            yield queue
+        finally:
+            for task in [*workers, *batched]:
+                task.cancel()
+            await asyncio.gather(*workers, *batched, return_exceptions=True)
+
+    async def after_write(self, written: Iterable[Tuple[str, str, str]]):
+        """書き込んだ要約を検索インデックスに追加し、対象ユーザーのダイジェストを作り直す"""
+        by_user: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for user_id, capture_id, summary in written:
+            by_user[user_id].append((capture_id, summary))
+        if self.capture_index:
+            await self.index_summaries(by_user)
+        await self.refresh_digests(by_user)
+
+    async def index_summaries(self, by_user: Dict[str, List[Tuple[str, str]]]):
+        """ユーザーごとに要約を埋め込み、検索インデックスに追加する"""
+        semaphore = asyncio.Semaphore(self.digest_concurrency)
+
+        async def index(user_id, items):
+            async with semaphore:
+                try:
+                    await self.capture_index.add(user_id, items)
+                except Exception as e:
+                    # 検索・ブリーフィングの関連情報に出ないだけなので、処理は続ける
+                    logger.warning("Failed to index %d captures for user %s: %s", len(items), user_id, e)
+
+        await asyncio.gather(*(index(user_id, items) for user_id, items in by_user.items()))
+
+    async def refresh_digests(self, user_ids: Iterable[str]):
+        """要約を書き込んだユーザーのダイジェストを作り直す"""
+        semaphore = asyncio.Semaphore(self.digest_concurrency)
+
+        async def refresh(user_id):
+            async with semaphore:
+                try:
+                    with span("digest_refresh"):
+                        await self.firestore_service.refresh_digest(user_id)
+                except Exception as e:
+                    # 次回の書き込み時、またはダイジェスト取得時に作り直される
+                    logger.warning("Failed to refresh digest for user %s: %s", user_id, e)
+
+        await asyncio.gather(*(refresh(user_id) for user_id in user_ids))
+
+    def report(self, counts: Counter, writer: SummaryWriter, elapsed: float) -> Dict[str, Any]:
+        """処理件数・書き込み結果・スループットをまとめる"""
+        write_report = writer.report()
+        processed_count = counts["processed"] - write_report["write_failed_count"]
+        result = {
+            "processed_count": processed_count,
+            "failed_count": counts["failed"],
+            "timeout_count": counts["timeout"],
+            "skipped_count": counts["skipped"],
+            **write_report,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_per_second": round(processed_count / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        if self.gemini_service.summary_cache:
+            result["summary_cache"] = self.gemini_service.summary_cache.stats()
+        result["gemini_rate_limiter"] = self.gemini_service.rate_limiter.stats()
+        if self.text_batcher:
+            result["text_batches"] = self.text_batcher.stats()
+        return result
+
+    async def _worker(
+        self,
+        queue: asyncio.Queue,
+        counts: Counter,
+        writer: SummaryWriter,
+        batched_slots: asyncio.Semaphore,
+        batched: Set[asyncio.Task],
+    ):
+        while True:
+            capture = await queue.get()
+            if self.batchable(capture):
+                await batched_slots.acquire()
+                task = asyncio.create_task(self._process_queued(capture, queue, counts, writer))
+                batched.add(task)
+                task.add_done_callback(batched.discard)
+                task.add_done_callback(lambda _: batched_slots.release())
+                continue
+            await self._process_queued(capture, queue, counts, writer)
+
+    async def _process_queued(self, capture: Dict[str, Any], queue: asyncio.Queue, counts: Counter, writer: SummaryWriter):
+        try:
+            outcome = await self.process_capture(capture, writer)
+            counts[outcome] += 1
+            BATCH_CAPTURES.labels("batch", outcome).inc()
+        finally:
+            queue.task_done()
+
+    def batchable(self, capture: Dict[str, Any]) -> bool:
+        """他のキャプチャとまとめて要約する短いテキストか"""
+        return (
+            capture["type"] == "text"
+            and self.text_batcher is not None
+            and self.text_batcher.accepts(capture["content"])
+        )
+
+    async def summarize_capture(self, capture: Dict[str, Any]) -> Optional[str]:
+        """キャプチャの種類に応じて要約する（要約対象外の種類はNone）"""
+        if capture["type"] == "url":
+            summarize = self.gemini_service.summarize_url(capture["content"])
+        elif self.batchable(capture):
+            summarize = self.text_batcher.summarize(capture["content"])
+        elif capture["type"] == "text":
+            summarize = self.gemini_service.summarize_text(capture["content"])
+        else:
+            return None
+
+        return await asyncio.wait_for(summarize, timeout=self.capture_timeout)
+
+    async def process_capture(self, capture: Dict[str, Any], writer: SummaryWriter) -> str:
+        """1件のキャプチャを要約して保存し、結果の種別を返す"""
+        try:
+            with span("batch_capture"):
+                summary = await self.summarize_capture(capture)
+            if summary is None:
+                return "skipped"
+            await writer.add(capture["user_id"], capture["id"], summary)
+        except asyncio.TimeoutError:
+            logger.warning("Timeout processing capture %s after %ss", capture["id"], self.capture_timeout)
+            return "timeout"
+        except Exception as e:
+            logger.error("Error processing capture %s: %s", capture["id"], e)
+            return "failed"
+
+        return "processed"
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from services.firestore_service import CAPTURE_SHARD_COUNT
+from services.metrics import BATCH_QUEUE_DEPTH
+from services.summary_writer import SummaryWriter
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+COUNT_KEYS = ("processed_count", "failed_count", "timeout_count", "skipped_count", "write_failed_count")
+
+
+class ShardLeaseLost(Exception):
+    """シャードのリースが他のインスタンスに移った"""
+
+
+class ShardedBatchProcessor:
+    """夜間バッチをユーザーIDのハッシュ範囲でシャードに分け、複数インスタンスで分担する
+
+    シャード番号はキャプチャの作成時に"shard"フィールドとして書き込まれており、各シャードは
+    そのシャードの未処理キャプチャを1つのcollection groupクエリで取得する。各インスタンスは
+    Firestoreのリースドキュメントでシャードを取得し、最後に処理し終えたキャプチャを
+    チェックポイントとして記録する。リースが切れたシャードは別のインスタンスが途中から再開する。
+
+    シャード番号を持たないキャプチャ（導入前に作成されたもの）や、別のBATCH_SHARD_COUNTで
+    書き込まれて範囲外の番号を持つキャプチャは、最後の番号の掃除用シャード（sweep_shard）が拾う。
+    run_idは実行ごとのリースドキュメントを分けるため、呼び出し元（スケジューラ）が指定する。
+    """
+
+    COLLECTION = "batch_shards"
+
+    def __init__(
+        self,
+        batch_processor,
+        run_id: str,
+        lease_seconds: Optional[float] = None,
+        checkpoint_interval: Optional[float] = None,
+    ):
+        self.batch_processor = batch_processor
+        self.firestore_service = batch_processor.firestore_service
+        self.run_id = run_id
+        # キャプチャに書き込まれたシャード番号と揃える必要があるため、実行ごとには変えられない
+        self.shard_count = CAPTURE_SHARD_COUNT
+        self.sweep_shard = self.shard_count
+        self.lease_seconds = lease_seconds or float(os.getenv("BATCH_SHARD_LEASE_SECONDS", "120"))
+        self.checkpoint_interval = checkpoint_interval or float(os.getenv("BATCH_CHECKPOINT_INTERVAL", "10"))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    @property
+    def db(self):
+        return self.firestore_service.db
+
+    def _ref(self, shard: int):
+        return self.db.collection(self.COLLECTION).document(f"{self.run_id}-{shard:04d}")
+
+    async def run(self, max_seconds: float) -> Dict[str, Any]:
+        """取得できるシャードがなくなるか、max_secondsが経過するまでシャードを処理する"""
+        started_at = time.monotonic()
+        deadline = started_at + max_seconds
+        completed: List[int] = []
+        released: List[int] = []
+
+        if self.db:
+            shards = list(range(self.shard_count + 1))
+            # インスタンスごとに取得を試みる順番を変えて、リースの競合を減らす
+            random.shuffle(shards)
+            for shard in shards:
+                if time.monotonic() >= deadline:
+                    break
+                lease = await self._claim(shard)
+                if lease is None:
+                    continue
+                try:
+                    finished = await self._process_shard(shard, lease, deadline)
+                except ShardLeaseLost:
+                    logger.warning("Lost lease on shard %d of run %s", shard, self.run_id)
+                    continue
+                (completed if finished else released).append(shard)
+
+        return {
+            "run_id": self.run_id,
+            "worker_id": self.worker_id,
+            "completed_shards": completed,
+            "released_shards": released,
+            "elapsed_seconds": round(time.monotonic() - started_at, 3),
+            "progress": await self.progress(),
+        }
+
+    async def _claim(self, shard: int) -> Optional[Dict[str, Any]]:
+        from google.cloud import firestore
+
+        ref = self._ref(shard)
+
+        @firestore.async_transactional
+        async def claim_in_transaction(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            data = snapshot.to_dict() if snapshot.exists else {
+                "run_id": self.run_id,
+                "shard": shard,
+                "shard_count": self.shard_count,
+                "status": PENDING,
+                "last_capture_path": None,
+                **{key: 0 for key in COUNT_KEYS},
+            }
+            if data["status"] == DONE:
+                return None
+            if data["status"] == LEASED and data["lease_expires_at"] > now:
+                return None
+            data.update({
+                "status": LEASED,
+                "lease_owner": self.worker_id,
+                "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                "updated_at": now,
+            })
+            transaction.set(ref, data)
+            return data
+
+        try:
+            return await claim_in_transaction(self.db.transaction())
+        except Exception as e:
+            logger.warning("Failed to claim shard %d of run %s: %s", shard, self.run_id, e)
+            return None
+
+    async def _update_lease(self, shard: int, update: Dict[str, Any]):
+        """リースを保持していることを確かめてから更新する"""
+        from google.cloud import firestore
+
+        ref = self._ref(shard)
+
+        @firestore.async_transactional
+        async def update_in_transaction(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get("lease_owner") != self.worker_id:
+                raise ShardLeaseLost(shard)
+            now = datetime.now(timezone.utc)
+            transaction.update(ref, {"updated_at": now, **update})
+
+        await update_in_transaction(self.db.transaction())
+
+    async def _process_shard(self, shard: int, lease: Dict[str, Any], deadline: float) -> bool:
+        """シャードを処理し、最後まで終えたかを返す（時間切れの場合はリースを手放す）"""
+        # チェックポイントのキャプチャの続きから、シャードの未処理キャプチャを順に取得する
+        last_capture_path = lease.get("last_capture_path")
+        if shard == self.sweep_shard:
+            captures = self._unsharded_captures(last_capture_path)
+        else:
+            captures = self.firestore_service.iter_unprocessed_captures(
+                shard=shard, start_after_path=last_capture_path
+            )
+
+        counts = Counter()
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._keep_lease(shard, lease_lost))
+        finished = False
+        try:
+            async with SummaryWriter(self.firestore_service) as writer:
+                async with self.batch_processor.worker_pool(counts, writer) as queue:
+                    checkpointed_at = time.monotonic()
+                    async for capture in captures:
+                        if lease_lost.is_set():
+                            raise ShardLeaseLost(shard)
+                        if time.monotonic() >= deadline:
+                            break
+                        await queue.put(capture)
+                        BATCH_QUEUE_DEPTH.set(queue.qsize())
+                        last_capture_path = capture["path"]
+
+                        if time.monotonic() - checkpointed_at >= self.checkpoint_interval:
+                            await self._checkpoint(shard, lease, last_capture_path, queue, writer, counts)
+                            checkpointed_at = time.monotonic()
+                    else:
+                        finished = True
+
+                    await self._checkpoint(shard, lease, last_capture_path, queue, writer, counts, finished=finished)
+        finally:
+            await captures.aclose()
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+        return finished
+
+    async def _unsharded_captures(self, start_after_path: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+        """どのシャードのクエリにも該当しない未処理キャプチャ（シャード番号がないか範囲外）"""
+        captures = self.firestore_service.iter_unprocessed_captures(start_after_path=start_after_path)
+        try:
+            async for capture in captures:
+                shard = capture.get("shard")
+                if not isinstance(shard, int) or not 0 <= shard < self.shard_count:
+                    yield capture
+        finally:
+            await captures.aclose()
+
+    async def _checkpoint(self, shard, lease, last_capture_path, queue, writer, counts, finished=None):
+        """投入済みのキャプチャを処理し終えてから進捗を記録する（finished指定時はシャードを完了か解放にする）"""
+        await queue.join()
+        await writer.flush()
+        await self.batch_processor.after_write(writer.take_written())
+        write_failed_count = writer.report()["write_failed_count"]
+        session_counts = {
+            "processed_count": counts["processed"] - write_failed_count,
+            "failed_count": counts["failed"],
+            "timeout_count": counts["timeout"],
+            "skipped_count": counts["skipped"],
+            "write_failed_count": write_failed_count,
+        }
+        update = {key: lease[key] + session_counts[key] for key in COUNT_KEYS}
+        update["last_capture_path"] = last_capture_path
+
+        now = datetime.now(timezone.utc)
+        if finished:
+            update["status"] = DONE
+        elif finished is False:
+            # 時間切れで中断したシャードは、他のインスタンスがすぐに続きから取得できるようにする
+            update["status"] = PENDING
+            update["lease_expires_at"] = now
+        else:
+            update["lease_expires_at"] = now + timedelta(seconds=self.lease_seconds)
+        await self._update_lease(shard, update)
+
+    async def _keep_lease(self, shard: int, lease_lost: asyncio.Event):
+        """処理中はリースを定期的に延長する"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self._update_lease(shard, {
+                    "lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+                })
+            except ShardLeaseLost:
+                lease_lost.set()
+                return
+            except Exception as e:
+                logger.warning("Failed to renew lease on shard %d of run %s: %s", shard, self.run_id, e)
+
+    async def progress(self) -> Dict[str, Any]:
+        """実行全体の進捗をシャードのリースドキュメントから集計する"""
+        result = {
+            "run_id": self.run_id,
+            # 掃除用シャードを含む
+            "shard_count": self.shard_count + 1,
+            "done_shards": 0,
+            "leased_shards": 0,
+            **{key: 0 for key in COUNT_KEYS},
+        }
+        if not self.db:
+            result["pending_shards"] = result["shard_count"]
+            return result
+
+        query = self.db.collection(self.COLLECTION).where("run_id", "==", self.run_id)
+        async for doc in query.stream():
+            data = doc.to_dict()
+            if data["status"] in (DONE, LEASED):
+                result[f"{data['status']}_shards"] += 1
+            for key in COUNT_KEYS:
+                result[key] += data.get(key, 0)
+        result["pending_shards"] = result["shard_count"] - result["done_shards"] - result["leased_shards"]
+        return result
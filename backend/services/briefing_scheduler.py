@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.calendar_service import event_time
+
+logger = logging.getLogger(__name__)
+
+
+class BriefingScheduler:
+    """直近の重要な予定のブリーフィングを、開始が近い順に事前生成する"""
+
+    def __init__(
+        self,
+        calendar_service,
+        briefing_service,
+        firestore_service,
+        hours_ahead: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_generations: Optional[int] = None,
+    ):
+        self.calendar_service = calendar_service
+        self.briefing_service = briefing_service
+        self.firestore_service = firestore_service
+        self.hours_ahead = hours_ahead or int(os.getenv("BRIEFING_PRECOMPUTE_HOURS_AHEAD", "24"))
+        self.concurrency = concurrency or int(os.getenv("BRIEFING_PRECOMPUTE_CONCURRENCY", "4"))
+        # 1回の実行で生成するブリーフィング数の上限（Geminiのクォータ予算）
+        self.max_generations = max_generations or int(os.getenv("BRIEFING_PRECOMPUTE_MAX_GENERATIONS", "200"))
+
+    async def run(self) -> Dict[str, Any]:
+        """全ユーザーの直近の予定を走査し、未生成・更新済みの予定だけブリーフィングを生成する"""
+        started_at = time.monotonic()
+        counts = Counter()
+        candidates = await self._collect_candidates(counts)
+        # 開始時刻が近い予定から処理する
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for candidate in candidates:
+            queue.put_nowait(candidate)
+
+        workers = [asyncio.create_task(self._worker(queue, counts)) for _ in range(self.concurrency)]
+        await asyncio.gather(*workers)
+
+        return {
+            "event_count": len(candidates),
+            "generated_count": counts["generated"],
+            "up_to_date_count": counts["up_to_date"],
+            "deferred_count": counts["deferred"],
+            "failed_count": counts["failed"],
+            "failed_user_count": counts["failed_users"],
+            "elapsed_seconds": round(time.monotonic() - started_at, 3),
+        }
+
+    async def _collect_candidates(self, counts: Counter) -> List[Tuple[datetime, str, Dict[str, Any]]]:
+        semaphore = asyncio.Semaphore(self.concurrency * 4)
+        now = datetime.now(timezone.utc)
+
+        async def events_for(user_id: str):
+            try:
+                async with semaphore:
+                    events = await self.calendar_service.get_events_for_briefing(
+                        user_id, hours_ahead=self.hours_ahead
+                    )
+            except Exception as e:
+                # 1人の予定が取得できなくても、他のユーザーの事前生成は続ける
+                logger.error("Error fetching events for user %s: %s", user_id, e)
+                counts["failed_users"] += 1
+                return []
+            return [
+                (event_time(event["start"]), user_id, event)
+                for event in events
+                # 開始済みの予定は事前生成の対象外
+                if event_time(event["start"]) >= now
+            ]
+
+        user_ids = [user_id async for user_id in self.firestore_service.iter_user_ids()]
+        results = await asyncio.gather(*(events_for(user_id) for user_id in user_ids))
+        return [candidate for events in results for candidate in events]
+
+    async def _worker(self, queue: asyncio.Queue, counts: Counter):
+        while not queue.empty():
+            _, user_id, event = queue.get_nowait()
+
+            # 予定が更新されていなければ保存済みのブリーフィングをそのまま使う
+            if await self.briefing_service.lookup(user_id, event):
+                counts["up_to_date"] += 1
+                continue
+
+            # 予算の枠を先に確保してから生成する（並列ワーカー間で上限を超えないように）
+            if counts["generated"] + counts["generating"] >= self.max_generations:
+                counts["deferred"] += 1
+                continue
+            counts["generating"] += 1
+            try:
+                # 保存済みでないことは上で確認したため、再確認せずに生成する
+                await self.briefing_service.generate(user_id, event)
+                counts["generated"] += 1
+            except Exception as e:
+                logger.error("Error precomputing briefing for event %s: %s", event["id"], e)
+                counts["failed"] += 1
+            finally:
+                counts["generating"] -= 1
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BriefingGeneration:
+    """生成中のブリーフィング（生成されたテキストを溜め、後から来た要求にも最初から配る）
+
+    テキストは生成側のタスクが読み出して溜めるため、Geminiの制限枠は生成が終わった時点で返り、
+    SSEのクライアントの読み出しの速さには左右されない。
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    def append(self, text: str):
+        self.parts.append(text)
+        self.notify()
+
+    def notify(self):
+        # 待っている全員を起こし、次の更新用に新しいEventに差し替える
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def tail(self) -> AsyncIterator[str]:
+        """これまでに生成されたテキストと、生成が終わるまでの続きを順に返す"""
+        index = 0
+        while True:
+            updated = self._updated
+            while index < len(self.parts):
+                yield self.parts[index]
+                index += 1
+            if self.task.done():
+                return
+            await updated.wait()
+
+    async def result(self) -> Dict[str, Any]:
+        """保存したブリーフィング（要求元が切断しても、他の要求のために生成は続ける）"""
+        return await asyncio.shield(self.task)
+
+
+class BriefingService:
+    """イベントの版（updated）ごとにブリーフィングをメモ化し、同じ生成要求を1回の呼び出しにまとめる"""
+
+    def __init__(self, gemini_service, firestore_service, capture_index=None):
+        self.gemini_service = gemini_service
+        self.firestore_service = firestore_service
+        self.capture_index = capture_index
+        # ブリーフィングに含める関連キャプチャの件数と、関連とみなす類似度の下限
+        self.related_count = int(os.getenv("BRIEFING_RELATED_CAPTURES", "5"))
+        self.related_min_score = float(os.getenv("BRIEFING_RELATED_MIN_SCORE", "0.5"))
+        self._in_flight: Dict[Tuple[str, str], BriefingGeneration] = {}
+        self.generated_count = 0
+        self.reused_count = 0
+        self.coalesced_count = 0
+
+    @staticmethod
+    def briefing_id(event: Dict[str, Any]) -> str:
+        """イベントIDと更新日時から決まるブリーフィングID（イベントが変わらなければ同じID）"""
+        raw = f"{event['id']}\x1f{event.get('updated', '')}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    async def lookup(self, user_id: str, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """イベントの現在の版に対する保存済みブリーフィングを取得"""
+        briefing = await self.firestore_service.get_briefing(user_id, self.briefing_id(event))
+        if briefing:
+            self.reused_count += 1
+        return briefing
+
+    async def get_or_generate(self, user_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        """保存済みがあればそれを返し、なければ生成して保存する（同時要求は1回の生成を共有）"""
+        return await self.start(user_id, event).result()
+
+    async def generate(self, user_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        """保存済みがないと確認済みのイベントのブリーフィングを、再確認せずに生成して保存する"""
+        return await self.start(user_id, event, lookup=False).result()
+
+    def start(
+        self, user_id: str, event: Dict[str, Any], stream: bool = False, lookup: bool = True
+    ) -> BriefingGeneration:
+        """イベントの生成中のブリーフィングに合流し、なければ生成を始める
+
+        streamを指定すると生成されたテキストを逐次溜める（保存済みの場合は全文を1回で溜める）。
+        lookupをFalseにすると、保存済みのブリーフィングを確認せずに生成する。
+        合流した要求は、最初の要求の方式に関わらずtail()とresult()で同じ結果を受け取る。
+        """
+        key = (user_id, self.briefing_id(event))
+        generation = self._in_flight.get(key)
+        if generation:
+            self.coalesced_count += 1
+            return generation
+        generation = BriefingGeneration()
+        generation.task = asyncio.create_task(self._lookup_or_generate(user_id, event, generation, stream, lookup))
+        self._in_flight[key] = generation
+
+        def finished(task: asyncio.Task):
+            self._in_flight.pop(key, None)
+            generation.notify()
+            # 全員が切断した後に失敗した場合も、例外を取り出してログに残す
+            if not task.cancelled() and task.exception():
+                logger.warning("Briefing generation for event %s failed: %s", event["id"], task.exception())
+
+        generation.task.add_done_callback(finished)
+        return generation
+
+    async def _lookup_or_generate(
+        self, user_id: str, event: Dict[str, Any], generation: BriefingGeneration, stream: bool, lookup: bool
+    ) -> Dict[str, Any]:
+        briefing = await self.lookup(user_id, event) if lookup else None
+        if briefing:
+            generation.append(briefing["briefing_content"])
+            return briefing
+        related = await self.related_captures(user_id, event)
+        if stream:
+            # ストリーミングは途中から再試行できないため、rate_limiter.callの再試行は使えない
+            async for text in self.gemini_service.stream_briefing(event, related):
+                generation.append(text)
+            briefing_content = "".join(generation.parts)
+        else:
+            briefing_content = await self.gemini_service.generate_briefing(event, related)
+            generation.append(briefing_content)
+        self.generated_count += 1
+        # 最後まで生成できた場合のみ保存する
+        return await self.save(user_id, event, briefing_content)
+
+    async def related_captures(self, user_id: str, event: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """イベントの件名・説明に近いユーザーのキャプチャ（検索インデックスがなければ空）"""
+        if not self.capture_index or not self.related_count:
+            return []
+        query = "\n".join(filter(None, (event.get("summary"), event.get("description"))))
+        if not query:
+            return []
+        try:
+            hits = await self.capture_index.search(user_id, query, k=self.related_count)
+            captures = await asyncio.gather(*(
+                self.firestore_service.get_capture(user_id, capture_id, fields=["content", "summary"])
+                for capture_id, score in hits if score >= self.related_min_score
+            ))
+        except Exception as e:
+            # 関連情報なしでもブリーフィングは作れる
+            logger.warning("Failed to look up related captures for user %s: %s", user_id, e)
+            return []
+        return [capture for capture in captures if capture]
+
+    async def save(self, user_id: str, event: Dict[str, Any], briefing_content: str) -> Dict[str, Any]:
+        """生成したブリーフィングをイベントの版に紐づけて保存"""
+        briefing_data = {
+            "user_id": user_id,
+            "event_id": event["id"],
+            "event_updated": event.get("updated", ""),
+            "event_title": event["summary"],
+            # 終日の予定はdateTimeを持たず、dateだけを持つ
+            "event_time": event["start"].get("dateTime") or event["start"].get("date"),
+            "briefing_content": briefing_content,
+            "created_at": datetime.now()
+        }
+        briefing_data["id"] = await self.firestore_service.save_briefing(
+            briefing_data, briefing_id=self.briefing_id(event)
+        )
+        return briefing_data
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "generated_count": self.generated_count,
+            "reused_count": self.reused_count,
+            "coalesced_count": self.coalesced_count,
+            "in_flight": len(self._in_flight),
+        }
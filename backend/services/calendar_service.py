@@ -1,73 +1,132 @@
 import os
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from datetime import datetime, timedelta, timezone
 from googleapiclient.errors import HttpError
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# googleapiclientは同期APIのため、イベントループを塞がないよう専用の上限付きスレッドプールで実行する
+_calendar_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CALENDAR_THREAD_POOL_SIZE", "8")),
+    thread_name_prefix="calendar"
+)
+
+# 必要なフィールドだけを取得してレスポンスを小さくする
+EVENT_FIELDS = (
+    "id,status,summary,description,start,end,location,created,updated,"
+    "attendees(email,displayName,responseStatus,optional)"
+)
+LIST_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+
+# 同梱したディスカバリードキュメント（起動時にネットワークから取得しない）
+DISCOVERY_DOCUMENT = os.path.join(os.path.dirname(__file__), "discovery", "calendar_v3.json")
 
 class CalendarService:
     def __init__(self):
-        self.service = None
-        self._initialize_service()
+        self._service = None
+        self._service_initialized = False
+        self._service_lock = threading.Lock()
+        self.credentials = None
+        # ユーザーごとのイベントストア（syncTokenで差分同期し、参照はローカルから返す）
+        self._stores: "OrderedDict[str, UserEventStore]" = OrderedDict()
+        self.sync_interval = float(os.getenv("CALENDAR_SYNC_INTERVAL", "60"))
+        self.max_users = int(os.getenv("CALENDAR_STORE_MAX_USERS", "1000"))
+        # 全件同期で取得する期間（今後の予定の表示・ブリーフィングの範囲に余裕を持たせる）
+        self.sync_horizon = timedelta(days=float(os.getenv("CALENDAR_SYNC_HORIZON_DAYS", "14")))
+        # スレッドごとにHTTP接続を保持し、keep-aliveで使い回す
+        self._local = threading.local()
+    
+    @property
+    def service(self):
+        """Google Calendar APIサービス（SDKの読み込みとドキュメントの解析が重いため、初回アクセス時に初期化する）"""
+        if not self._service_initialized:
+            with self._service_lock:
+                if not self._service_initialized:
+                    self._initialize_service()
+                    self._service_initialized = True
+        return self._service
+    
+    def warm_up(self):
+        """起動後にスレッド上で呼び、初回リクエストで初期化を待たないようにする"""
+        self.service
     
     def _initialize_service(self):
         """Google Calendar APIサービスを初期化"""
         try:
             credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
             if credentials_path:
-                credentials = service_account.Credentials.from_service_account_file(
+                from google.oauth2 import service_account
+                from googleapiclient.discovery import build_from_document
+                
+                self.credentials = service_account.Credentials.from_service_account_file(
                     credentials_path,
                     scopes=['https://www.googleapis.com/auth/calendar.readonly']
                 )
-                self.service = build('calendar', 'v3', credentials=credentials)
+                with open(DISCOVERY_DOCUMENT, encoding="utf-8") as f:
+                    self._service = build_from_document(f.read(), credentials=self.credentials)
         except Exception as e:
-            print(f"Calendar service initialization failed: {e}")
-            self.service = None
+            logger.error("Calendar service initialization failed: %s", e)
+            self._service = None
+    
+    def stats(self) -> Dict[str, int]:
+        return {"synced_users": len(self._stores)}
+    
+    async def _execute(self, request):
+        """APIリクエストをスレッドプール上で実行"""
+        loop = asyncio.get_running_loop()
+        with span("calendar_api"):
+            return await loop.run_in_executor(_calendar_executor, self._execute_sync, request)
+    
+    def _execute_sync(self, request):
+        # httplib2.Httpはスレッドセーフではないため、ワーカースレッドごとに1つ持つ
+        http = getattr(self._local, "http", None)
+        if http is None:
+            import httplib2
+            import google_auth_httplib2
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return request.execute(http=http)
     
     async def get_upcoming_events(self, user_id: str, days_ahead: int = 7) -> List[Dict[str, Any]]:
         """今後の予定を取得"""
         if not self.service:
             return []
         
+        # 現在時刻から指定日数後まで
+        now = datetime.now(timezone.utc)
+        until = now + timedelta(days=days_ahead)
         try:
-            # 現在時刻から指定日数後まで
-            now = datetime.utcnow()
-            end_time = now + timedelta(days=days_ahead)
-            
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=now.isoformat() + 'Z',
-                timeMax=end_time.isoformat() + 'Z',
-                maxResults=50,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            
-            # イベント情報を整形
-            formatted_events = []
-            for event in events:
-                start = event['start'].get('dateTime', event['start'].get('date'))
-                
-                formatted_event = {
-                    'id': event['id'],
-                    'summary': event.get('summary', 'No title'),
-                    'description': event.get('description', ''),
-                    'start': start,
-                    'end': event['end'].get('dateTime', event['end'].get('date')),
-                    'attendees': event.get('attendees', []),
-                    'location': event.get('location', ''),
-                    'created': event.get('created', ''),
-                    'updated': event.get('updated', '')
-                }
-                formatted_events.append(formatted_event)
-            
-            return formatted_events
-            
+            store = await self._synced_store(user_id, until)
         except HttpError as error:
-            print(f'An error occurred: {error}')
+            logger.error("Calendar API error: %s", error)
             return []
+        
+        events = store.events_between(now, until)
+        
+        # イベント情報を整形
+        formatted_events = []
+        for event in events:
+            formatted_event = {
+                'id': event['id'],
+                'summary': event.get('summary', 'No title'),
+                'description': event.get('description', ''),
+                'start': event['start'].get('dateTime', event['start'].get('date')),
+                'end': event['end'].get('dateTime', event['end'].get('date')),
+                'attendees': event.get('attendees', []),
+                'location': event.get('location', ''),
+                'created': event.get('created', ''),
+                'updated': event.get('updated', '')
+            }
+            formatted_events.append(formatted_event)
+        
+        return formatted_events
     
     async def get_event(self, user_id: str, event_id: str) -> Optional[Dict[str, Any]]:
         """特定のイベントを取得"""
@@ -75,10 +134,15 @@ class CalendarService:
             return None
         
         try:
-            event = self.service.events().get(
-                calendarId='primary',
-                eventId=event_id
-            ).execute()
+            store = await self._synced_store(user_id)
+            event = store.events.get(event_id)
+            if event is None:
+                # 同期範囲外（過去の予定など）のイベントのみAPIから直接取得する
+                event = await self._execute(self.service.events().get(
+                    calendarId='primary',
+                    eventId=event_id,
+                    fields=EVENT_FIELDS
+                ))
             
             return {
                 'id': event['id'],
@@ -93,7 +157,7 @@ class CalendarService:
             }
             
         except HttpError as error:
-            print(f'An error occurred: {error}')
+            logger.error("Calendar API error: %s", error)
             return None
     
     async def get_events_for_briefing(self, user_id: str, hours_ahead: int = 24) -> List[Dict[str, Any]]:
@@ -101,39 +165,142 @@ class CalendarService:
         if not self.service:
             return []
         
+        # 現在時刻から指定時間後まで
+        now = datetime.now(timezone.utc)
+        until = now + timedelta(hours=hours_ahead)
         try:
-            # 現在時刻から指定時間後まで
-            now = datetime.utcnow()
-            end_time = now + timedelta(hours=hours_ahead)
-            
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=now.isoformat() + 'Z',
-                timeMax=end_time.isoformat() + 'Z',
-                maxResults=20,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            
-            # 会議室予約などではなく、実際の会議や重要な予定のみを対象とする
-            important_events = []
-            for event in events:
-                # 参加者がいる、または説明がある場合は重要な予定とみなす
-                if event.get('attendees') or event.get('description'):
-                    important_events.append({
-                        'id': event['id'],
-                        'summary': event.get('summary', 'No title'),
-                        'description': event.get('description', ''),
-                        'start': event['start'],
-                        'end': event['end'],
-                        'attendees': event.get('attendees', []),
-                        'location': event.get('location', ''),
-                    })
-            
-            return important_events
-            
+            store = await self._synced_store(user_id, until)
         except HttpError as error:
-            print(f'An error occurred: {error}')
-            return []
\ No newline at end of file
+            logger.error("Calendar API error: %s", error)
+            return []
+        
+        events = store.events_between(now, until)
+        
+        # 会議室予約などではなく、実際の会議や重要な予定のみを対象とする
+        important_events = []
+        for event in events:
+            # 参加者がいる、または説明がある場合は重要な予定とみなす
+            if event.get('attendees') or event.get('description'):
+                important_events.append({
+                    'id': event['id'],
+                    'summary': event.get('summary', 'No title'),
+                    'description': event.get('description', ''),
+                    'start': event['start'],
+                    'end': event['end'],
+                    'attendees': event.get('attendees', []),
+                    'location': event.get('location', ''),
+                    'created': event.get('created', ''),
+                    'updated': event.get('updated', '')
+                })
+        
+        return important_events
+    
+    async def _synced_store(self, user_id: str, until: Optional[datetime] = None) -> "UserEventStore":
+        """ユーザーのイベントストアを取得し、前回の同期から時間が経っていれば差分同期する
+        
+        差分同期は全件同期した期間（timeMax）の中しか追わないため、untilまでの予定が
+        同期済みの期間を超える場合は全件同期からやり直す。
+        """
+        until = until or datetime.now(timezone.utc)
+        store = self._stores.get(user_id)
+        if store is None:
+            store = UserEventStore()
+            self._stores[user_id] = store
+            while len(self._stores) > self.max_users:
+                self._stores.popitem(last=False)
+        self._stores.move_to_end(user_id)
+        
+        if until <= store.window_end and time.monotonic() - store.synced_at < self.sync_interval:
+            return store
+        
+        async with store.lock:
+            if until > store.window_end:
+                store.reset()
+            # ロック待ちの間に他のリクエストが同期済みなら何もしない
+            elif time.monotonic() - store.synced_at < self.sync_interval:
+                return store
+            try:
+                await self._sync(store, until)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                # 同期トークンが失効した場合は全件同期からやり直す
+                store.reset()
+                await self._sync(store, until)
+        return store
+    
+    async def _sync(self, store: "UserEventStore", until: datetime):
+        """syncTokenによる差分同期（初回は直近からsync_horizon後、またはuntilまでの全件同期）"""
+        params = {
+            'calendarId': 'primary',
+            'singleEvents': True,
+            'maxResults': 2500,
+            'fields': LIST_FIELDS,
+        }
+        window_end = store.window_end
+        if store.sync_token:
+            params['syncToken'] = store.sync_token
+        else:
+            # singleEventsで繰り返し予定を展開するため、終了を指定しないと無期限の予定が際限なく返る
+            now = datetime.now(timezone.utc)
+            window_end = max(now + self.sync_horizon, until)
+            params['timeMin'] = (now - timedelta(days=1)).isoformat()
+            params['timeMax'] = window_end.isoformat()
+        
+        page_token = None
+        while True:
+            if page_token:
+                params['pageToken'] = page_token
+            result = await self._execute(self.service.events().list(**params))
+            store.apply(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        
+        store.sync_token = result.get('nextSyncToken')
+        store.window_end = window_end
+        store.synced_at = time.monotonic()
+        store.prune(datetime.now(timezone.utc) - timedelta(days=1))
+
+
+def event_time(value: Dict[str, str]) -> datetime:
+    """イベントの開始・終了（dateTimeまたは終日のdate）をタイムゾーン付きで返す"""
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+    return datetime.fromisoformat(value['date']).replace(tzinfo=timezone.utc)
+
+
+class UserEventStore:
+    """1ユーザー分のカレンダーイベントのローカルコピー"""
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.events: Dict[str, Dict[str, Any]] = {}
+        self.sync_token: Optional[str] = None
+        # 全件同期した期間の終わり（差分同期はこの期間内の変更だけを返す）
+        self.window_end = datetime.min.replace(tzinfo=timezone.utc)
+        self.synced_at = float('-inf')
+    
+    def apply(self, items: List[Dict[str, Any]]):
+        """同期結果を反映（削除されたイベントはstatus=cancelledで届く）"""
+        for event in items:
+            if event.get('status') == 'cancelled':
+                self.events.pop(event['id'], None)
+            elif 'start' in event and 'end' in event:
+                self.events[event['id']] = event
+    
+    def prune(self, before: datetime):
+        """終了済みのイベントを削除"""
+        for event_id in [i for i, e in self.events.items() if event_time(e['end']) < before]:
+            del self.events[event_id]
+    
+    def events_between(self, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """期間内に進行中・開始するイベントを開始時刻順に返す"""
+        events = [
+            e for e in self.events.values()
+            if event_time(e['end']) > start and event_time(e['start']) < end
+        ]
+        return sorted(events, key=lambda e: event_time(e['start']))
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.embedding_service import DOCUMENT_TASK, QUERY_TASK
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# 1セグメントに保存するベクトル数（768次元のfloat16で約400KB、ドキュメント上限1MiBに収まる）
+SEGMENT_SIZE = 256
+# 他のインスタンスとの時計のずれを見込んで、新しいセグメントを少し遡って読み直す
+CLOCK_SKEW = timedelta(seconds=60)
+
+
+class _UserIndex:
+    """1ユーザー分の埋め込み行列（追加時に容量を倍々で確保し、行のコピーを減らす）"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        # セグメントID → そのセグメントに含まれるキャプチャID
+        self.segments: Dict[str, List[str]] = {}
+        self.loaded_until: Optional[datetime] = None
+        self.checked_at = 0.0
+        self.lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def append(self, ids: Sequence[str], vectors: np.ndarray) -> int:
+        """未登録のキャプチャだけを追加し、追加した件数を返す"""
+        keep = [index for index, capture_id in enumerate(ids) if capture_id not in self.rows]
+        if not keep:
+            return 0
+        vectors = vectors[keep]
+        if self.vectors.shape[1] != vectors.shape[1]:
+            self.vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        needed = self.size + len(keep)
+        if needed > len(self.vectors):
+            grown = np.zeros((max(needed, len(self.vectors) * 2, 64), vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size:needed] = vectors
+        for index in keep:
+            self.rows[ids[index]] = len(self.ids)
+            self.ids.append(ids[index])
+        return len(keep)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """コサイン類似度の上位k件（ベクトルは正規化済みのため内積で計算する）"""
+        if self.size == 0 or query.shape[0] != self.vectors.shape[1]:
+            return []
+        scores = self.vectors[:self.size] @ query
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[index], float(scores[index])) for index in top]
+
+
+class CaptureIndex:
+    """キャプチャの要約の埋め込みをユーザーごとに保持し、類似するキャプチャを検索する
+
+    Firestoreには追記のみのセグメント（IDの配列とfloat16のベクトル列）として保存するため、
+    トランザクションなしで複数インスタンスから追加できる。検索はプロセス内に読み込んだ
+    行列に対して行い、前回の読み込み以降に追加されたセグメントだけを読み足す。
+    """
+
+    def __init__(
+        self,
+        firestore_service,
+        embedding_service,
+        max_users: Optional[int] = None,
+        refresh_interval: Optional[float] = None,
+        compact_segments: Optional[int] = None,
+    ):
+        self.firestore_service = firestore_service
+        self.embedding_service = embedding_service
+        self.max_users = max_users or int(os.getenv("CAPTURE_INDEX_MAX_USERS", "1000"))
+        # この間隔より前に確認したユーザーは、検索前にFirestoreの新しいセグメントを確認する
+        self.refresh_interval = refresh_interval or float(os.getenv("CAPTURE_INDEX_REFRESH_SECONDS", "30"))
+        # セグメント数がこれを超えたら、小さいセグメントをまとめ直す
+        self.compact_segments = compact_segments or int(os.getenv("CAPTURE_INDEX_COMPACT_SEGMENTS", "16"))
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self.indexed_count = 0
+        self.search_count = 0
+
+    def _segments(self, user_id: str):
+        return self.firestore_service.db.collection("users").document(user_id).collection("capture_index")
+
+    async def add(self, user_id: str, items: Sequence[Tuple[str, str]]) -> int:
+        """(キャプチャID, 要約)を埋め込んでインデックスに追加し、追加した件数を返す"""
+        # 同じキャプチャが重複して渡された場合は最後の要約を使う
+        items = list(dict(items).items())
+        if not items or not self.firestore_service.db:
+            return 0
+        vectors = await self.embedding_service.embed([text for _, text in items], DOCUMENT_TASK)
+        if vectors is None:
+            return 0
+        ids = [capture_id for capture_id, _ in items]
+
+        index = await self._load(user_id, force=True)
+        async with index.lock:
+            keep = [position for position, capture_id in enumerate(ids) if capture_id not in index.rows]
+            if not keep:
+                return 0
+            ids, vectors = [ids[position] for position in keep], vectors[keep]
+            for start in range(0, len(ids), SEGMENT_SIZE):
+                end = start + SEGMENT_SIZE
+                await self._write_segment(user_id, index, ids[start:end], vectors[start:end])
+            added = index.append(ids, vectors)
+            if len(index.segments) > self.compact_segments:
+                await self._compact(user_id, index)
+        self.indexed_count += added
+        return added
+
+    async def search(self, user_id: str, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """クエリに近いキャプチャの(ID, 類似度)を類似度の高い順に返す"""
+        if not self.firestore_service.db:
+            return []
+        vectors = await self.embedding_service.embed([query], QUERY_TASK)
+        if vectors is None:
+            return []
+        index = await self._load(user_id)
+        self.search_count += 1
+        with span("capture_index_search"):
+            return index.search(vectors[0], k)
+
+    async def _load(self, user_id: str, force: bool = False) -> _UserIndex:
+        """プロセス内のインデックスを返す（確認から時間が経っていれば新しいセグメントを読み足す）"""
+        index = self._users.get(user_id)
+        if index is None or index.model != self.embedding_service.model_name:
+            index = _UserIndex(self.embedding_service.model_name)
+            self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+        if force or time.monotonic() - index.checked_at >= self.refresh_interval:
+            async with index.lock:
+                with span("capture_index_load"):
+                    await self._read_new_segments(user_id, index)
+        return index
+
+    async def _read_new_segments(self, user_id: str, index: _UserIndex):
+        query = self._segments(user_id)
+        if index.loaded_until:
+            query = query.where("created_at", ">=", index.loaded_until - CLOCK_SKEW)
+        query = query.order_by("created_at")
+        index.checked_at = time.monotonic()
+
+        async for doc in query.stream():
+            if doc.id in index.segments:
+                continue
+            data = doc.to_dict()
+            # 埋め込みモデルを切り替える前のセグメントは読まない（次元や意味が揃わないため）
+            if data["model"] != index.model:
+                continue
+            vectors = np.frombuffer(data["vectors"], dtype=np.float16).reshape(len(data["ids"]), data["dim"])
+            index.append(data["ids"], vectors.astype(np.float32))
+            index.segments[doc.id] = data["ids"]
+            if index.loaded_until is None or data["created_at"] > index.loaded_until:
+                index.loaded_until = data["created_at"]
+
+    def _segment_data(self, ids: Sequence[str], vectors: np.ndarray) -> Dict:
+        return {
+            "model": self.embedding_service.model_name,
+            "ids": list(ids),
+            "dim": int(vectors.shape[1]),
+            "vectors": vectors.astype(np.float16).tobytes(),
+            "created_at": datetime.now(timezone.utc),
+        }
+
+    async def _write_segment(self, user_id: str, index: _UserIndex, ids: Sequence[str], vectors: np.ndarray):
+        segment_id = uuid.uuid4().hex
+        await self._segments(user_id).document(segment_id).set(self._segment_data(ids, vectors))
+        index.segments[segment_id] = list(ids)
+
+    async def _compact(self, user_id: str, index: _UserIndex):
+        """満杯でないセグメントを詰め直し、書き込みと削除を1つのバッチで反映する
+
+        他のインスタンスが同時に詰め直しても、同じキャプチャが重複して残るだけで欠けることはない
+        （重複は読み込み時に除く）。
+        """
+        small = [segment_id for segment_id, ids in index.segments.items() if len(ids) < SEGMENT_SIZE]
+        if len(small) < 2:
+            return
+        # 他のインスタンスが書いたセグメントと重複しているIDは1行にまとめる
+        rows = sorted({index.rows[capture_id] for segment_id in small for capture_id in index.segments[segment_id]})
+
+        batch = self.firestore_service.db.batch()
+        new_segments = {}
+        for start in range(0, len(rows), SEGMENT_SIZE):
+            chunk = rows[start:start + SEGMENT_SIZE]
+            segment_id = uuid.uuid4().hex
+            batch.set(
+                self._segments(user_id).document(segment_id),
+                self._segment_data([index.ids[row] for row in chunk], index.vectors[chunk]),
+            )
+            new_segments[segment_id] = [index.ids[row] for row in chunk]
+        for segment_id in small:
+            batch.delete(self._segments(user_id).document(segment_id))
+        try:
+            await batch.commit()
+        except Exception as e:
+            # 詰め直せなくても検索結果は変わらない
+            logger.warning("Failed to compact capture index of user %s: %s", user_id, e)
+            return
+        for segment_id in small:
+            del index.segments[segment_id]
+        index.segments.update(new_segments)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._users),
+            "vectors": sum(index.size for index in self._users.values()),
+            "indexed_count": self.indexed_count,
+            "search_count": self.search_count,
+        }
@@ -0,0 +1,160 @@
+import os
+import re
+from typing import Dict, List, Optional, Type
+
+import lxml.html
+
+# 本文ではないことがほぼ確実な要素
+_BOILERPLATE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe", "svg", "template"]
+
+_POSITIVE = re.compile(r"article|body|content|entry|main|post|story|text|blog", re.I)
+_NEGATIVE = re.compile(
+    r"comment|footer|sidebar|side|nav|menu|share|social|ad-|ads|advert|promo|related|widget|banner|breadcrumb|cookie|popup|subscribe",
+    re.I,
+)
+
+
+class ContentExtractor:
+    """HTMLから要約対象の本文テキストを抽出するエンジンの基底クラス"""
+
+    name = ""
+
+    def extract(self, html: str) -> str:
+        raise NotImplementedError
+
+
+class SoupExtractor(ContentExtractor):
+    """BeautifulSoup（html.parser）でページ全体のテキストを抽出する従来の実装"""
+
+    name = "bs4"
+
+    def extract(self, html: str) -> str:
+        # 既定のエンジンではないため、選択された場合にだけ読み込む
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, "html.parser")
+
+        for script in soup(["script", "style", "nav", "header", "footer"]):
+            script.decompose()
+
+        return " ".join(soup.get_text().split())
+
+
+class ReadabilityExtractor(ContentExtractor):
+    """lxmlでパースし、readability方式のスコアリングで本文ブロックだけを抽出する"""
+
+    name = "readability"
+
+    # 抽出結果がこれより短い場合は本文判定に失敗したとみなし、ページ全体のテキストを使う
+    min_text_length = 200
+
+    def extract(self, html: str) -> str:
+        if not html.strip():
+            return ""
+        try:
+            root = lxml.html.document_fromstring(html)
+        except (ValueError, lxml.etree.ParserError):
+            return ""
+
+        for element in list(root.iter(*_BOILERPLATE_TAGS)):
+            element.drop_tree()
+
+        top = self._top_candidate(root)
+        if top is not None:
+            text = self._collect(top)
+            if len(text) >= self.min_text_length:
+                return text
+
+        body = root.find("body")
+        return self._text(body if body is not None else root)
+
+    def _top_candidate(self, root) -> Optional[lxml.html.HtmlElement]:
+        scores: Dict[lxml.html.HtmlElement, float] = {}
+
+        for paragraph in root.iter("p", "pre", "td", "blockquote", "li"):
+            text = self._normalize(paragraph.text_content())
+            if len(text) < 25:
+                continue
+
+            # 段落の長さと読点・カンマの数を親と祖父母に加点する
+            score = 1 + text.count(",") + text.count("、") + text.count("。") + min(len(text) // 100, 3)
+            parent = paragraph.getparent()
+            if parent is None:
+                continue
+            grandparent = parent.getparent()
+
+            for node, weight in ((parent, 1.0), (grandparent, 0.5)):
+                if node is None:
+                    continue
+                if node not in scores:
+                    scores[node] = self._class_weight(node)
+                scores[node] += score * weight
+
+        if not scores:
+            return None
+
+        # リンクだらけのブロック（メニュー・関連記事一覧など）は減点する
+        return max(scores, key=lambda node: scores[node] * (1 - self._link_density(node)))
+
+    def _collect(self, top) -> str:
+        """本文候補と、同程度に本文らしい兄弟要素のテキストをまとめる"""
+        parent = top.getparent()
+        if parent is None:
+            return self._text(top)
+
+        parts: List[str] = []
+        for sibling in parent:
+            if not isinstance(sibling.tag, str):
+                continue
+            if sibling is top:
+                parts.append(self._text(sibling))
+                continue
+            text = self._text(sibling)
+            if len(text) > 80 and self._link_density(sibling) < 0.25 and self._class_weight(sibling) >= 0:
+                parts.append(text)
+        return self._normalize(" ".join(parts))
+
+    @staticmethod
+    def _class_weight(node) -> float:
+        weight = 0.0
+        for attribute in (node.get("class"), node.get("id")):
+            if not attribute:
+                continue
+            if _NEGATIVE.search(attribute):
+                weight -= 25
+            if _POSITIVE.search(attribute):
+                weight += 25
+        if node.tag in ("article", "main"):
+            weight += 25
+        return weight
+
+    @staticmethod
+    def _link_density(node) -> float:
+        text_length = len(node.text_content())
+        if not text_length:
+            return 1.0
+        link_length = sum(len(link.text_content()) for link in node.iter("a"))
+        return link_length / text_length
+
+    @classmethod
+    def _text(cls, node) -> str:
+        # text_content()は隣接要素の文字列を区切りなしで連結するため、要素ごとに空白で区切る
+        return cls._normalize(" ".join(node.itertext()))
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.split())
+
+
+EXTRACTORS: Dict[str, Type[ContentExtractor]] = {
+    SoupExtractor.name: SoupExtractor,
+    ReadabilityExtractor.name: ReadabilityExtractor,
+}
+
+
+def get_extractor(name: Optional[str] = None) -> ContentExtractor:
+    """設定（HTML_EXTRACTOR）に応じた抽出エンジンを返す"""
+    name = name or os.getenv("HTML_EXTRACTOR", ReadabilityExtractor.name)
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor: {name} (available: {', '.join(EXTRACTORS)})")
+    return EXTRACTORS[name]()
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# 検索対象（キャプチャの要約）と検索クエリで埋め込みの作り方を変える
+DOCUMENT_TASK = "RETRIEVAL_DOCUMENT"
+QUERY_TASK = "RETRIEVAL_QUERY"
+
+
+class EmbeddingService:
+    """Vertex AIのテキスト埋め込みモデルで、正規化済みのベクトルを作る"""
+
+    def __init__(self):
+        self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
+        self.location = "asia-northeast1"
+        self.model_name = os.getenv("EMBEDDING_MODEL", "textembedding-gecko-multilingual@001")
+        # 1リクエストで送れるテキスト数（リージョン・モデルごとの上限に合わせる）
+        self.batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "5"))
+        self._semaphore = asyncio.Semaphore(int(os.getenv("EMBEDDING_CONCURRENCY", "4")))
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        """埋め込みモデル（SDKの読み込みが重いため、初回アクセス時に初期化する）"""
+        if self._model is None and self.project_id:
+            with self._model_lock:
+                if self._model is None:
+                    import vertexai
+                    from vertexai.language_models import TextEmbeddingModel
+                    vertexai.init(project=self.project_id, location=self.location)
+                    self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def warm_up(self):
+        """起動後にスレッド上で呼び、初回の埋め込みでSDKの読み込みを待たないようにする"""
+        self.model
+
+    async def embed(self, texts: List[str], task_type: str = DOCUMENT_TASK) -> Optional[np.ndarray]:
+        """テキストごとの埋め込みを行ごとにL2正規化した行列で返す（モデル未設定時はNone）"""
+        if not self.model:
+            return None
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self._embed_batch(batch, task_type) for batch in batches))
+        vectors = np.asarray([values for batch in results for values in batch], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    async def _embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        from vertexai.language_models import TextEmbeddingInput
+
+        inputs = [TextEmbeddingInput(text=text, task_type=task_type) for text in texts]
+        # 同時実行数はバッチ処理の埋め込みだけに適用し、検索クエリは待たせない
+        if task_type == QUERY_TASK:
+            with span("embedding_query"):
+                embeddings = await self.model.get_embeddings_async(inputs)
+        else:
+            async with self._semaphore:
+                with span("embedding"):
+                    embeddings = await self.model.get_embeddings_async(inputs)
+        return [embedding.values for embedding in embeddings]
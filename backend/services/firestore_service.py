@@ -1,16 +1,74 @@
 import os
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-from google.cloud import firestore
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional, Dict, Any, AsyncIterator
+from datetime import datetime, timedelta, timezone
+import threading
 import uuid
 
+logger = logging.getLogger(__name__)
+
+# ダイジェストドキュメントに保持するキャプチャ件数（1ページ目）
+DIGEST_SIZE = int(os.getenv("DIGEST_SIZE", "20"))
+# 夜間バッチのシャード数（キャプチャの作成時にユーザーごとのシャード番号を書き込む）
+CAPTURE_SHARD_COUNT = int(os.getenv("BATCH_SHARD_COUNT", "16"))
+
+def shard_for_user(user_id: str, shard_count: int = CAPTURE_SHARD_COUNT) -> int:
+    """ユーザーIDのハッシュ値の範囲でシャードを決める"""
+    digest = int(hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:8], 16)
+    return digest * shard_count >> 32
+
+# 一覧のプレビュー表示で返す本文・要約の最大文字数
+PREVIEW_CHARS = int(os.getenv("LIST_PREVIEW_CHARS", "200"))
+
+# 一覧表示に必要なフィールドだけを読み、metadataなどの大きなフィールドは転送しない
+CAPTURE_LIST_FIELDS = ["id", "type", "content", "timestamp", "processed", "summary"]
+BRIEFING_LIST_FIELDS = ["id", "event_id", "event_title", "event_time", "briefing_content", "created_at"]
+
+def preview_text(text: str, limit: int = PREVIEW_CHARS) -> str:
+    """一覧表示用に先頭だけを残す"""
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def capture_preview(capture: Dict[str, Any]) -> Dict[str, Any]:
+    """本文と要約を切り詰めたキャプチャ"""
+    return {
+        **capture,
+        "content": preview_text(capture["content"]),
+        "summary": preview_text(capture.get("summary") or ""),
+    }
+
+def summary_update(summary: str) -> Dict[str, Any]:
+    """要約の書き戻し内容（要約と処理済みフラグを同じ書き込みで更新する）"""
+    return {
+        "summary": summary,
+        "processed": True,
+        "processed_at": datetime.now()
+    }
+
 class FirestoreService:
     def __init__(self):
         self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-        if self.project_id:
-            self.db = firestore.Client(project=self.project_id)
-        else:
-            self.db = None
+        self._db = None
+        self._db_lock = threading.Lock()
+    
+    @property
+    def db(self):
+        """Firestoreクライアント（SDKの読み込みが重いため、初回アクセス時に生成する）"""
+        if self._db is None and self.project_id:
+            with self._db_lock:
+                if self._db is None:
+                    from google.cloud import firestore
+                    self._db = firestore.AsyncClient(project=self.project_id)
+        return self._db
+    
+    @db.setter
+    def db(self, db):
+        self._db = db
+    
+    def warm_up(self):
+        """起動後にスレッド上で呼び、SDKを先に読み込んでおく（クライアントはイベントループ上で生成する）"""
+        import google.cloud.firestore  # noqa: F401
     
     async def save_capture(self, capture_data: Dict[str, Any]) -> str:
         """キャプチャデータを保存"""
@@ -19,84 +77,200 @@ class FirestoreService:
         
         capture_id = str(uuid.uuid4())
         capture_data["id"] = capture_id
+        capture_data["shard"] = shard_for_user(capture_data["user_id"])
         
         doc_ref = self.db.collection("users").document(capture_data["user_id"]).collection("captures").document(capture_id)
-        doc_ref.set(capture_data)
+        await doc_ref.set(capture_data)
         
         return capture_id
     
-    async def get_processed_captures(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
-        """処理済みのキャプチャを取得"""
+    async def save_captures(self, captures_data: List[Dict[str, Any]], batch_size: int = 500) -> List[Dict[str, Any]]:
+        """複数のキャプチャをWriteBatchでまとめて保存し、各件のIDとエラーを返す"""
+        results = []
+        for start in range(0, len(captures_data), batch_size):
+            results.extend(await self._save_capture_chunk(captures_data[start:start + batch_size]))
+        return results
+    
+    async def _save_capture_chunk(self, captures_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for capture_data in captures_data:
+            capture_data["id"] = str(uuid.uuid4())
+            capture_data["shard"] = shard_for_user(capture_data["user_id"])
+        if not self.db:
+            return [{"id": capture_data["id"], "error": None} for capture_data in captures_data]
+        
+        batch = self.db.batch()
+        for capture_data in captures_data:
+            batch.set(self.capture_ref(capture_data["user_id"], capture_data["id"]), capture_data)
+        
+        try:
+            await batch.commit()
+            return [{"id": capture_data["id"], "error": None} for capture_data in captures_data]
+        except Exception as e:
+            logger.warning("Batch commit of %d captures failed, retrying individually: %s", len(captures_data), e)
+        
+        # バッチは全件成功か全件失敗のため、1件ずつ書き直して失敗した項目を特定する
+        results = []
+        for capture_data in captures_data:
+            try:
+                await self.capture_ref(capture_data["user_id"], capture_data["id"]).set(capture_data)
+                results.append({"id": capture_data["id"], "error": None})
+            except Exception as e:
+                results.append({"id": None, "error": str(e)})
+        return results
+    
+    async def get_capture(
+        self, user_id: str, capture_id: str, fields: Optional[List[str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """キャプチャを1件取得（fields指定時はそのフィールドだけを読む）"""
+        if not self.db:
+            return None
+        
+        doc = await self.capture_ref(user_id, capture_id).get(field_paths=fields)
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        data["id"] = doc.id
+        data["user_id"] = user_id
+        return data
+    
+    async def iter_user_ids(self) -> AsyncIterator[str]:
+        """ユーザーIDを順次取得（サブコレクションのみを持つユーザーも含む）"""
+        if not self.db:
+            return
+        
+        async for user_ref in self.db.collection("users").list_documents():
+            yield user_ref.id
+    
+    async def get_processed_captures(
+        self, user_id: str, limit: int = 20, cursor: Optional[str] = None, preview: bool = False
+    ) -> List[Dict[str, Any]]:
+        """処理済みのキャプチャを新しい順に取得（cursor指定時はそのキャプチャより古いもの、previewで本文を切り詰める）"""
         if not self.db:
             return []
         
+        from google.cloud import firestore
         captures_ref = (
             self.db.collection("users")
             .document(user_id)
             .collection("captures")
             .where("processed", "==", True)
             .order_by("timestamp", direction=firestore.Query.DESCENDING)
+            .select(CAPTURE_LIST_FIELDS)
             .limit(limit)
         )
+        if cursor:
+            cursor_doc = await self.capture_ref(user_id, cursor).get()
+            if not cursor_doc.exists:
+                return []
+            captures_ref = captures_ref.start_after(cursor_doc)
         
-        docs = captures_ref.stream()
         captures = []
         
-        for doc in docs:
-            data = doc.to_dict()
-            captures.append({
-                "id": data["id"],
-                "type": data["type"],
-                "content": data["content"],
-                "timestamp": data["timestamp"],
-                "processed": data["processed"],
-                "summary": data.get("summary", "")
-            })
+        async for doc in captures_ref.stream():
+            capture = doc.to_dict()
+            capture.setdefault("summary", "")
+            captures.append(capture_preview(capture) if preview else capture)
         
         return captures
     
-    async def get_unprocessed_captures(self) -> List[Dict[str, Any]]:
-        """未処理のキャプチャを取得（バッチ処理用）"""
+    def digest_ref(self, user_id: str):
+        """ユーザーごとのダイジェストドキュメント参照を取得"""
+        return self.db.collection("users").document(user_id).collection("digest").document("latest")
+    
+    async def get_digest(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """事前に集計したダイジェストを1回の読み取りで取得"""
         if not self.db:
-            return []
+            return None
+        
+        doc = await self.digest_ref(user_id).get()
+        return doc.to_dict() if doc.exists else None
+    
+    async def refresh_digest(self, user_id: str, limit: int = DIGEST_SIZE) -> Dict[str, Any]:
+        """最新の処理済みキャプチャからダイジェストを作り直して保存"""
+        digest = {
+            "captures": await self.get_processed_captures(user_id, limit=limit),
+            "updated_at": datetime.now(timezone.utc)
+        }
+        if self.db:
+            await self.digest_ref(user_id).set(digest)
+        return digest
+    
+    async def iter_unprocessed_captures(
+        self,
+        shard: Optional[int] = None,
+        start_after_path: Optional[str] = None,
+        page_size: int = 500
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """未処理のキャプチャをページ単位で順次取得（バッチ処理用）
+        
+        shard指定時はそのシャードのキャプチャのみ、start_after_path指定時はそのキャプチャの後から取得する。
+        取得したキャプチャの"path"をstart_after_pathに渡すと、続きから再開できる。
+        """
+        if not self.db:
+            return
         
-        # 24時間以内の未処理キャプチャを取得
+        # 24時間以内の未処理キャプチャを全ユーザー横断で1つのクエリから取得
         yesterday = datetime.now() - timedelta(days=1)
         
-        captures = []
-        users_ref = self.db.collection("users")
-        
-        for user_doc in users_ref.stream():
-            captures_ref = (
-                user_doc.reference.collection("captures")
-                .where("processed", "==", False)
-                .where("timestamp", ">=", yesterday)
-            )
-            
-            for capture_doc in captures_ref.stream():
-                data = capture_doc.to_dict()
-                data["id"] = capture_doc.id
-                data["user_id"] = user_doc.id
-                captures.append(data)
+        query = self.db.collection_group("captures").where("processed", "==", False)
+        if shard is not None:
+            query = query.where("shard", "==", shard)
+        query = (
+            query
+            .where("timestamp", ">=", yesterday)
+            .order_by("timestamp")
+            .limit(page_size)
+        )
         
-        return captures
+        async def fetch_page(last_doc):
+            page_query = query.start_after(last_doc) if last_doc else query
+            return [doc async for doc in page_query.stream()]
+        
+        start_doc = None
+        if start_after_path:
+            start_doc = await self.db.document(start_after_path).get()
+            # チェックポイントのキャプチャが削除されていれば先頭から（処理済みはクエリで除かれる）
+            if not start_doc.exists:
+                start_doc = None
+        page = await fetch_page(start_doc)
+        while page:
+            # 現在のページを処理している間に次のページを先読みする
+            next_page = None
+            if len(page) == page_size:
+                next_page = asyncio.create_task(fetch_page(page[-1]))
+            
+            try:
+                for capture_doc in page:
+                    data = capture_doc.to_dict()
+                    data["id"] = capture_doc.id
+                    data["user_id"] = capture_doc.reference.parent.parent.id
+                    data["path"] = capture_doc.reference.path
+                    yield data
+            except BaseException:
+                # 途中で打ち切られた場合は先読みを止める
+                if next_page:
+                    next_page.cancel()
+                raise
+            
+            page = await next_page if next_page else []
     
-    async def update_capture_summary(self, capture_id: str, summary: str):
-        """キャプチャの要約を更新"""
+    def capture_ref(self, user_id: str, capture_id: str):
+        """キャプチャのドキュメント参照を取得"""
+        return self.db.collection("users").document(user_id).collection("captures").document(capture_id)
+    
+    async def update_capture_summary(self, user_id: str, capture_id: str, summary: str):
+        """キャプチャの要約を保存し、処理済みにする"""
         if not self.db:
             return
         
-        # Note: In a real implementation, we would need the user_id 
-        # For now, we'll update based on capture_id across all users
-        # This is a simplified implementation for testing
-        return
+        await self.capture_ref(user_id, capture_id).update(summary_update(summary))
     
-    async def save_briefing(self, briefing_data: Dict[str, Any]) -> str:
-        """ブリーフィングを保存"""
+    async def save_briefing(self, briefing_data: Dict[str, Any], briefing_id: Optional[str] = None) -> str:
+        """ブリーフィングを保存（briefing_id指定時はそのIDで上書き保存）"""
         if not self.db:
             return "mock-briefing-id"
         
-        briefing_id = str(uuid.uuid4())
+        briefing_id = briefing_id or str(uuid.uuid4())
         briefing_data["id"] = briefing_id
         
         doc_ref = (
@@ -105,35 +279,45 @@ class FirestoreService:
             .collection("briefings")
             .document(briefing_id)
         )
-        doc_ref.set(briefing_data)
+        await doc_ref.set(briefing_data)
         
         return briefing_id
     
-    async def get_user_briefings(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
-        """ユーザーのブリーフィングを取得"""
+    async def get_briefing(self, user_id: str, briefing_id: str) -> Optional[Dict[str, Any]]:
+        """ブリーフィングを1件取得"""
+        if not self.db:
+            return None
+        
+        doc = await (
+            self.db.collection("users")
+            .document(user_id)
+            .collection("briefings")
+            .document(briefing_id)
+            .get()
+        )
+        return doc.to_dict() if doc.exists else None
+    
+    async def get_user_briefings(self, user_id: str, limit: int = 20, preview: bool = False) -> List[Dict[str, Any]]:
+        """ユーザーのブリーフィングを新しい順に取得（previewで本文を切り詰める）"""
         if not self.db:
             return []
         
+        from google.cloud import firestore
         briefings_ref = (
             self.db.collection("users")
             .document(user_id)
             .collection("briefings")
             .order_by("created_at", direction=firestore.Query.DESCENDING)
+            .select(BRIEFING_LIST_FIELDS)
             .limit(limit)
         )
         
-        docs = briefings_ref.stream()
         briefings = []
         
-        for doc in docs:
-            data = doc.to_dict()
-            briefings.append({
-                "id": data["id"],
-                "event_id": data["event_id"],
-                "event_title": data["event_title"],
-                "event_time": data["event_time"],
-                "briefing_content": data["briefing_content"],
-                "created_at": data["created_at"]
-            })
+        async for doc in briefings_ref.stream():
+            briefing = doc.to_dict()
+            if preview:
+                briefing["briefing_content"] = preview_text(briefing["briefing_content"])
+            briefings.append(briefing)
         
         return briefings
\ No newline at end of file
@@ -1,40 +1,48 @@
 import os
-from typing import Optional
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import httpx
-from bs4 import BeautifulSoup
+import asyncio
+import json
+import logging
+import threading
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from services.page_fetcher import PageFetcher
+from services.content_extractor import ContentExtractor, get_extractor
+from services.text_chunker import chunk_text
+from services.token_estimator import estimate_tokens
+from services.rate_limiter import GeminiRateLimiter
+from services.summary_cache import normalize_url
+from services.metrics import record_gemini_usage, span
 
-class GeminiService:
-    def __init__(self):
-        self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
-        self.location = "asia-northeast1"
-        
-        if self.project_id:
-            vertexai.init(project=self.project_id, location=self.location)
-            self.model = GenerativeModel("gemini-1.5-pro")
-        else:
-            self.model = None
-    
-    async def summarize_url(self, url: str) -> str:
-        """URLの内容を要約"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=10.0)
-                response.raise_for_status()
-                
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            for script in soup(["script", "style", "nav", "header", "footer"]):
-                script.decompose()
-            
-            text = soup.get_text()
-            text = ' '.join(text.split())
-            
-            if len(text) > 5000:
-                text = text[:5000] + "..."
-            
-            prompt = f"""
+logger = logging.getLogger(__name__)
+
+# 生成結果のトークン数の見積もり（TPMの事前確保に使い、実績で補正する）
+ESTIMATED_OUTPUT_TOKENS = 512
+# まとめて要約する場合の1件あたりの出力トークン数の見積もり
+ESTIMATED_BATCH_ITEM_OUTPUT_TOKENS = 200
+
+class GeminiServiceError(Exception):
+    """要約・ブリーフィングの生成に失敗した（エラー文を結果として扱わないよう例外で通知する）"""
+
+def response_usage(response) -> Dict[str, int]:
+    """レスポンスのusage_metadata（取得できない場合は空）"""
+    try:
+        return response.to_dict().get("usage_metadata", {})
+    except Exception:
+        return {}
+
+def response_token_usage(response) -> Optional[int]:
+    """レスポンスの使用トークン数をメトリクスに記録して返す（取得できない場合はNone）"""
+    usage = response_usage(response)
+    record_gemini_usage(usage)
+    return usage.get("total_token_count")
+
+# 要約プロンプトを変更したら上げる（キャッシュ済みの要約を無効化するため）
+SUMMARY_PROMPT_VERSION = "2"
+# 入力の一部しか要約できなかった場合に要約の先頭に付ける注記
+PARTIAL_SUMMARY_NOTE = "※本文が長いため、前半部分のみの要約です。"
+
+def _url_summary_prompt(url: str, content: str) -> str:
+    return f"""
             以下のWebページの内容を日本語で簡潔に要約してください。
             - 重要なポイントを3つ以内で整理
             - 各ポイントは1-2文で説明
@@ -43,56 +51,85 @@ class GeminiService:
             URL: {url}
             
             内容:
-            {text}
+            {content}
             """
-            
-            if self.model:
-                response = self.model.generate_content(prompt)
-                return response.text
-            else:
-                return f"URL: {url}\n内容の要約が利用できません（Gemini APIが設定されていません）"
-                
-        except Exception as e:
-            return f"URL: {url}\n要約中にエラーが発生しました: {str(e)}"
-    
-    async def summarize_text(self, text: str) -> str:
-        """テキストを要約"""
-        try:
-            prompt = f"""
+
+def _text_summary_prompt(content: str) -> str:
+    return f"""
             以下のテキストを日本語で簡潔に要約してください。
             - 重要なポイントを3つ以内で整理
             - 各ポイントは1-2文で説明
             - 読みやすい箇条書き形式で出力
             
             テキスト:
-            {text}
+            {content}
             """
+
+def _batch_text_summary_prompt(texts: List[str]) -> str:
+    items = "\n\n".join(f'<item id="{index}">\n{text}\n</item>' for index, text in enumerate(texts))
+    return f"""
+            以下の<item>タグで区切られた{len(texts)}件のテキストを、それぞれ独立に日本語で簡潔に要約してください。
+            - 重要なポイントを3つ以内で整理
+            - 各ポイントは1-2文で説明
+            - 読みやすい箇条書き形式で出力
             
-            if self.model:
-                response = self.model.generate_content(prompt)
-                return response.text
-            else:
-                return f"テキストの要約が利用できません（Gemini APIが設定されていません）\n\n元のテキスト: {text[:200]}..."
-                
-        except Exception as e:
-            return f"要約中にエラーが発生しました: {str(e)}"
-    
-    async def generate_briefing(self, event: dict) -> str:
-        """カレンダーイベントに基づいてブリーフィングを生成"""
-        try:
-            event_title = event.get("summary", "")
-            event_description = event.get("description", "")
-            attendees = event.get("attendees", [])
-            
-            attendee_emails = [a.get("email", "") for a in attendees if a.get("email")]
+            出力は次の形式のJSON配列のみとし、説明文やコードブロックは付けないでください。
+            [{{"id": 0, "summary": "要約"}}, {{"id": 1, "summary": "要約"}}]
             
-            prompt = f"""
+            {items}
+            """
+
+def parse_batch_summaries(text: str, count: int) -> List[Optional[str]]:
+    """まとめて要約した応答から、入力順の要約を取り出す（取り出せなかった項目はNone）"""
+    summaries: List[Optional[str]] = [None] * count
+    # コードブロックや前置きが付いていても配列部分だけを読む
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return summaries
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return summaries
+    if not isinstance(items, list):
+        return summaries
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, summary = item.get("id"), item.get("summary")
+        if isinstance(index, int) and 0 <= index < count and isinstance(summary, str) and summary.strip():
+            summaries[index] = summary.strip()
+    return summaries
+
+# ブリーフィングに含める関連キャプチャ1件あたりの要約の最大文字数
+RELATED_SUMMARY_CHARS = 400
+
+def _related_section(related: Optional[List[dict]]) -> str:
+    """関連するキャプチャの要約をプロンプトに差し込む節（関連がなければ空）"""
+    if not related:
+        return ""
+    lines = "\n            ".join(
+        "- " + " ".join((capture.get("summary") or capture.get("content", "")).split())[:RELATED_SUMMARY_CHARS]
+        for capture in related
+    )
+    return f"""
+            ユーザーが過去に保存したメモ・記事のうち、このイベントに関連しそうなもの（参考情報）:
+            {lines}
+            """
+
+def _briefing_prompt(event: dict, related: Optional[List[dict]] = None) -> str:
+    event_title = event.get("summary", "")
+    event_description = event.get("description", "")
+    attendees = event.get("attendees", [])
+    
+    attendee_emails = [a.get("email", "") for a in attendees if a.get("email")]
+    
+    return f"""
             以下の会議・イベントに関する事前ブリーフィングを日本語で作成してください。
             
             イベント: {event_title}
             説明: {event_description}
             参加者: {', '.join(attendee_emails)}
-            
+            {_related_section(related)}
             以下の観点でブリーフィングを作成してください：
             1. 会議の目的・重要性
             2. 事前に準備すべき情報や資料
@@ -101,12 +138,258 @@ class GeminiService:
             
             簡潔で実用的な内容にしてください。
             """
+
+class GeminiService:
+    def __init__(
+        self,
+        summary_cache=None,
+        page_fetcher: Optional[PageFetcher] = None,
+        extractor: Optional[ContentExtractor] = None,
+        rate_limiter: Optional[GeminiRateLimiter] = None
+    ):
+        self.project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
+        self.location = "asia-northeast1"
+        self.model_name = "gemini-1.5-pro"
+        self.summary_cache = summary_cache
+        self.page_fetcher = page_fetcher or PageFetcher()
+        self.extractor = extractor or get_extractor()
+        
+        self._model = None
+        self._model_lock = threading.Lock()
+        
+        # URL取得の同時実行数はPageFetcher側で、Gemini呼び出しはレートリミッタで制限する
+        self.rate_limiter = rate_limiter or GeminiRateLimiter()
+        
+        # 長文要約（map-reduce）の設定
+        self.chunk_tokens = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+        self.chunk_concurrency = int(os.getenv("SUMMARY_CHUNK_CONCURRENCY", "4"))
+        self.max_chunks = int(os.getenv("SUMMARY_MAX_CHUNKS", "40"))
+        self.max_reduce_rounds = int(os.getenv("SUMMARY_MAX_REDUCE_ROUNDS", "3"))
+    
+    @property
+    def model(self):
+        """Vertex AIのモデル（SDKの読み込みが重いため、初回アクセス時に初期化する）"""
+        if self._model is None and self.project_id:
+            with self._model_lock:
+                if self._model is None:
+                    import vertexai
+                    from vertexai.generative_models import GenerativeModel
+                    vertexai.init(project=self.project_id, location=self.location)
+                    self._model = GenerativeModel(self.model_name)
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    def warm_up(self):
+        """起動後にスレッド上で呼び、初回リクエストでSDKの読み込みを待たないようにする"""
+        self.model
+    
+    async def _cached_summary(self, kind: str, content: str):
+        """キャッシュキーとキャッシュ済みの要約を返す（キャッシュ無効時は両方None）"""
+        if not (self.summary_cache and self.model):
+            return None, None
+        key = self.summary_cache.key(kind, content, SUMMARY_PROMPT_VERSION, self.model_name)
+        with span("summary_cache_get"):
+            return key, await self.summary_cache.get(key)
+    
+    async def summarize_url(self, url: str) -> str:
+        """URLの内容を要約
+        
+        直近（SUMMARY_CACHE_URL_TTL以内）に要約したURLはページを取得せずに返す。それ以外はページを
+        取得し、URLと本文の組をキャッシュキーにする（更新されたページは要約し直し、変わった部分の
+        チャンクだけがGeminiに送られる）。
+        """
+        try:
+            url_key, cached = await self._cached_summary("url", normalize_url(url))
+            if cached is not None:
+                return cached
+            
+            with span("fetch"):
+                body, content_type = await self.page_fetcher.fetch(url)
+            
+            if content_type == "text/plain":
+                text = ' '.join(body.split())
+            else:
+                # 本文抽出はCPU処理のため、イベントループの外で実行する
+                with span("extract"):
+                    text = await asyncio.to_thread(self.extractor.extract, body)
+            
+            if not self.model:
+                return f"URL: {url}\n内容の要約が利用できません（Gemini APIが設定されていません）"
+            
+            page_key, summary = await self._cached_summary("page", f"{normalize_url(url)} {text}")
+            writes = []
+            if summary is None:
+                summary = await self._summarize_long(text, partial(_url_summary_prompt, url))
+                if page_key:
+                    writes.append(self.summary_cache.set(page_key, summary))
+            if url_key:
+                writes.append(self.summary_cache.set(url_key, summary, ttl=self.summary_cache.url_ttl))
+            await asyncio.gather(*writes)
+            return summary
+                
+        except Exception as e:
+            raise GeminiServiceError(f"URL: {url}\n要約中にエラーが発生しました: {str(e)}") from e
+    
+    async def summarize_text(self, text: str) -> str:
+        """テキストを要約"""
+        try:
+            cache_key, cached = await self._cached_summary("text", text)
+            if cached is not None:
+                return cached
+            
+            if self.model:
+                summary = await self._summarize_long(text, _text_summary_prompt)
+                if cache_key:
+                    await self.summary_cache.set(cache_key, summary)
+                return summary
+            else:
+                return f"テキストの要約が利用できません（Gemini APIが設定されていません）\n\n元のテキスト: {text[:200]}..."
+                
+        except Exception as e:
+            raise GeminiServiceError(f"要約中にエラーが発生しました: {str(e)}") from e
+    
+    async def summarize_texts(self, texts: List[str]) -> List[Optional[str]]:
+        """短いテキストを1回の呼び出しでまとめて要約する
+        
+        応答から取り出せなかった項目はNoneを返すので、呼び出し側でsummarize_textによる個別要約に切り替える。
+        呼び出し自体の失敗（再試行後のRateLimitExceededなど）はsummarize_textと同じく
+        GeminiServiceErrorとして送出し、全件を個別に呼び直して負荷を増やさないようにする。
+        """
+        summaries: List[Optional[str]] = [None] * len(texts)
+        if not self.model:
+            return summaries
+        
+        cached = await asyncio.gather(*(self._cached_summary("text", text) for text in texts))
+        cache_keys = [key for key, _ in cached]
+        summaries = [summary for _, summary in cached]
+        misses = [index for index, summary in enumerate(summaries) if summary is None]
+        if not misses:
+            return summaries
+        
+        prompt = _batch_text_summary_prompt([texts[index] for index in misses])
+        try:
+            with span("gemini_generate_batch"):
+                response = await self.rate_limiter.call(
+                    lambda: self.model.generate_content_async(prompt),
+                    estimated_tokens=estimate_tokens(prompt) + ESTIMATED_BATCH_ITEM_OUTPUT_TOKENS * len(misses),
+                    actual_tokens=response_token_usage
+                )
+        except Exception as e:
+            raise GeminiServiceError(f"{len(misses)}件のまとめての要約中にエラーが発生しました: {str(e)}") from e
+        try:
+            parsed = parse_batch_summaries(response.text, len(misses))
+        except ValueError as e:
+            # 安全フィルタなどで本文のない応答は、項目ごとの個別要約に任せる
+            logger.warning("Batched summary of %d texts has no text: %s", len(misses), e)
+            return summaries
+        
+        for index, summary in zip(misses, parsed):
+            summaries[index] = summary
+        await asyncio.gather(*(
+            self.summary_cache.set(cache_keys[index], summaries[index])
+            for index in misses if cache_keys[index] and summaries[index] is not None
+        ))
+        return summaries
+    
+    async def _generate(self, prompt: str) -> str:
+        """Geminiでテキストを生成（レート制限・再試行付き）"""
+        with span("gemini_generate"):
+            response = await self.rate_limiter.call(
+                lambda: self.model.generate_content_async(prompt),
+                estimated_tokens=estimate_tokens(prompt) + ESTIMATED_OUTPUT_TOKENS,
+                actual_tokens=response_token_usage
+            )
+        return response.text
+    
+    async def _summarize_long(self, text: str, build_prompt: Callable[[str], str]) -> str:
+        """長文は分割して並列に部分要約し（map）、部分要約をまとめて最終要約を作る（reduce）
+        
+        入力の一部しか要約できなかった場合（チャンク数の上限超過、reduceで縮まらない場合）は、
+        要約の先頭にPARTIAL_SUMMARY_NOTEを付けて部分的な要約であることを示す。
+        """
+        chunks = chunk_text(text, self.chunk_tokens)
+        truncated = len(chunks) > self.max_chunks
+        if truncated:
+            logger.warning("Input too long (%d chunks), summarizing the first %d", len(chunks), self.max_chunks)
+            chunks = chunks[:self.max_chunks]
+        if len(chunks) <= 1:
+            return await self._generate(build_prompt(text))
+        
+        partials = await self._summarize_chunks(chunks)
+        merged = "\n\n".join(partials)
+        merged_tokens = estimate_tokens(merged)
+        # 部分要約の合計がまだ長い場合は、部分要約をさらに要約して縮める（回数に上限を設け、縮まなければ打ち切る）
+        for _ in range(self.max_reduce_rounds):
+            if len(partials) <= 1 or merged_tokens <= self.chunk_tokens:
+                break
+            reduced = await self._summarize_chunks(chunk_text(merged, self.chunk_tokens))
+            reduced_merged = "\n\n".join(reduced)
+            reduced_tokens = estimate_tokens(reduced_merged)
+            if reduced_tokens >= merged_tokens:
+                break
+            partials, merged, merged_tokens = reduced, reduced_merged, reduced_tokens
+        if merged_tokens > self.chunk_tokens:
+            logger.warning("Partial summaries did not fit (%d tokens), using the first chunk", merged_tokens)
+            merged = chunk_text(merged, self.chunk_tokens)[0]
+            truncated = True
+        
+        summary = await self._generate(build_prompt(
+            f"（長文のため、分割した各部分の要約を順に示します）\n\n{merged}"
+        ))
+        return f"{PARTIAL_SUMMARY_NOTE}\n{summary}" if truncated else summary
+    
+    async def _summarize_chunks(self, chunks: List[str]) -> List[str]:
+        """チャンクごとの部分要約（チャンクの内容ハッシュでキャッシュする）"""
+        semaphore = asyncio.Semaphore(self.chunk_concurrency)
+        
+        async def summarize_chunk(index: int, chunk: str) -> str:
+            cache_key, cached = await self._cached_summary("chunk", chunk)
+            if cached is not None:
+                return cached
+            async with semaphore:
+                partial = await self._generate(f"""
+            以下は長い文書の一部（{index + 1}/{len(chunks)}）です。
+            この部分に含まれる重要な事実・主張・結論を、後で全体の要約に使えるよう日本語で簡潔にまとめてください。
             
+            {chunk}
+            """)
+            if cache_key:
+                await self.summary_cache.set(cache_key, partial)
+            return partial
+        
+        return await asyncio.gather(*(summarize_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+    
+    async def generate_briefing(self, event: dict, related: Optional[List[dict]] = None) -> str:
+        """カレンダーイベント（と関連するキャプチャ）に基づいてブリーフィングを生成"""
+        try:
             if self.model:
-                response = self.model.generate_content(prompt)
-                return response.text
+                return await self._generate(_briefing_prompt(event, related))
             else:
-                return f"イベント: {event_title}\nブリーフィングが利用できません（Gemini APIが設定されていません）"
+                return f"イベント: {event.get('summary', '')}\nブリーフィングが利用できません（Gemini APIが設定されていません）"
                 
         except Exception as e:
-            return f"ブリーフィング生成中にエラーが発生しました: {str(e)}"
\ No newline at end of file
+            raise GeminiServiceError(f"ブリーフィング生成中にエラーが発生しました: {str(e)}") from e
+    
+    async def stream_briefing(self, event: dict, related: Optional[List[dict]] = None) -> AsyncIterator[str]:
+        """ブリーフィングを生成しながら、生成されたテキストを順に返す"""
+        if not self.model:
+            yield f"イベント: {event.get('summary', '')}\nブリーフィングが利用できません（Gemini APIが設定されていません）"
+            return
+        
+        prompt = _briefing_prompt(event, related)
+        try:
+            # ストリーミングは途中から再試行できないため、制限枠の確保のみ行う
+            async with self.rate_limiter.slot(estimate_tokens(prompt) + ESTIMATED_OUTPUT_TOKENS):
+                with span("gemini_stream"):
+                    response = None
+                    responses = await self.model.generate_content_async(prompt, stream=True)
+                    async for response in responses:
+                        yield response.text
+                    # 使用トークン数は最後のチャンクにまとめて入っている
+                    if response is not None:
+                        record_gemini_usage(response_usage(response))
+        except Exception as e:
+            raise GeminiServiceError(f"ブリーフィング生成中にエラーが発生しました: {str(e)}") from e
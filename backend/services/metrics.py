@@ -0,0 +1,86 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# 外部API呼び出し（数ms〜数十秒）を想定したバケット
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "janus_http_request_duration_seconds",
+    "HTTPリクエストの処理時間（ルートのパステンプレート単位）",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "janus_stage_duration_seconds",
+    "処理段階ごとの所要時間（URL取得・本文抽出・Gemini呼び出し・Firestore書き込みなど）",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+GEMINI_TOKENS = Counter(
+    "janus_gemini_tokens_total",
+    "Geminiの入出力トークン数",
+    ["direction"],
+)
+GEMINI_COST_USD = Counter(
+    "janus_gemini_cost_usd_total",
+    "トークン単価から見積もったGeminiの利用料金（USD）",
+)
+BATCH_CAPTURES = Counter(
+    "janus_batch_captures_total",
+    "バッチ処理・キュー処理したキャプチャ数（結果別）",
+    ["source", "outcome"],
+)
+BATCH_QUEUE_DEPTH = Gauge(
+    "janus_batch_queue_depth",
+    "バッチ処理のワーカー待ちキャプチャ数",
+)
+
+# 料金の見積もりに使う100万トークンあたりの単価（USD）
+GEMINI_INPUT_USD_PER_MTOK = float(os.getenv("GEMINI_INPUT_USD_PER_MTOK", "1.25"))
+GEMINI_OUTPUT_USD_PER_MTOK = float(os.getenv("GEMINI_OUTPUT_USD_PER_MTOK", "5.0"))
+
+_input_tokens = GEMINI_TOKENS.labels("input")
+_output_tokens = GEMINI_TOKENS.labels("output")
+
+# リクエスト単位のトレース（ミドルウェアが設定し、spanが段階名ごとに[合計秒数, 回数]を加算する）
+# 夜間バッチのように1リクエストで数万回spanを通っても、段階の種類数より大きくならない
+_trace: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("janus_trace", default=None)
+
+
+def start_trace() -> Dict[str, List[float]]:
+    """現在のコンテキスト（＝リクエスト）のトレースを開始し、spanが集計される辞書を返す"""
+    spans: Dict[str, List[float]] = {}
+    _trace.set(spans)
+    return spans
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """処理段階の所要時間をヒストグラムと、リクエスト中であればそのトレースに記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        spans = _trace.get()
+        if spans is not None:
+            totals = spans.setdefault(stage, [0.0, 0])
+            totals[0] += elapsed
+            totals[1] += 1
+
+
+def record_gemini_usage(usage: Dict[str, int]):
+    """usage_metadataの入出力トークン数と見積もり料金を記録する"""
+    input_tokens = usage.get("prompt_token_count", 0)
+    output_tokens = usage.get("candidates_token_count", 0)
+    _input_tokens.inc(input_tokens)
+    _output_tokens.inc(output_tokens)
+    GEMINI_COST_USD.inc(
+        (input_tokens * GEMINI_INPUT_USD_PER_MTOK + output_tokens * GEMINI_OUTPUT_USD_PER_MTOK) / 1_000_000
+    )
@@ -0,0 +1,86 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+# 要約対象として取得するContent-Type（それ以外は本文をダウンロードせずに打ち切る）
+ALLOWED_CONTENT_TYPES = {"text/html", "application/xhtml+xml", "text/plain"}
+
+
+class UnsupportedContentError(Exception):
+    """要約できないContent-Typeのページ"""
+
+
+class PageFetcher:
+    """URL取得用の共有HTTPクライアント（接続プール・HTTP/2・ホスト別同時接続数の上限付き）"""
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        per_host_concurrency: Optional[int] = None,
+        timeout: float = 10.0,
+    ):
+        self.max_bytes = max_bytes or int(os.getenv("URL_FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+        self.concurrency = concurrency or int(os.getenv("URL_FETCH_CONCURRENCY", "16"))
+        self.per_host_concurrency = per_host_concurrency or int(os.getenv("URL_FETCH_PER_HOST_CONCURRENCY", "4"))
+        self.client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+            headers={"User-Agent": "JanusAIButler/1.0"},
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        # 取得中・待機中のリクエストがあるホストだけを持つ（ホストごとの利用数が0になったら消す）
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._host_users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def _host_slot(self, host: str) -> AsyncIterator[None]:
+        """ホスト別の同時接続数の枠を取る"""
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        try:
+            async with host_semaphore:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_semaphores[host]
+
+    async def fetch(self, url: str) -> Tuple[str, str]:
+        """ページ本文を上限バイト数まで取得し、(本文, Content-Type) を返す"""
+        host = urlsplit(url).hostname or ""
+
+        # ホストの枠を先に取り、混雑したホストの順番待ちが全体の枠を塞がないようにする
+        async with self._host_slot(host), self._semaphore:
+            async with self.client.stream("GET", url) as response:
+                response.raise_for_status()
+
+                content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                if content_type not in ALLOWED_CONTENT_TYPES:
+                    raise UnsupportedContentError(f"Unsupported content type: {content_type or 'unknown'}")
+
+                # 上限に達したら残りは読まずに接続を閉じる
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body.extend(chunk[:self.max_bytes - len(body)])
+                    if len(body) >= self.max_bytes:
+                        break
+
+                encoding = response.charset_encoding or "utf-8"
+
+        return bytes(body).decode(encoding, errors="replace"), content_type
+
+    async def aclose(self):
+        await self.client.aclose()
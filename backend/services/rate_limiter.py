@@ -0,0 +1,184 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from services.metrics import span
+
+# クォータ超過（速度を落とすべきエラー）
+THROTTLE_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+# 時間をおいて再試行すれば成功しうる一時的なエラー
+TRANSIENT_ERRORS = THROTTLE_ERRORS + (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.Aborted,
+)
+
+
+class TokenBucket:
+    """1分あたりの量で補充されるトークンバケット"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0):
+        """必要量が貯まるまで待って消費する（容量を超える要求は満杯になった時点で通す）
+
+        先に消費して残量を負にしておき（予約）、不足分が貯まる時間だけ待つ。待っている間は
+        何も保持しないため、後から来た要求は自分より前の予約分を含めた時間だけ並行して待つ。
+        """
+        amount = min(amount, self.capacity)
+        self._refill()
+        self.available -= amount
+        if self.available >= 0:
+            return
+        try:
+            await asyncio.sleep(-self.available / self.rate)
+        except asyncio.CancelledError:
+            # 待つのをやめた要求の予約分は返す
+            self.available += amount
+            raise
+
+    def adjust(self, delta: float):
+        """見積もりと実績の差を反映（負の値で追加消費、正の値で返却）"""
+        self._refill()
+        self.available = min(self.capacity, self.available + delta)
+
+
+class AdaptiveConcurrency:
+    """AIMD方式の同時実行数制御（成功で少しずつ増やし、スロットリングで半減、それ以外の失敗では変えない）"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, cooldown: float = 5.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, succeeded: bool = False, throttled: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # 同時に失敗した複数の呼び出しで何度も半減しないよう、一定時間に1回だけ下げる
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RateLimitExceeded(Exception):
+    """再試行してもクォータ超過・一時的エラーが解消しなかった"""
+
+
+class GeminiRateLimiter:
+    """Vertex AI呼び出しの共有レートリミッタ（RPM・TPMのペース配分、適応的同時実行数、ジッタ付き指数バックオフ）"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        min_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        max_concurrency = max_concurrency or int(os.getenv("GEMINI_CONCURRENCY", "8"))
+        self.requests = TokenBucket(requests_per_minute or float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "300")))
+        self.tokens = TokenBucket(tokens_per_minute or float(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000")))
+        self.concurrency = AdaptiveConcurrency(
+            initial=max(1, max_concurrency // 2),
+            minimum=min_concurrency or int(os.getenv("GEMINI_MIN_CONCURRENCY", "1")),
+            maximum=max_concurrency,
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled_count = 0
+        self.retry_count = 0
+
+    async def call(
+        self,
+        request: Callable[[], Awaitable[Any]],
+        estimated_tokens: int,
+        actual_tokens: Optional[Callable[[Any], Optional[int]]] = None,
+    ) -> Any:
+        """requestを制限内で実行し、一時的なエラーは再試行する"""
+        for attempt in range(self.max_retries + 1):
+            with span("gemini_quota_wait"):
+                await self.requests.acquire()
+                await self.tokens.acquire(estimated_tokens)
+                await self.concurrency.acquire()
+            succeeded = throttled = False
+            try:
+                result = await request()
+            except TRANSIENT_ERRORS as e:
+                throttled = isinstance(e, THROTTLE_ERRORS)
+                if throttled:
+                    self.throttled_count += 1
+                if attempt == self.max_retries:
+                    raise RateLimitExceeded(f"Gave up after {attempt + 1} attempts: {e}") from e
+            else:
+                succeeded = True
+                if actual_tokens:
+                    used = actual_tokens(result)
+                    if used:
+                        self.tokens.adjust(estimated_tokens - used)
+                return result
+            finally:
+                await self.concurrency.release(succeeded=succeeded, throttled=throttled)
+
+            # フルジッタ: 多数の呼び出しが同時に再試行して再びクォータを超えるのを避ける
+            self.retry_count += 1
+            await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """再試行できない呼び出し（ストリーミング等）用に、制限枠だけを確保する"""
+        with span("gemini_quota_wait"):
+            await self.requests.acquire()
+            await self.tokens.acquire(estimated_tokens)
+            await self.concurrency.acquire()
+        succeeded = throttled = False
+        try:
+            yield
+            succeeded = True
+        except THROTTLE_ERRORS:
+            throttled = True
+            self.throttled_count += 1
+            raise
+        finally:
+            await self.concurrency.release(succeeded=succeeded, throttled=throttled)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "throttled_count": self.throttled_count,
+            "retry_count": self.retry_count,
+        }
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# 要約結果に影響しないトラッキング用クエリパラメータ
+_TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "mc_cid", "mc_eid", "ref", "ref_src"}
+
+
+def normalize_url(url: str) -> str:
+    """同じページを指すURLが同じキーになるよう正規化"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
+
+
+def normalize_text(text: str) -> str:
+    """空白の違いだけのテキストが同じキーになるよう正規化"""
+    return " ".join(text.split())
+
+
+class SummaryCache:
+    """ユーザー横断の要約キャッシュ（プロセス内LRU + Firestore永続層）"""
+
+    COLLECTION = "summary_cache"
+
+    def __init__(
+        self,
+        firestore_service,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        persistent_ttl: Optional[float] = None,
+    ):
+        self.firestore_service = firestore_service
+        self.max_entries = max_entries or int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+        self.ttl = ttl or float(os.getenv("SUMMARY_CACHE_TTL", str(6 * 3600)))
+        self.persistent_ttl = persistent_ttl or float(os.getenv("SUMMARY_CACHE_PERSISTENT_TTL", str(30 * 86400)))
+        # URLをキーにした要約（ページを取得せずに返す）の有効期間。ページの更新はこの時間内に反映される
+        self.url_ttl = float(os.getenv("SUMMARY_CACHE_URL_TTL", "3600"))
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def key(self, kind: str, content: str, prompt_version: str, model_name: str) -> str:
+        """正規化済みの内容・プロンプト版・モデル名からキャッシュキーを生成"""
+        normalized = normalize_text(content)
+        raw = "\x1f".join((kind, prompt_version, model_name, normalized))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """キャッシュを参照（メモリ → Firestoreの順）"""
+        entry = self._entries.get(key)
+        if entry:
+            expires_at, summary = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return summary
+            del self._entries[key]
+
+        summary = await self._get_persistent(key)
+        if summary is not None:
+            self.persistent_hits += 1
+            self._remember(key, summary)
+            return summary
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, summary: str, ttl: Optional[float] = None):
+        """要約をキャッシュに保存（ttlを指定すると、メモリ・Firestoreともにその時間で期限切れにする）"""
+        self._remember(key, summary, ttl)
+
+        db = self.firestore_service.db
+        if not db:
+            return
+        try:
+            await db.collection(self.COLLECTION).document(key).set({
+                "summary": summary,
+                "created_at": datetime.now(timezone.utc),
+                # FirestoreのTTLポリシーでこの時刻以降に自動削除される
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl or self.persistent_ttl),
+            })
+        except Exception as e:
+            logger.warning("Summary cache write failed: %s", e)
+
+    async def _get_persistent(self, key: str) -> Optional[str]:
+        db = self.firestore_service.db
+        if not db:
+            return None
+        try:
+            doc = await db.collection(self.COLLECTION).document(key).get()
+        except Exception as e:
+            logger.warning("Summary cache read failed: %s", e)
+            return None
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        if data["expires_at"] <= datetime.now(timezone.utc):
+            return None
+        return data["summary"]
+
+    def _remember(self, key: str, summary: str, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + min(ttl or self.ttl, self.ttl), summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット・ミスの集計"""
+        hits = self.memory_hits + self.persistent_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
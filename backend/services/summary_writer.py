@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.firestore_service import summary_update
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Firestoreの1バッチあたりの書き込み上限
+MAX_BATCH_SIZE = 500
+
+
+class SummaryWriter:
+    """要約の書き戻しをWriteBatchにまとめ、件数と経過時間で自動フラッシュする"""
+
+    def __init__(
+        self,
+        firestore_service,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ):
+        self.firestore_service = firestore_service
+        self.batch_size = min(batch_size or int(os.getenv("SUMMARY_WRITE_BATCH_SIZE", "200")), MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval or float(os.getenv("SUMMARY_WRITE_FLUSH_INTERVAL", "2.0"))
+        self.written_count = 0
+        self.commit_count = 0
+        self.failures: List[Dict[str, str]] = []
+        # ダイジェストと検索インデックスの更新対象（ユーザーID, キャプチャID, 要約）
+        self.written: List[Tuple[str, str, str]] = []
+        self._pending: List[Tuple[str, str, str]] = []
+        self._oldest_pending_at = 0.0
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+    async def add(self, user_id: str, capture_id: str, summary: str):
+        """書き戻し対象を追加（バッチサイズに達したらその場でコミット）"""
+        if not self._pending:
+            self._oldest_pending_at = time.monotonic()
+        self._pending.append((user_id, capture_id, summary))
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """溜まっている書き込みをコミット"""
+        async with self._lock:
+            while self._pending:
+                chunk = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                await self._commit(chunk)
+            self._oldest_pending_at = 0.0
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval / 2)
+            if self._pending and time.monotonic() - self._oldest_pending_at >= self.flush_interval:
+                await self.flush()
+
+    async def _commit(self, chunk: List[Tuple[str, str, str]]):
+        db = self.firestore_service.db
+        if not db:
+            return
+
+        batch = db.batch()
+        for user_id, capture_id, summary in chunk:
+            batch.update(self.firestore_service.capture_ref(user_id, capture_id), summary_update(summary))
+
+        try:
+            with span("firestore_summary_commit"):
+                await batch.commit()
+            self.commit_count += 1
+            self.written_count += len(chunk)
+            self.written.extend(chunk)
+            return
+        except Exception as e:
+            logger.warning("Batch commit of %d summaries failed, retrying individually: %s", len(chunk), e)
+
+        # バッチは全件成功か全件失敗のため、1件ずつ書き直して失敗したドキュメントを特定する
+        for user_id, capture_id, summary in chunk:
+            try:
+                await self.firestore_service.update_capture_summary(user_id, capture_id, summary)
+                self.written_count += 1
+                self.written.append((user_id, capture_id, summary))
+            except Exception as e:
+                self.failures.append({"user_id": user_id, "capture_id": capture_id, "error": str(e)})
+
+    def take_written(self) -> List[Tuple[str, str, str]]:
+        """前回の呼び出し以降に書き込んだ(ユーザーID, キャプチャID, 要約)を返す"""
+        written, self.written = self.written, []
+        return written
+
+    def report(self) -> Dict[str, Any]:
+        """書き込み結果の集計"""
+        return {
+            "written_count": self.written_count,
+            "commit_count": self.commit_count,
+            "write_failed_count": len(self.failures),
+            "write_failures": self.failures[:100],
+        }
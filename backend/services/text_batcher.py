@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TextSummaryBatcher:
+    """短いテキストの要約依頼を集め、トークン予算の範囲で1回のGemini呼び出しにまとめる
+
+    件数か入力トークン数が上限に達するか、最初の依頼から一定時間経つとまとめて送る。
+    応答から要約を取り出せなかった項目は、summarize_textで個別に要約し直す。
+    呼び出し自体が失敗した場合は、まとめた全件の依頼元にGeminiServiceErrorを返す（キューの再試行とバックオフに任せる）。
+    """
+
+    def __init__(
+        self,
+        gemini_service,
+        max_items: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        max_item_tokens: Optional[int] = None,
+        linger: Optional[float] = None,
+    ):
+        self.gemini_service = gemini_service
+        self.max_items = max_items or int(os.getenv("TEXT_BATCH_MAX_ITEMS", "20"))
+        self.token_budget = token_budget or int(os.getenv("TEXT_BATCH_TOKEN_BUDGET", "8000"))
+        # これより長いテキストはまとめずに個別に要約する
+        self.max_item_tokens = max_item_tokens or int(os.getenv("TEXT_BATCH_MAX_ITEM_TOKENS", "600"))
+        self.linger = linger or float(os.getenv("TEXT_BATCH_LINGER_MS", "100")) / 1000
+        self.batch_count = 0
+        self.batched_item_count = 0
+        self.fallback_count = 0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def accepts(self, text: str) -> bool:
+        """まとめて要約する対象か（短いテキストのみ）"""
+        return estimate_tokens(text) <= self.max_item_tokens
+
+    async def summarize(self, text: str) -> str:
+        """他の依頼とまとめて要約する（まとめた応答から取り出せなければ個別に要約し、呼び出しの失敗は送出する）"""
+        tokens = estimate_tokens(text)
+        if self._pending and self._pending_tokens + tokens > self.token_budget:
+            self._flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_items or self._pending_tokens >= self.token_budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._flush)
+
+        summary = await future
+        if summary is None:
+            self.fallback_count += 1
+            summary = await self.gemini_service.summarize_text(text)
+        return summary
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        task = asyncio.create_task(self._summarize_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarize_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in batch]
+        try:
+            summaries = await self.gemini_service.summarize_texts(texts)
+        except Exception as e:
+            logger.warning("Batched summary of %d texts failed: %s", len(texts), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batch_count += 1
+        self.batched_item_count += len(texts)
+        for (_, future), summary in zip(batch, summaries):
+            # タイムアウトで待つのをやめた依頼は結果を捨てる
+            if not future.done():
+                future.set_result(summary)
+
+    def stats(self) -> Dict[str, Any]:
+        """まとめた呼び出し数と個別要約への切り替え数"""
+        return {
+            "batch_count": self.batch_count,
+            "batched_item_count": self.batched_item_count,
+            "fallback_count": self.fallback_count,
+            "items_per_batch": round(self.batched_item_count / self.batch_count, 2) if self.batch_count else 0.0,
+        }
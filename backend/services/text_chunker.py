@@ -0,0 +1,63 @@
+import re
+import zlib
+from typing import List
+
+from services.token_estimator import estimate_tokens
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[。！？!?.])\s+|(?<=[。！？])")
+
+
+def _split_units(text: str, max_tokens: int) -> List[str]:
+    """段落 → 文 → 固定長の順に、max_tokensを超えない単位へ分割"""
+    units = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            # 1文字は最低1トークン以上と見積もるため、max_tokens文字で切れば必ず収まる
+            for start in range(0, len(sentence), max_tokens):
+                units.append(sentence[start:start + max_tokens])
+    return units
+
+
+def chunk_text(text: str, max_tokens: int) -> List[str]:
+    """テキストをトークン数の上限内のチャンクに分割
+
+    区切り位置は文の内容のハッシュで決める（content-defined chunking）。
+    文書の一部が編集されても、変更箇所から離れたチャンクは同じ内容のまま残るため、
+    チャンク単位の要約キャッシュが再利用できる。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text] if text.strip() else []
+
+    units = _split_units(text, max_tokens)
+    # 連結時の区切り（空行）の分として1トークンずつ加える
+    unit_tokens = [estimate_tokens(unit) + 1 for unit in units]
+    min_tokens = max_tokens // 4
+    # 平均チャンクが上限の半分程度になるよう、境界とみなす確率を決める
+    average_unit = max(1, sum(unit_tokens) // len(units))
+    divisor = max(1, (max_tokens // 2 - min_tokens) // average_unit)
+
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit, tokens in zip(units, unit_tokens):
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+        if current_tokens >= min_tokens and zlib.crc32(unit.encode("utf-8")) % divisor == 0:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
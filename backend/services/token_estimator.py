@@ -0,0 +1,10 @@
+import re
+
+# CJK文字（ひらがな・カタカナ・漢字・全角記号）は概ね1文字1トークン
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """トークナイザを呼ばずにトークン数を概算（CJKは1文字1トークン、それ以外は4文字1トークン）"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
@@ -0,0 +1,343 @@
+import asyncio
+import itertools
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.metrics import BATCH_CAPTURES
+
+logger = logging.getLogger(__name__)
+
+# キューアイテムの状態（pendingとleasedはavailable_atを過ぎると取得可能になる）
+PENDING = "pending"
+LEASED = "leased"
+DEAD = "dead"
+
+
+class CaptureWorkQueue:
+    """Firestore上の永続ワークキュー（リース付きで取得し、失敗時は回数上限まで再試行する）"""
+
+    COLLECTION = "capture_queue"
+
+    def __init__(
+        self,
+        firestore_service,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retry_base_delay: float = 30.0,
+    ):
+        self.firestore_service = firestore_service
+        self.lease_seconds = lease_seconds or float(os.getenv("CAPTURE_QUEUE_LEASE_SECONDS", "300"))
+        self.max_attempts = max_attempts or int(os.getenv("CAPTURE_QUEUE_MAX_ATTEMPTS", "5"))
+        self.retry_base_delay = retry_base_delay
+        # メトリクス用に状態ごとの件数を数え直す間隔（0で無効）
+        self.stats_interval = float(os.getenv("CAPTURE_QUEUE_STATS_INTERVAL", "60"))
+        self._counts: Dict[str, int] = {}
+        self._refresher: Optional[asyncio.Task] = None
+
+    @property
+    def db(self):
+        return self.firestore_service.db
+
+    def _ref(self, capture_id: str):
+        return self.db.collection(self.COLLECTION).document(capture_id)
+
+    async def start(self):
+        """状態ごとの件数を定期的に数え直すタスクを開始"""
+        if self.stats_interval > 0:
+            self._refresher = asyncio.create_task(self._refresh_counts_periodically())
+
+    async def aclose(self):
+        if self._refresher:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+
+    async def count_by_status(self) -> Dict[str, int]:
+        """状態ごとのアイテム数（集計クエリで数え、アイテム自体は読まない）"""
+        if not self.db:
+            return {}
+        statuses = (PENDING, LEASED, DEAD)
+        results = await asyncio.gather(*(
+            self.db.collection(self.COLLECTION).where("status", "==", status).count().get()
+            for status in statuses
+        ))
+        return {status: int(result[0][0].value) for status, result in zip(statuses, results)}
+
+    async def _refresh_counts_periodically(self):
+        while True:
+            # 起動直後のSDKの読み込みと重ならないよう、最初の集計も間隔を空けてから行う
+            await asyncio.sleep(self.stats_interval)
+            try:
+                self._counts = await self.count_by_status()
+            except Exception as e:
+                logger.warning("Failed to count capture queue items: %s", e)
+
+    def stats(self) -> Dict[str, int]:
+        """直近に数えた状態ごとの件数（depthは未処理とリース中の合計）"""
+        if not self._counts:
+            return {}
+        return {
+            "depth": self._counts[PENDING] + self._counts[LEASED],
+            "pending": self._counts[PENDING],
+            "leased": self._counts[LEASED],
+            "dead": self._counts[DEAD],
+        }
+
+    @staticmethod
+    def item_data(user_id: str, capture_id: str) -> Dict[str, Any]:
+        """新規キューアイテムの内容"""
+        now = datetime.now(timezone.utc)
+        return {
+            "user_id": user_id,
+            "capture_id": capture_id,
+            "status": PENDING,
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now,
+        }
+
+    async def enqueue(self, user_id: str, capture_id: str):
+        """キャプチャの要約処理をキューに追加"""
+        if not self.db:
+            return
+        await self._ref(capture_id).set(self.item_data(user_id, capture_id))
+
+    async def enqueue_many(self, items: List[Tuple[str, str]], batch_size: int = 500):
+        """複数のキャプチャをWriteBatchでまとめてキューに追加"""
+        if not self.db:
+            return
+        for start in range(0, len(items), batch_size):
+            batch = self.db.batch()
+            for user_id, capture_id in items[start:start + batch_size]:
+                batch.set(self._ref(capture_id), self.item_data(user_id, capture_id))
+            await batch.commit()
+
+    async def claim(self, worker_id: str, max_items: int) -> List[Dict[str, Any]]:
+        """取得可能なアイテムをリース付きで最大max_items件取得"""
+        if not self.db:
+            return []
+
+        now = datetime.now(timezone.utc)
+        query = (
+            self.db.collection(self.COLLECTION)
+            .where("status", "in", [PENDING, LEASED])
+            .where("available_at", "<=", now)
+            .order_by("available_at")
+            .limit(max_items * 3)
+        )
+        candidates = [doc.reference async for doc in query.stream()]
+        # 複数のワーカーが同じ先頭アイテムを奪い合わないよう、候補の順序をばらす
+        random.shuffle(candidates)
+
+        # 必要な件数ずつトランザクションを並列に実行し、取れなかった分は次の候補で補う
+        claimed = []
+        remaining = iter(candidates)
+        while len(claimed) < max_items:
+            refs = list(itertools.islice(remaining, max_items - len(claimed)))
+            if not refs:
+                break
+            items = await asyncio.gather(*(self._claim_one(ref, worker_id) for ref in refs))
+            claimed.extend(item for item in items if item)
+        return claimed
+
+    async def _claim_one(self, ref, worker_id: str) -> Optional[Dict[str, Any]]:
+        from google.cloud import firestore
+
+        @firestore.async_transactional
+        async def claim_in_transaction(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            data = snapshot.to_dict()
+            now = datetime.now(timezone.utc)
+            # 候補を読んでから他のワーカーが取得済みの場合は諦める
+            if data["status"] not in (PENDING, LEASED) or data["available_at"] > now:
+                return None
+            # 処理中にリースが切れ続けたアイテム（fail()を経ずに上限に達したもの）はここでdeadにする
+            if data["attempts"] >= self.max_attempts:
+                transaction.update(ref, {"status": DEAD, "last_error": "lease expired after max attempts"})
+                return None
+            update = {
+                "status": LEASED,
+                "lease_owner": worker_id,
+                "available_at": now + timedelta(seconds=self.lease_seconds),
+                "attempts": data["attempts"] + 1,
+            }
+            transaction.update(ref, update)
+            return {**data, **update, "id": ref.id}
+
+        try:
+            return await claim_in_transaction(self.db.transaction())
+        except Exception as e:
+            # 競合で取得できなかったアイテムは他のワーカーに任せる
+            logger.info("Failed to claim queue item %s: %s", ref.id, e)
+            return None
+
+    async def complete(self, item: Dict[str, Any]):
+        """処理済みのアイテムを削除"""
+        await self._ref(item["id"]).delete()
+
+    async def fail(self, item: Dict[str, Any], error: str):
+        """失敗したアイテムを指数バックオフ後に再試行させる（上限回数を超えたらdeadにする）"""
+        if item["attempts"] >= self.max_attempts:
+            await self._ref(item["id"]).update({"status": DEAD, "last_error": error})
+            return
+        delay = self.retry_base_delay * 2 ** (item["attempts"] - 1)
+        await self._ref(item["id"]).update({
+            "status": PENDING,
+            "available_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+            "last_error": error,
+        })
+
+
+class CaptureQueueWorker:
+    """キューからキャプチャを取得して要約する（複数インスタンスで同時に実行できる）
+
+    取得役のタスクがバッファを補充し続け、concurrency本のワーカーがそこから取り出して処理する。
+    書き込んだ要約は複数回の取得にまたがって溜め、件数か経過時間のしきい値で
+    after_write（検索インデックスとダイジェストの更新）にユーザーごとにまとめて渡す。
+    """
+
+    def __init__(
+        self,
+        work_queue: CaptureWorkQueue,
+        batch_processor,
+        concurrency: Optional[int] = None,
+        flush_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ):
+        self.work_queue = work_queue
+        self.batch_processor = batch_processor
+        self.firestore_service = batch_processor.firestore_service
+        self.concurrency = concurrency or int(os.getenv("CAPTURE_QUEUE_CONCURRENCY", "8"))
+        self.flush_size = flush_size or int(os.getenv("CAPTURE_QUEUE_FLUSH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("CAPTURE_QUEUE_FLUSH_SECONDS", "10"))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # ダイジェストと検索インデックスの更新対象（ユーザーID, キャプチャID, 要約）
+        self.written: List[Tuple[str, str, str]] = []
+        self._flush_lock = asyncio.Lock()
+
+    async def run(self, max_seconds: float) -> Dict[str, Any]:
+        """キューが空になるか、max_secondsが経過するまで処理する（取得済みのアイテムは処理し切る）"""
+        started_at = time.monotonic()
+        counts = Counter()
+        buffer: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+        text_batcher = self.batch_processor.text_batcher
+        # まとめて要約するテキストはワーカーを塞がないよう別タスクで待つ（BatchProcessorと同じく2バッチ分まで）
+        batched_slots = asyncio.Semaphore(text_batcher.max_items * 2 if text_batcher else 0)
+        batched: Set[asyncio.Task] = set()
+        workers = [
+            asyncio.create_task(self._worker(buffer, counts, batched_slots, batched))
+            for _ in range(self.concurrency)
+        ]
+        flusher = asyncio.create_task(self._flush_periodically())
+        try:
+            while time.monotonic() - started_at < max_seconds:
+                items = await self.work_queue.claim(self.worker_id, self.concurrency)
+                if not items:
+                    break
+                for item in items:
+                    # バッファが埋まっている間は待つため、リース済みで未着手のアイテムは2×concurrency件まで
+                    await buffer.put(item)
+            for _ in workers:
+                await buffer.put(None)
+            await asyncio.gather(*workers)
+            await asyncio.gather(*list(batched))
+        finally:
+            tasks = [flusher, *workers, *batched]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush()
+
+        return {
+            "worker_id": self.worker_id,
+            "processed_count": counts["processed"],
+            "retry_count": counts["retry"],
+            "dead_count": counts["dead"],
+            "skipped_count": counts["skipped"],
+            "elapsed_seconds": round(time.monotonic() - started_at, 3),
+        }
+
+    async def _worker(
+        self,
+        buffer: asyncio.Queue,
+        counts: Counter,
+        batched_slots: asyncio.Semaphore,
+        batched: Set[asyncio.Task],
+    ):
+        while True:
+            item = await buffer.get()
+            if item is None:
+                return
+            try:
+                capture = await self.firestore_service.get_capture(item["user_id"], item["capture_id"])
+            except Exception as e:
+                self._record(counts, await self._fail(item, e))
+                continue
+            if capture and not capture.get("processed") and self.batch_processor.batchable(capture):
+                await batched_slots.acquire()
+                task = asyncio.create_task(self._process_and_record(item, capture, counts))
+                batched.add(task)
+                task.add_done_callback(batched.discard)
+                task.add_done_callback(lambda _: batched_slots.release())
+                continue
+            await self._process_and_record(item, capture, counts)
+
+    async def _process_and_record(self, item: Dict[str, Any], capture: Optional[Dict[str, Any]], counts: Counter):
+        self._record(counts, await self.process_item(item, capture))
+        if len(self.written) >= self.flush_size:
+            await self.flush()
+
+    @staticmethod
+    def _record(counts: Counter, result: str):
+        counts[result] += 1
+        BATCH_CAPTURES.labels("queue", result).inc()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """溜まった要約をafter_writeに渡す（同時に1回だけ実行する）"""
+        async with self._flush_lock:
+            written, self.written = self.written, []
+            if written:
+                await self.batch_processor.after_write(written)
+
+    async def process_item(self, item: Dict[str, Any], capture: Optional[Dict[str, Any]]) -> str:
+        """取得済みのキャプチャ1件を処理し、結果の種別を返す"""
+        try:
+            # 削除済み・夜間バッチで処理済みのキャプチャはそのまま完了にする
+            if not capture or capture.get("processed"):
+                await self.work_queue.complete(item)
+                return "skipped"
+
+            summary = await self.batch_processor.summarize_capture(capture)
+            if summary is not None:
+                await self.firestore_service.update_capture_summary(item["user_id"], item["capture_id"], summary)
+                self.written.append((item["user_id"], item["capture_id"], summary))
+            await self.work_queue.complete(item)
+            return "processed" if summary is not None else "skipped"
+
+        except Exception as e:
+            return await self._fail(item, e)
+
+    async def _fail(self, item: Dict[str, Any], e: Exception) -> str:
+        """失敗したアイテムを再試行かdeadにし、結果の種別を返す"""
+        error = str(e) or type(e).__name__
+        logger.error("Error processing queued capture %s (attempt %d): %s", item["capture_id"], item["attempts"], error)
+        try:
+            await self.work_queue.fail(item, error)
+        except Exception as fail_error:
+            # 更新できなくてもリース切れで再取得される
+            logger.warning("Failed to release queue item %s: %s", item["id"], fail_error)
+        return "dead" if item["attempts"] >= self.work_queue.max_attempts else "retry"
@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+
+import httpx
+
+from api import auth
+from api.main import app
+from benchmarks.fakes import fake_services, override_dependencies
+
+
+class SchedulerAuthTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        override_dependencies(app, fake_services())
+        self.addCleanup(app.dependency_overrides.clear)
+        transport = httpx.ASGITransport(app=app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def precompute(self, **headers) -> httpx.Response:
+        return await self.client.post("/future/precompute-briefings", headers=headers)
+
+    async def test_precompute_requires_scheduler_token(self):
+        with mock.patch.object(auth, "SCHEDULER_SECRET", "s3cret"):
+            missing = await self.precompute()
+            wrong = await self.precompute(**{"X-Scheduler-Token": "guess"})
+            ok = await self.precompute(**{"X-Scheduler-Token": "s3cret"})
+
+        self.assertEqual(missing.status_code, 403)
+        self.assertEqual(wrong.status_code, 403)
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(ok.json()["failed_count"], 0)
+
+    async def test_precompute_is_disabled_without_secret(self):
+        with mock.patch.object(auth, "SCHEDULER_SECRET", ""):
+            response = await self.precompute(**{"X-Scheduler-Token": ""})
+
+        self.assertEqual(response.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fakes import fake_services
+from services.batch_processor import BatchProcessor
+from services.batch_shards import DONE, LEASED, ShardedBatchProcessor
+from services.firestore_service import CAPTURE_SHARD_COUNT
+
+
+class ShardedBatchTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.services = fake_services()
+        self.firestore = self.services.firestore_service
+
+    def sharded(self, run_id: str = "run-1") -> ShardedBatchProcessor:
+        processor = BatchProcessor(self.firestore, self.services.gemini_service)
+        return ShardedBatchProcessor(processor, run_id=run_id)
+
+    async def capture(self, user_id: str, shard="keep") -> tuple:
+        capture_id = await self.firestore.save_capture({
+            "user_id": user_id,
+            "type": "text",
+            "content": f"{user_id}のメモ",
+            "timestamp": datetime.now(),
+            "processed": False,
+        })
+        path = ("users", user_id, "captures", capture_id)
+        if shard is None:
+            del self.firestore.db.docs[path]["shard"]
+        elif shard != "keep":
+            self.firestore.db.docs[path]["shard"] = shard
+        return user_id, capture_id
+
+    async def processed(self, user_id: str, capture_id: str) -> bool:
+        return (await self.firestore.get_capture(user_id, capture_id))["processed"]
+
+    async def test_all_shards_complete_and_unsharded_captures_are_swept(self):
+        captures = [await self.capture(f"u{i}") for i in range(8)]
+        captures.append(await self.capture("legacy", shard=None))
+        captures.append(await self.capture("resharded", shard=CAPTURE_SHARD_COUNT + 3))
+
+        result = await self.sharded().run(max_seconds=30)
+
+        self.assertEqual(sorted(result["completed_shards"]), list(range(CAPTURE_SHARD_COUNT + 1)))
+        self.assertEqual(result["progress"]["done_shards"], CAPTURE_SHARD_COUNT + 1)
+        self.assertEqual(result["progress"]["processed_count"], len(captures))
+        for user_id, capture_id in captures:
+            self.assertTrue(await self.processed(user_id, capture_id))
+
+    async def test_done_run_is_not_reprocessed_but_new_run_is_separate(self):
+        await self.capture("u1")
+        await self.sharded().run(max_seconds=30)
+
+        again = await self.sharded().run(max_seconds=30)
+        other = await self.sharded(run_id="run-2").run(max_seconds=30)
+
+        self.assertEqual(again["completed_shards"], [])
+        self.assertEqual(len(other["completed_shards"]), CAPTURE_SHARD_COUNT + 1)
+
+    async def test_live_lease_is_skipped_and_expired_lease_is_taken_over(self):
+        first = self.sharded()
+        second = self.sharded()
+        self.assertIsNotNone(await first._claim(0))
+        self.assertIsNone(await second._claim(0))
+
+        lease = self.firestore.db.docs[("batch_shards", "run-1-0000")]
+        self.assertEqual(lease["status"], LEASED)
+        lease["lease_expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+        taken = await second._claim(0)
+        self.assertEqual(taken["lease_owner"], second.worker_id)
+
+        lease["status"] = DONE
+        self.assertIsNone(await first._claim(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from datetime import date, timedelta
+
+from benchmarks.fakes import fake_services
+from services.briefing_scheduler import BriefingScheduler
+
+
+class AllDayCalendar:
+    """終日の予定（start.dateのみ）を1件だけ返すカレンダー"""
+
+    def __init__(self):
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        self.event = {
+            "id": "all-day-event",
+            "summary": "社内研修",
+            "description": "終日の研修",
+            "start": {"date": tomorrow},
+            "end": {"date": tomorrow},
+            "attendees": [],
+            "updated": "2026-01-01T00:00:00Z",
+        }
+
+    async def get_events_for_briefing(self, user_id, hours_ahead=24):
+        return [self.event]
+
+
+class AllDayBriefingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_all_day_event_is_generated_once(self):
+        services = fake_services()
+        await services.firestore_service.save_capture({"user_id": "u1", "type": "text", "content": "メモ"})
+        model = services.gemini_service.model
+        scheduler = BriefingScheduler(AllDayCalendar(), services.briefing_service, services.firestore_service)
+
+        first = await scheduler.run()
+        second = await scheduler.run()
+
+        self.assertEqual(first["generated_count"], 1)
+        self.assertEqual(first["failed_count"], 0)
+        self.assertEqual(second["up_to_date_count"], 1)
+        self.assertEqual(model.faults.calls, 1)
+
+        briefing = await services.briefing_service.lookup("u1", AllDayCalendar().event)
+        self.assertEqual(briefing["event_time"], AllDayCalendar().event["start"]["date"])
+
+
+class FlakyCalendar(AllDayCalendar):
+    """u2の予定の取得だけ失敗するカレンダー"""
+
+    async def get_events_for_briefing(self, user_id, hours_ahead=24):
+        if user_id == "u2":
+            raise RuntimeError("calendar unavailable")
+        return [self.event]
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_user_does_not_stop_others_and_briefing_is_looked_up_once(self):
+        services = fake_services()
+        for user_id in ("u1", "u2"):
+            await services.firestore_service.save_capture({"user_id": user_id, "type": "text", "content": "メモ"})
+        firestore = services.firestore_service
+        lookups = []
+        get_briefing = firestore.get_briefing
+
+        async def counting_get_briefing(user_id, briefing_id):
+            lookups.append(user_id)
+            return await get_briefing(user_id, briefing_id)
+
+        firestore.get_briefing = counting_get_briefing
+        scheduler = BriefingScheduler(FlakyCalendar(), services.briefing_service, firestore)
+
+        result = await scheduler.run()
+
+        self.assertEqual(result["generated_count"], 1)
+        self.assertEqual(result["failed_user_count"], 1)
+        self.assertEqual(lookups, ["u1"])
+
+
+class StreamCoalescingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_streams_share_one_generation(self):
+        services = fake_services()
+        event = AllDayCalendar().event
+        model = services.gemini_service.model
+
+        first = services.briefing_service.start("u1", event, stream=True)
+        second = services.briefing_service.start("u1", event, stream=True)
+        later = services.briefing_service.start("u1", event)
+
+        async def read(generation):
+            return "".join([text async for text in generation.tail()])
+
+        texts = await asyncio.gather(read(first), read(second), read(later))
+        briefing = await later.result()
+
+        self.assertIs(first, second)
+        self.assertEqual(model.faults.calls, 1)
+        self.assertEqual(texts, [briefing["briefing_content"]] * 3)
+
+    async def test_limiter_slot_is_released_before_the_client_reads(self):
+        services = fake_services()
+        generation = services.briefing_service.start("u1", AllDayCalendar().event, stream=True)
+
+        # クライアントが1トークンも読まないうちに生成と保存が終わる
+        await generation.result()
+
+        self.assertEqual(services.gemini_service.rate_limiter.concurrency.in_flight, 0)
+        self.assertGreater(len(generation.parts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
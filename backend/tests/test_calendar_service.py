@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from services.calendar_service import CalendarService
+
+
+class RecordingEvents:
+    """events().list()の引数を記録し、空の同期結果を返す"""
+
+    def __init__(self):
+        self.calls = []
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        self.calls.append(dict(params))
+        return {"items": [], "nextSyncToken": f"token-{len(self.calls)}"}
+
+
+class CalendarSyncTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.api = RecordingEvents()
+        self.calendar = CalendarService()
+        self.calendar._service = self.api
+        self.calendar._service_initialized = True
+        self.calendar.sync_interval = 0
+
+        async def execute(request):
+            return request
+
+        self.calendar._execute = execute
+
+    async def test_initial_sync_is_bounded_and_later_syncs_are_incremental(self):
+        await self.calendar.get_events_for_briefing("u1")
+        await self.calendar.get_events_for_briefing("u1")
+
+        first, second = self.api.calls
+        time_max = datetime.fromisoformat(first["timeMax"])
+        self.assertLessEqual(time_max - datetime.now(timezone.utc), self.calendar.sync_horizon)
+        self.assertGreater(time_max - datetime.now(timezone.utc), timedelta(days=7))
+        self.assertEqual(second["syncToken"], "token-1")
+        self.assertNotIn("timeMax", second)
+
+    async def test_range_beyond_synced_window_triggers_full_sync(self):
+        await self.calendar.get_upcoming_events("u1")
+        await self.calendar.get_upcoming_events("u1", days_ahead=30)
+
+        second = self.api.calls[1]
+        self.assertNotIn("syncToken", second)
+        self.assertGreater(
+            datetime.fromisoformat(second["timeMax"]) - datetime.now(timezone.utc), timedelta(days=29)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
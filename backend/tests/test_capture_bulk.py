@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+import httpx
+
+from api import past_mode
+from api.main import app
+from benchmarks.fakes import fake_services, override_dependencies
+
+
+class CaptureBulkTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.services = fake_services()
+        override_dependencies(app, self.services)
+        self.addCleanup(app.dependency_overrides.clear)
+        transport = httpx.ASGITransport(app=app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+
+    async def bulk(self, captures) -> httpx.Response:
+        return await self.client.post("/past/capture/bulk", json={"captures": captures})
+
+    async def test_too_many_captures_is_rejected(self):
+        with mock.patch.object(past_mode, "CAPTURE_BULK_MAX_ITEMS", 2):
+            response = await self.bulk([{"type": "text", "content": str(i)} for i in range(3)])
+
+        self.assertEqual(response.status_code, 413)
+
+    async def test_invalid_items_fail_without_echoing_input(self):
+        secret = "機密のメモ"
+        response = await self.bulk([
+            {"type": "text", "content": "一件目"},
+            {"type": "text", "content": 123, "metadata": secret},
+            "not an object",
+            {"type": "text", "content": "四件目"},
+        ])
+
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((body["created_count"], body["failed_count"]), (2, 2))
+        self.assertEqual([bool(result["id"]) for result in body["results"]], [True, False, False, True])
+        self.assertIn("content", body["results"][1]["error"])
+        self.assertNotIn(secret, body["results"][1]["error"])
+        self.assertNotIn("not an object", body["results"][2]["error"])
+
+    async def test_enqueue_failure_still_returns_created_captures(self):
+        async def unavailable(items):
+            raise RuntimeError("queue unavailable")
+
+        self.services.work_queue.enqueue_many = unavailable
+        with self.assertLogs("api.past_mode", level="WARNING") as logs:
+            response = await self.bulk([
+                {"type": "text", "content": "一件目"},
+                {"type": "text"},
+                {"type": "text", "content": "三件目"},
+            ])
+
+        self.assertEqual(response.json()["created_count"], 2)
+        self.assertIn("Failed to enqueue 2 bulk captures", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime
+
+import httpx
+
+from api.main import app
+from benchmarks.fakes import fake_services, override_dependencies
+
+
+class DigestConditionalGetTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        services = fake_services()
+        self.firestore = services.firestore_service
+        override_dependencies(app, services)
+        self.addCleanup(app.dependency_overrides.clear)
+        transport = httpx.ASGITransport(app=app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.addAsyncCleanup(self.client.aclose)
+        await self.add_processed("最初のメモ")
+
+    async def add_processed(self, content: str):
+        capture_id = await self.firestore.save_capture({
+            "user_id": "bench-user", "type": "text", "content": content,
+            "timestamp": datetime.now(), "processed": False,
+        })
+        await self.firestore.update_capture_summary("bench-user", capture_id, f"{content}の要約")
+        await self.firestore.refresh_digest("bench-user")
+
+    async def digest(self, **headers) -> httpx.Response:
+        return await self.client.get("/past/digest", headers=headers)
+
+    async def test_unchanged_digest_returns_304(self):
+        first = await self.digest()
+        etag = first.headers["etag"]
+
+        again = await self.digest(**{"If-None-Match": etag})
+        weak = await self.digest(**{"If-None-Match": f'"other", W/{etag}'})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.json()["captures"]), 1)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+        self.assertEqual(again.headers["etag"], etag)
+        self.assertEqual(weak.status_code, 304)
+
+    async def test_changed_digest_returns_new_body(self):
+        etag = (await self.digest()).headers["etag"]
+        await self.add_processed("次のメモ")
+
+        response = await self.digest(**{"If-None-Match": etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertEqual(len(response.json()["captures"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
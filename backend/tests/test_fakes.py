@@ -0,0 +1,65 @@
+import inspect
+import re
+import unittest
+from importlib.metadata import version
+
+from google.cloud import firestore
+from google.cloud.firestore_v1 import async_transaction
+
+from benchmarks.fakes import FakeFirestoreClient, FakeTransaction
+
+
+class FakeTransactionProtocolTest(unittest.IsolatedAsyncioTestCase):
+    """FakeTransactionはasync_transactionalの非公開のプロトコルに依存するため、SDKの更新で壊れたら知らせる"""
+
+    def setUp(self):
+        self.client = FakeFirestoreClient()
+        self.ref = self.client.collection("counters").document("c1")
+
+    def test_fake_implements_every_private_member_the_sdk_uses(self):
+        source = inspect.getsource(async_transaction._AsyncTransactional)
+        used = set(re.findall(r"transaction\.(_\w+)", source))
+        missing = {name for name in used if not hasattr(FakeTransaction(self.client), name)}
+
+        self.assertTrue(used, "async_transactional no longer calls the transaction's private methods")
+        self.assertFalse(
+            missing,
+            f"google-cloud-firestore {version('google-cloud-firestore')} uses {sorted(missing)} "
+            "on the transaction; update FakeTransaction in benchmarks/fakes.py",
+        )
+
+    async def test_conflicting_write_is_retried(self):
+        await self.ref.set({"value": 0})
+        attempts = []
+
+        @firestore.async_transactional
+        async def increment(transaction):
+            snapshot = await self.ref.get(transaction=transaction)
+            attempts.append(snapshot.get("value"))
+            if len(attempts) == 1:
+                # 読み取りからコミットまでの間に他から書き込まれる
+                await self.ref.set({"value": 10})
+            transaction.set(self.ref, {"value": snapshot.get("value") + 1})
+
+        await increment(self.client.transaction())
+
+        self.assertEqual(attempts, [0, 10])
+        self.assertEqual((await self.ref.get()).get("value"), 11)
+
+    async def test_exhausted_attempts_raise(self):
+        await self.ref.set({"value": 0})
+
+        @firestore.async_transactional
+        async def always_conflicts(transaction):
+            snapshot = await self.ref.get(transaction=transaction)
+            await self.ref.set({"value": snapshot.get("value") + 1})
+            transaction.set(self.ref, {"value": -1})
+
+        with self.assertRaises(ValueError):
+            await always_conflicts(self.client.transaction(max_attempts=3))
+
+        self.assertEqual((await self.ref.get()).get("value"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+from google.api_core import exceptions as google_exceptions
+
+from benchmarks.fakes import fake_services
+from services.gemini_service import PARTIAL_SUMMARY_NOTE, GeminiServiceError
+
+
+class EditablePageFetcher:
+    """クエリを除いたURLでpagesを引いて返す（テストからページを書き換えられる）"""
+
+    def __init__(self):
+        self.pages = {}
+        self.fetches = 0
+
+    async def fetch(self, url):
+        self.fetches += 1
+        return self.pages[url.split("?")[0]], "text/plain"
+
+
+class SummarizeUrlCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gemini = fake_services().gemini_service
+        self.fetcher = EditablePageFetcher()
+        self.gemini.page_fetcher = self.fetcher
+        self.url = "https://example.com/article"
+        self.fetcher.pages[self.url] = "最初の本文。"
+
+    async def test_recent_url_is_served_without_fetching(self):
+        first = await self.gemini.summarize_url(self.url)
+        cached = await self.gemini.summarize_url(self.url + "?utm_source=mail")
+
+        self.assertEqual(cached, first)
+        self.assertEqual(self.fetcher.fetches, 1)
+        self.assertEqual(self.gemini.model.faults.calls, 1)
+
+    async def test_edited_page_is_summarized_again_after_url_ttl(self):
+        self.gemini.summary_cache.url_ttl = 0.05
+
+        first = await self.gemini.summarize_url(self.url)
+        await asyncio.sleep(0.1)
+        unchanged = await self.gemini.summarize_url(self.url)
+        self.fetcher.pages[self.url] = "書き換えた本文。"
+        await asyncio.sleep(0.1)
+        edited = await self.gemini.summarize_url(self.url)
+
+        self.assertEqual(unchanged, first)
+        self.assertNotEqual(edited, first)
+        self.assertEqual(self.fetcher.fetches, 3)
+        self.assertEqual(self.gemini.model.faults.calls, 2)
+
+
+class SummarizeTextsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_whole_call_failure_is_wrapped_like_summarize_text(self):
+        services = fake_services()
+        gemini = services.gemini_service
+        gemini.rate_limiter.max_retries = 1
+
+        async def exhausted(prompt, stream=False):
+            raise google_exceptions.ResourceExhausted("quota")
+
+        gemini.model.generate_content_async = exhausted
+
+        with self.assertRaises(GeminiServiceError):
+            await gemini.summarize_texts(["A", "B"])
+        with self.assertRaises(GeminiServiceError):
+            await gemini.summarize_text("A")
+
+
+
+class SummarizeLongTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.gemini = fake_services().gemini_service
+        self.gemini.chunk_tokens = 200
+        self.gemini.max_chunks = 100
+        # 段落ごとに内容が異なる長文（1段落およそ60トークン）
+        self.text = "\n\n".join(f"段落{i}の本文です。" * 6 for i in range(60))
+
+    async def test_short_text_is_not_marked_partial(self):
+        summary = await self.gemini.summarize_text("短い本文です。")
+
+        self.assertFalse(summary.startswith(PARTIAL_SUMMARY_NOTE))
+
+    async def test_truncated_input_is_marked_partial(self):
+        self.gemini.max_chunks = 2
+
+        summary = await self.gemini.summarize_text(self.text)
+
+        self.assertTrue(summary.startswith(PARTIAL_SUMMARY_NOTE))
+
+    async def test_reduce_stops_when_partials_do_not_shrink(self):
+        rounds = []
+
+        async def verbose_chunks(chunks):
+            # 部分要約が元のチャンクより縮まないモデル
+            rounds.append(len(chunks))
+            return [chunk + "補足。" for chunk in chunks]
+
+        self.gemini._summarize_chunks = verbose_chunks
+
+        summary = await self.gemini.summarize_text(self.text)
+
+        # map 1回 + 縮まないと分かったreduce 1回で打ち切る
+        self.assertEqual(len(rounds), 2)
+        self.assertTrue(summary.startswith(PARTIAL_SUMMARY_NOTE))
+
+    async def test_reduce_rounds_are_capped(self):
+        rounds = []
+
+        async def slowly_shrinking_chunks(chunks):
+            # 部分要約が少しずつしか縮まないモデル
+            rounds.append(len(chunks))
+            return [chunk[: len(chunk) * 9 // 10] for chunk in chunks]
+
+        self.gemini._summarize_chunks = slowly_shrinking_chunks
+        self.gemini.max_reduce_rounds = 2
+
+        summary = await self.gemini.summarize_text(self.text)
+
+        self.assertEqual(len(rounds), 1 + 2)
+        self.assertTrue(summary.startswith(PARTIAL_SUMMARY_NOTE))
+
+
+if __name__ == "__main__":
+    unittest.main()
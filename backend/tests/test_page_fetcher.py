@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+import httpx
+
+from services.page_fetcher import PageFetcher, UnsupportedContentError
+
+
+class PageFetcherTest(unittest.IsolatedAsyncioTestCase):
+    def fetcher(self, handler, **kwargs) -> PageFetcher:
+        fetcher = PageFetcher(**kwargs)
+        fetcher.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        self.addAsyncCleanup(fetcher.aclose)
+        return fetcher
+
+    async def test_body_is_cut_at_max_bytes(self):
+        fetcher = self.fetcher(
+            lambda request: httpx.Response(200, content=b"a" * 5000, headers={"content-type": "text/html"}),
+            max_bytes=1000,
+        )
+
+        body, content_type = await fetcher.fetch("https://example.com/")
+
+        self.assertEqual(len(body), 1000)
+        self.assertEqual(content_type, "text/html")
+
+    async def test_unsupported_content_type_is_rejected(self):
+        fetcher = self.fetcher(
+            lambda request: httpx.Response(200, content=b"%PDF", headers={"content-type": "application/pdf"})
+        )
+
+        with self.assertRaises(UnsupportedContentError):
+            await fetcher.fetch("https://example.com/file.pdf")
+
+    async def test_busy_host_does_not_block_other_hosts(self):
+        slow_host = asyncio.Event()
+
+        async def handler(request):
+            if request.url.host == "slow.example":
+                await slow_host.wait()
+            return httpx.Response(200, text="ok", headers={"content-type": "text/plain"})
+
+        fetcher = self.fetcher(handler, concurrency=2, per_host_concurrency=1)
+        slow = [asyncio.create_task(fetcher.fetch(f"https://slow.example/{index}")) for index in range(4)]
+        await asyncio.sleep(0)
+
+        body, _ = await asyncio.wait_for(fetcher.fetch("https://fast.example/"), timeout=1)
+        slow_host.set()
+        await asyncio.gather(*slow)
+
+        self.assertEqual(body, "ok")
+
+    async def test_host_semaphores_are_dropped_when_unused(self):
+        fetcher = self.fetcher(lambda request: httpx.Response(200, text="ok", headers={"content-type": "text/plain"}))
+
+        await asyncio.gather(*(fetcher.fetch(f"https://host{index}.example/") for index in range(5)))
+
+        self.assertEqual(fetcher._host_semaphores, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import time
+import unittest
+
+from google.api_core import exceptions as google_exceptions
+
+from services.rate_limiter import AdaptiveConcurrency, GeminiRateLimiter, RateLimitExceeded, TokenBucket
+
+
+def limiter(**kwargs) -> GeminiRateLimiter:
+    options = dict(
+        requests_per_minute=1e9, tokens_per_minute=1e12, max_concurrency=8, base_delay=0.001, max_delay=0.01
+    )
+    return GeminiRateLimiter(**{**options, **kwargs})
+
+
+class AdaptiveConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+    async def test_success_increases_and_throttling_halves_the_limit(self):
+        concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=8)
+
+        await concurrency.acquire()
+        await concurrency.release(succeeded=True)
+        self.assertAlmostEqual(concurrency.limit, 4.25)
+
+        await concurrency.acquire()
+        await concurrency.release(throttled=True)
+        self.assertAlmostEqual(concurrency.limit, 2.125)
+
+    async def test_other_failures_leave_the_limit_unchanged(self):
+        concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=8)
+
+        await concurrency.acquire()
+        await concurrency.release()
+
+        self.assertEqual(concurrency.limit, 4)
+        self.assertEqual(concurrency.in_flight, 0)
+
+
+class GeminiRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_transient_errors_are_retried(self):
+        rate_limiter = limiter()
+        attempts = []
+
+        async def request():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise google_exceptions.ResourceExhausted("quota")
+            return "ok"
+
+        self.assertEqual(await rate_limiter.call(request, estimated_tokens=10), "ok")
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(rate_limiter.retry_count, 2)
+        self.assertEqual(rate_limiter.throttled_count, 2)
+
+    async def test_gives_up_after_max_retries(self):
+        rate_limiter = limiter(max_retries=2)
+
+        async def request():
+            raise google_exceptions.ServiceUnavailable("down")
+
+        with self.assertRaises(RateLimitExceeded):
+            await rate_limiter.call(request, estimated_tokens=10)
+        self.assertEqual(rate_limiter.retry_count, 2)
+
+    async def test_non_transient_errors_are_not_retried_or_counted_as_success(self):
+        rate_limiter = limiter()
+        limit = rate_limiter.concurrency.limit
+
+        async def request():
+            raise ValueError("bad request")
+
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                await rate_limiter.call(request, estimated_tokens=10)
+
+        self.assertEqual(rate_limiter.retry_count, 0)
+        self.assertEqual(rate_limiter.concurrency.limit, limit)
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waiters_pass_in_reservation_order(self):
+        # 1秒あたり60の補充で、満杯の60を使い切った後に6ずつ要求する
+        bucket = TokenBucket(per_minute=3600)
+        await bucket.acquire(3600)
+        finished = {}
+
+        async def acquire(name):
+            await bucket.acquire(6)
+            finished[name] = time.monotonic()
+
+        started = time.monotonic()
+        await asyncio.gather(acquire("first"), acquire("second"))
+
+        # 1件目は0.1秒、2件目は1件目の予約分を含めて0.2秒で通る
+        self.assertAlmostEqual(finished["first"] - started, 0.1, delta=0.05)
+        self.assertAlmostEqual(finished["second"] - started, 0.2, delta=0.05)
+
+    async def test_cancelled_waiter_returns_its_reservation(self):
+        bucket = TokenBucket(per_minute=60)
+        await bucket.acquire(60)
+        waiter = asyncio.create_task(bucket.acquire(30))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        self.assertGreater(bucket.available, -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
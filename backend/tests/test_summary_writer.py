@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+from datetime import datetime
+
+from benchmarks.fakes import fake_services
+from services.summary_writer import SummaryWriter
+
+
+class SummaryWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.firestore = fake_services().firestore_service
+        self.captures = []
+        for i in range(5):
+            capture_id = await self.firestore.save_capture({
+                "user_id": "u1", "type": "text", "content": f"メモ{i}", "timestamp": datetime.now(), "processed": False,
+            })
+            self.captures.append(("u1", capture_id))
+
+    async def summary(self, capture_id: str):
+        capture = await self.firestore.get_capture("u1", capture_id)
+        return capture.get("summary") if capture["processed"] else None
+
+    async def test_writes_are_committed_in_batches(self):
+        async with SummaryWriter(self.firestore, batch_size=2, flush_interval=60) as writer:
+            for user_id, capture_id in self.captures:
+                await writer.add(user_id, capture_id, f"要約 {capture_id}")
+            # バッチサイズに達した分だけがコミット済み
+            self.assertEqual(writer.commit_count, 2)
+
+        self.assertEqual(writer.report()["written_count"], 5)
+        self.assertEqual(writer.commit_count, 3)
+        self.assertEqual(len(writer.take_written()), 5)
+        self.assertEqual(writer.take_written(), [])
+        for _, capture_id in self.captures:
+            self.assertEqual(await self.summary(capture_id), f"要約 {capture_id}")
+
+    async def test_pending_writes_are_flushed_after_interval(self):
+        async with SummaryWriter(self.firestore, batch_size=100, flush_interval=0.05) as writer:
+            await writer.add("u1", self.captures[0][1], "要約")
+            await asyncio.sleep(0.2)
+
+            self.assertEqual(writer.commit_count, 1)
+            self.assertEqual(await self.summary(self.captures[0][1]), "要約")
+
+    async def test_failed_batch_is_retried_per_document(self):
+        async with SummaryWriter(self.firestore, batch_size=100, flush_interval=60) as writer:
+            await writer.add("u1", self.captures[0][1], "要約")
+            await writer.add("u1", "deleted-capture", "要約")
+            await writer.add("u1", self.captures[1][1], "要約")
+
+        report = writer.report()
+        self.assertEqual(report["written_count"], 2)
+        self.assertEqual(report["write_failed_count"], 1)
+        self.assertEqual(report["write_failures"][0]["capture_id"], "deleted-capture")
+        self.assertEqual(await self.summary(self.captures[1][1]), "要約")
+
+
+if __name__ == "__main__":
+    unittest.main()
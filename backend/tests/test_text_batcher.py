@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from services.gemini_service import GeminiServiceError
+from services.text_batcher import TextSummaryBatcher
+
+
+class StubGemini:
+    """summarize_textsの結果を指定でき、個別要約の呼び出しを記録する"""
+
+    def __init__(self, batch_result):
+        self.batch_result = batch_result
+        self.individual = []
+
+    async def summarize_texts(self, texts):
+        if isinstance(self.batch_result, Exception):
+            raise self.batch_result
+        return self.batch_result[:len(texts)]
+
+    async def summarize_text(self, text):
+        self.individual.append(text)
+        return f"個別: {text}"
+
+
+class TextSummaryBatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def test_missing_items_fall_back_individually(self):
+        gemini = StubGemini(["要約A", None])
+        batcher = TextSummaryBatcher(gemini, max_items=2)
+
+        summaries = await asyncio.gather(batcher.summarize("A"), batcher.summarize("B"))
+
+        self.assertEqual(summaries, ["要約A", "個別: B"])
+        self.assertEqual(gemini.individual, ["B"])
+
+    async def test_whole_call_failure_is_raised_without_fallback(self):
+        gemini = StubGemini(GeminiServiceError("quota"))
+        batcher = TextSummaryBatcher(gemini, max_items=2)
+
+        results = await asyncio.gather(batcher.summarize("A"), batcher.summarize("B"), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, GeminiServiceError) for result in results))
+        self.assertEqual(gemini.individual, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from services.text_chunker import chunk_text
+from services.token_estimator import estimate_tokens
+
+
+def document(paragraphs: int) -> str:
+    return "\n\n".join(f"段落{i}の本文です。内容は段落ごとに異なります。" * 3 for i in range(paragraphs))
+
+
+class ChunkTextTest(unittest.TestCase):
+    def test_short_and_empty_text(self):
+        self.assertEqual(chunk_text("短い本文。", 100), ["短い本文。"])
+        self.assertEqual(chunk_text("  \n\n ", 100), [])
+
+    def test_chunks_fit_and_keep_every_paragraph(self):
+        text = document(80)
+
+        chunks = chunk_text(text, 200)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 200)
+        self.assertEqual("\n\n".join(chunks), text)
+
+    def test_oversized_sentence_is_cut_to_fit(self):
+        text = "あ" * 1000
+
+        chunks = chunk_text(text, 100)
+
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 100)
+        self.assertEqual("".join("".join(chunk.split()) for chunk in chunks), text)
+
+    def test_edit_keeps_distant_chunks(self):
+        text = document(80)
+        paragraphs = text.split("\n\n")
+        paragraphs[40] = "書き換えた段落です。" * 3
+        edited = "\n\n".join(paragraphs)
+
+        before = chunk_text(text, 200)
+        after = chunk_text(edited, 200)
+
+        # 編集箇所を含むチャンク以外は同じ内容のまま残る
+        self.assertEqual(before[0], after[0])
+        self.assertEqual(before[-1], after[-1])
+        self.assertGreaterEqual(len(set(before) & set(after)), len(before) - 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
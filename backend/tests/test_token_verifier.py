@@ -0,0 +1,76 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+
+from api import auth
+from api.main import app
+from api.token_verifier import FirebaseTokenVerifier
+
+
+class TokenCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.verifier = FirebaseTokenVerifier(max_ttl=60, check_revoked=False)
+        self.addAsyncCleanup(self.verifier.aclose)
+        # 公開鍵での検証ではなく、SDKでの検証（下で差し替える）を使う
+        self.verifier.project_id = None
+        self.verified = []
+        self.expires_in = 3600
+
+        def verify_with_sdk(token):
+            self.verified.append(token)
+            uid = token.split(":")[0]
+            return {"uid": uid, "exp": time.time() + self.expires_in}
+
+        self.verifier._verify_with_sdk = verify_with_sdk
+
+    async def test_verified_token_is_cached_until_ttl(self):
+        self.verifier.max_ttl = 0.05
+
+        await self.verifier.verify("u1:a")
+        await self.verifier.verify("u1:a")
+        await asyncio.sleep(0.1)
+        await self.verifier.verify("u1:a")
+
+        self.assertEqual(len(self.verified), 2)
+        self.assertEqual(self.verifier.stats()["hits"], 1)
+
+    async def test_cache_never_outlives_token_expiry(self):
+        self.expires_in = 0.05
+
+        await self.verifier.verify("u1:a")
+        await asyncio.sleep(0.1)
+        await self.verifier.verify("u1:a")
+
+        self.assertEqual(len(self.verified), 2)
+
+    async def test_invalidate_user_drops_only_that_users_tokens(self):
+        for token in ("u1:a", "u1:b", "u2:a"):
+            await self.verifier.verify(token)
+
+        self.verifier.invalidate_user("u1")
+
+        self.assertEqual(self.verifier.stats()["entries"], 1)
+        await self.verifier.verify("u2:a")
+        await self.verifier.verify("u1:a")
+        self.assertEqual(self.verified[3:], ["u1:a"])
+
+    async def test_logout_revokes_and_invalidates(self):
+        revoked = []
+        app.state.token_verifier = self.verifier
+        self.addCleanup(delattr, app.state, "token_verifier")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            with mock.patch.object(auth, "firebase_auth", lambda: SimpleNamespace(revoke_refresh_tokens=revoked.append)):
+                response = await client.post("/auth/logout", headers={"Authorization": "Bearer u1:a"})
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(revoked, ["u1"])
+        self.assertEqual(self.verifier.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
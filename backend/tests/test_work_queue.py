@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from api.metrics import ServiceStatsCollector
+from benchmarks.fakes import fake_services
+from services.batch_processor import BatchProcessor
+from services.work_queue import DEAD, LEASED, CaptureQueueWorker, CaptureWorkQueue
+
+
+class ClaimTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.services = fake_services()
+        self.queue = CaptureWorkQueue(self.services.firestore_service, max_attempts=2)
+
+    async def expire_lease(self, capture_id):
+        await self.queue._ref(capture_id).update({"available_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+
+    async def test_expired_lease_is_reclaimed_until_max_attempts(self):
+        await self.queue.enqueue("u1", "c1")
+
+        first = await self.queue.claim("worker-1", 10)
+        await self.expire_lease("c1")
+        second = await self.queue.claim("worker-2", 10)
+        await self.expire_lease("c1")
+        third = await self.queue.claim("worker-3", 10)
+
+        self.assertEqual([item["attempts"] for item in first + second], [1, 2])
+        self.assertEqual(second[0]["status"], LEASED)
+        self.assertEqual(third, [])
+        item = (await self.queue._ref("c1").get()).to_dict()
+        self.assertEqual(item["status"], DEAD)
+        self.assertEqual(item["attempts"], 2)
+
+
+class QueueStatsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_counts_are_refreshed_and_exported(self):
+        queue = CaptureWorkQueue(fake_services().firestore_service)
+        queue.stats_interval = 0.02
+        await queue.enqueue_many([("u1", f"c{i}") for i in range(4)])
+        await queue.claim("worker-1", 1)
+        await queue._ref("c3").update({"status": DEAD})
+        self.assertEqual(queue.stats(), {})
+
+        await queue.start()
+        self.addAsyncCleanup(queue.aclose)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(queue.stats(), {"depth": 3, "pending": 2, "leased": 1, "dead": 1})
+        collector = ServiceStatsCollector(SimpleNamespace(state=SimpleNamespace(work_queue=queue)))
+        metrics = {metric.name: metric.samples[0].value for metric in collector.collect()}
+        self.assertEqual(metrics["janus_capture_queue_depth"], 3)
+        self.assertEqual(metrics["janus_capture_queue_dead"], 1)
+
+
+class RecordingBatchProcessor(BatchProcessor):
+    """after_writeに渡された要約を記録する"""
+
+    def __init__(self, services):
+        super().__init__(services.firestore_service, services.gemini_service)
+        self.flushes = []
+
+    async def after_write(self, written):
+        self.flushes.append(list(written))
+
+
+class QueueWorkerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_processes_all_items_and_flushes_written_summaries_together(self):
+        services = fake_services()
+        captures = [
+            {"user_id": f"u{index % 3}", "type": "text", "content": f"メモ {index}"}
+            for index in range(30)
+        ]
+        items = [(capture["user_id"], await services.firestore_service.save_capture(capture)) for capture in captures]
+        await services.work_queue.enqueue_many(items)
+        processor = RecordingBatchProcessor(services)
+        worker = CaptureQueueWorker(services.work_queue, processor, concurrency=4, flush_size=1000)
+
+        result = await worker.run(max_seconds=60)
+
+        self.assertEqual(result["processed_count"], 30)
+        self.assertEqual(len(processor.flushes), 1)
+        self.assertEqual(sorted(capture_id for _, capture_id, _ in processor.flushes[0]), sorted(i for _, i in items))
+        self.assertEqual(await services.work_queue.claim("other", 10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -62,6 +62,34 @@ gcloud iam service-accounts keys create ../backend/gcp-service-account.json \
 echo "7. Creating Firestore database..."
 gcloud firestore databases create --region=$REGION
 
+# バッチ処理用の複合インデックス作成（全ユーザー横断のcollection groupクエリ）
+echo "8. Creating Firestore indexes..."
+gcloud firestore indexes composite create \
+    --collection-group=captures \
+    --query-scope=COLLECTION_GROUP \
+    --field-config=field-path=processed,order=ascending \
+    --field-config=field-path=timestamp,order=ascending
+
+# シャード分割したバッチ処理のシャード単位クエリ用インデックス
+gcloud firestore indexes composite create \
+    --collection-group=captures \
+    --query-scope=COLLECTION_GROUP \
+    --field-config=field-path=processed,order=ascending \
+    --field-config=field-path=shard,order=ascending \
+    --field-config=field-path=timestamp,order=ascending
+
+# キャプチャ処理キューの取得クエリ用インデックス
+gcloud firestore indexes composite create \
+    --collection-group=capture_queue \
+    --query-scope=COLLECTION \
+    --field-config=field-path=status,order=ascending \
+    --field-config=field-path=available_at,order=ascending
+
+# 要約キャッシュの期限切れドキュメントを自動削除するTTLポリシー
+gcloud firestore fields ttls update expires_at \
+    --collection-group=summary_cache \
+    --enable-ttl
+
 echo "=== Setup Complete ==="
 echo "Project ID: $PROJECT_ID"
 echo "Service Account: $SERVICE_ACCOUNT_NAME@$PROJECT_ID.iam.gserviceaccount.com"